@@ -0,0 +1,141 @@
+import os
+import json
+import atexit
+import time
+import sqlite3
+import threading
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ACCESS_LOG_PATH = os.getenv("ACCESS_LOG_PATH", "access_log.db")
+FLUSH_THRESHOLD = 256  # Batch counter updates so requests don't each write to SQLite
+MAX_ROWS = int(os.getenv("ACCESS_LOG_MAX_ROWS", 100000))
+MIN_HITS = 0.5  # Keys that decay below this are forgotten
+BUSY_TIMEOUT_MS = 5000  # How long SQLite waits for another worker's write
+
+
+class AccessLog:
+    """
+    Persistent popularity counters for cache keys, surviving restarts.
+
+    Every request for a TTS rendition or transcript is counted under its cache key
+    whether it was a memory hit, a disk hit or a miss, so the log reflects demand
+    rather than what happened to be cached. An optional JSON payload keeps what is
+    needed to rebuild the entry (e.g. the text, voice and speed of a TTS request).
+    Counts decay over time so popularity follows recent traffic. Every worker shares
+    the file, so upkeep that must run once per host is coordinated with try_lease().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}  # (namespace, key) -> (last_access, hits, payload)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS accesses (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                hits REAL NOT NULL,
+                last_access REAL NOT NULL,
+                payload TEXT,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS accesses_hits ON accesses(namespace, hits)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    def record(self, namespace, key, payload=None):
+        """Count one access to key; payload (a JSON-serializable dict) replaces any stored one."""
+        with self._lock:
+            _, hits, old_payload = self._pending.get((namespace, key), (0, 0, None))
+            self._pending[(namespace, key)] = (time.time(), hits + 1, payload if payload is not None else old_payload)
+            if len(self._pending) >= FLUSH_THRESHOLD:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def hottest(self, namespace, limit):
+        """Return up to limit (key, hits, payload dict or None) tuples, most popular first."""
+        with self._lock:
+            self._flush()
+            rows = self._db.execute(
+                "SELECT key, hits, payload FROM accesses WHERE namespace = ? ORDER BY hits DESC LIMIT ?",
+                (namespace, limit)
+            ).fetchall()
+        return [(key, hits, json.loads(payload) if payload else None) for key, hits, payload in rows]
+
+    def decay(self, factor):
+        """Multiply every count by factor, forget keys that fell below MIN_HITS and cap the table size."""
+        with self._lock:
+            self._flush()
+            self._db.execute("UPDATE accesses SET hits = hits * ?", (factor,))
+            self._db.execute("DELETE FROM accesses WHERE hits < ?", (MIN_HITS,))
+            self._db.execute(
+                "DELETE FROM accesses WHERE rowid IN "
+                "(SELECT rowid FROM accesses ORDER BY hits DESC LIMIT -1 OFFSET ?)", (MAX_ROWS,)
+            )
+            self._db.commit()
+
+    def try_lease(self, name, holder, seconds):
+        """
+        Take or renew the named lease for seconds if it is free, expired or already ours.
+
+        Returns:
+            bool: Whether holder now holds the lease.
+        """
+        now = time.time()
+        with self._lock:
+            # A single upsert, so two workers can never both acquire an expired lease
+            cursor = self._db.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at < ? OR leases.holder = excluded.holder",
+                (name, holder, now + seconds, now)
+            )
+            self._db.commit()
+            return cursor.rowcount > 0
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT namespace, COUNT(*) FROM accesses GROUP BY namespace").fetchall()
+            return {"keys": dict(rows), "pending": len(self._pending)}
+
+    def _flush(self):
+        # Caller must hold the lock
+        if not self._pending:
+            return
+        self._db.executemany(
+            "INSERT INTO accesses (namespace, key, hits, last_access, payload) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(namespace, key) DO UPDATE SET hits = hits + excluded.hits, "
+            "last_access = excluded.last_access, payload = COALESCE(excluded.payload, payload)",
+            [(namespace, key, hits, last_access, json.dumps(payload) if payload is not None else None)
+             for (namespace, key), (last_access, hits, payload) in self._pending.items()]
+        )
+        self._db.commit()
+        self._pending.clear()
+
+
+access_log = AccessLog(ACCESS_LOG_PATH)
+atexit.register(access_log.flush)
+
+
+def record_access(namespace, key, payload=None):
+    """Count an access in the shared log; failures never affect the request."""
+    try:
+        access_log.record(namespace, key, payload)
+    except Exception as e:
+        logger.warning(f"Could not record cache access: {str(e)}")
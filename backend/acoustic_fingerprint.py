@@ -0,0 +1,127 @@
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+from audio_format import resample
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Analysis parameters: 64 ms frames every 32 ms at 8 kHz, 17 log-spaced bands over the speech range
+ANALYSIS_RATE = 8000
+FRAME_SIZE = 512
+HOP_SIZE = 256
+BAND_EDGES_HZ = np.geomspace(300, 3000, 18)
+MIN_FRAMES = 32  # About one second of audio; shorter clips are not matched acoustically
+
+MAX_BIT_ERROR_RATE = 0.3  # Re-encoded copies land well below this; unrelated clips sit near 0.5
+MIN_OVERLAP = 0.8  # Fraction of the shorter clip that must align
+
+
+def acoustic_fingerprint(samples, rate):
+    """
+    Compute a compact fingerprint of what a clip sounds like, not how it is encoded.
+
+    Each 32 ms hop yields a 16-bit word: bit m is the sign of the change over time of
+    the energy difference between bands m and m+1. Signs of energy differences survive
+    re-encoding, resampling and gain changes.
+
+    Args:
+        samples (numpy.ndarray): Decoded audio of shape (frames, channels).
+        rate (int): Sample rate of samples.
+
+    Returns:
+        numpy.ndarray or None: uint32 sub-fingerprints, one per hop, or None if the clip
+        is too short.
+    """
+    mono = resample(samples.mean(axis=1, keepdims=True), rate, ANALYSIS_RATE)[:, 0]
+    if len(mono) < FRAME_SIZE + HOP_SIZE * MIN_FRAMES:
+        return None
+
+    frames = np.lib.stride_tricks.sliding_window_view(mono, FRAME_SIZE)[::HOP_SIZE] * np.hanning(FRAME_SIZE)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    edges = np.round(BAND_EDGES_HZ * FRAME_SIZE / ANALYSIS_RATE).astype(int)
+    bands = np.add.reduceat(power, edges, axis=1)[:, :-1]
+
+    band_diff = bands[:, :-1] - bands[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    weights = (1 << np.arange(bits.shape[1], dtype=np.uint32))
+    return (bits * weights).sum(axis=1).astype(np.uint32)
+
+
+def bit_error_rate(a, b):
+    """Fraction of differing bits between two equally long sub-fingerprint arrays."""
+    differing = np.unpackbits((a ^ b).view(np.uint8)).sum()
+    return differing / (len(a) * (len(BAND_EDGES_HZ) - 2))
+
+
+class FingerprintIndex:
+    """
+    Bounded in-memory index from acoustic fingerprints to transcript cache keys.
+
+    Candidates come from an inverted index of exact sub-fingerprint matches, voted by
+    alignment offset, so trimmed copies are found without comparing against every
+    entry. The best candidate is confirmed with the bit error rate over the overlap.
+    """
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> fingerprint
+        self._postings = {}  # sub-fingerprint -> {key: [positions]}
+        self.matches = 0
+        self.misses = 0
+
+    def add(self, key, fingerprint):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = fingerprint
+            for position, word in enumerate(fingerprint.tolist()):
+                if word:  # All-zero words come from digital silence and match everything
+                    self._postings.setdefault(word, {}).setdefault(key, []).append(position)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def match(self, fingerprint):
+        """Return the cache key of a clip that sounds the same as fingerprint, or None."""
+        with self._lock:
+            votes = {}
+            for position, word in enumerate(fingerprint.tolist()):
+                if not word:
+                    continue
+                for key, positions in self._postings.get(word, {}).items():
+                    for entry_position in positions:
+                        candidate = (key, position - entry_position)
+                        votes[candidate] = votes.get(candidate, 0) + 1
+            best = sorted(votes.items(), key=lambda item: item[1], reverse=True)[:5]
+            for (key, offset), _ in best:
+                stored = self._entries[key]
+                start = max(0, offset)
+                overlap = min(len(fingerprint) - start, len(stored) + offset - start)
+                if overlap < MIN_OVERLAP * min(len(fingerprint), len(stored)) or overlap < MIN_FRAMES:
+                    continue
+                error = bit_error_rate(fingerprint[start:start + overlap],
+                                       stored[start - offset:start - offset + overlap])
+                if error <= MAX_BIT_ERROR_RATE:
+                    self._entries.move_to_end(key)
+                    self.matches += 1
+                    logger.debug(f"Acoustic match {key[:8]}... at offset {offset} frames, bit error rate {error:.3f}")
+                    return key
+            self.misses += 1
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "matches": self.matches, "misses": self.misses}
+
+    def _remove(self, key):
+        # Caller must hold the lock
+        fingerprint = self._entries.pop(key)
+        for word in set(fingerprint.tolist()):
+            postings = self._postings.get(word)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[word]
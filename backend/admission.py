@@ -0,0 +1,142 @@
+import os
+import math
+import time
+import threading
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from metrics import observe_stage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.2  # Weight of the newest sample in the service time average
+REJECT_DECAY = 0.9  # Each deadline rejection shrinks the estimate so a stale slow average recovers
+
+
+class Overloaded(Exception):
+    """Raised when a request is rejected by admission control."""
+
+    def __init__(self, message, retry_after, status=503):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.status = status
+
+
+class WorkQueue:
+    """
+    Bounded worker pool for one kind of work, with deadline-aware admission.
+
+    Each queue has its own threads, so a burst of slow TTS jobs cannot starve
+    transcription. A submission is rejected immediately when the queue is full
+    (429) or when the estimated queue wait plus service time would already blow
+    its deadline (503). A job that would start on an idle worker is always
+    admitted, so an estimate inflated by a past slowdown cannot lock the queue
+    shut. Jobs that sat in the queue past their deadline are dropped instead of
+    being run for a client that has given up.
+    """
+
+    def __init__(self, name, workers, max_queue, initial_service_time):
+        """
+        Args:
+            name (str): Queue name for logs and stats.
+            workers (int): Number of worker threads.
+            max_queue (int): Maximum jobs waiting for a worker.
+            initial_service_time (float): Seconds per job assumed until real samples arrive.
+        """
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.service_time = initial_service_time
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected_full = 0
+        self.rejected_deadline = 0
+        self.expired = 0
+
+    def estimated_wait(self):
+        """Seconds a new job would wait for a worker given current depth and service time."""
+        backlog = self.queued + self.running - self.workers + 1
+        return max(0, backlog) * self.service_time / self.workers
+
+    def submit(self, deadline, fn, *args, **kwargs):
+        """
+        Admit and schedule fn(*args, **kwargs).
+
+        Args:
+            deadline (float): Seconds from now by which the result is needed.
+
+        Returns:
+            Future: The job's future.
+
+        Raises:
+            Overloaded: If the job cannot be admitted.
+        """
+        submitted_at = time.time()
+        with self._lock:
+            wait = self.estimated_wait()
+            if self.queued >= self.max_queue:
+                self.rejected_full += 1
+                logger.warning(f"[{self.name}] Queue full ({self.queued} waiting), rejecting")
+                raise Overloaded(f"{self.name} queue is full, please retry shortly", wait + self.service_time, status=429)
+            if wait > 0 and wait + self.service_time > deadline:
+                self.rejected_deadline += 1
+                logger.warning(f"[{self.name}] Estimated {wait:.1f}s wait + {self.service_time:.1f}s service exceeds {deadline}s deadline, rejecting")
+                # Rejected jobs never report a service time, so decay the estimate here
+                self.service_time *= REJECT_DECAY
+                raise Overloaded(f"{self.name} is overloaded, please retry shortly", wait, status=503)
+            self.queued += 1
+
+        def run():
+            started_at = time.time()
+            waited = started_at - submitted_at
+            observe_stage("queue_wait", waited, "expired" if waited > deadline else "started")
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                if waited > deadline:
+                    with self._lock:
+                        self.expired += 1
+                    raise Overloaded(f"{self.name} request expired in queue", self.service_time)
+                result = fn(*args, **kwargs)
+                with self._lock:
+                    elapsed = time.time() - started_at
+                    self.service_time = (1 - EWMA_ALPHA) * self.service_time + EWMA_ALPHA * elapsed
+                    self.completed += 1
+                return result
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        # Run in a copy of the caller's context so stage metrics keep the request's route label
+        return self._executor.submit(contextvars.copy_context().run, run)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "avg_service_seconds": round(self.service_time, 3),
+                "estimated_wait_seconds": round(self.estimated_wait(), 3),
+                "rejected_full": self.rejected_full,
+                "rejected_deadline": self.rejected_deadline,
+                "expired_in_queue": self.expired,
+            }
+
+
+def queue_from_env(name, workers, max_queue, initial_service_time):
+    """Build a WorkQueue whose sizes can be overridden with <NAME>_WORKERS / <NAME>_MAX_QUEUE."""
+    prefix = name.upper()
+    return WorkQueue(
+        name,
+        int(os.getenv(f"{prefix}_WORKERS", workers)),
+        int(os.getenv(f"{prefix}_MAX_QUEUE", max_queue)),
+        initial_service_time
+    )
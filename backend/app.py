@@ -1,22 +1,33 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g, Response
 from flask_cors import CORS
 import io
 import time
+import tempfile
+import hashlib
 import threading
-import queue
-from tts import text_to_speech, executor  # Import the executor from tts.py
-from stt import transcribe_audio
+import zipfile
+from concurrent.futures import wait, FIRST_COMPLETED
+from tts import text_to_speech, text_to_speech_rendition, pipelined_text_to_speech, rendition_cache_key, record_tts_access
+from tts import disk_cache as tts_disk_cache
+from stt import transcribe_audio, audio_cache_key, audio_file_cache_key, get_cached_transcript, disk_cache as stt_disk_cache, acoustic_index
 import logging
 from dotenv import load_dotenv
 import os
 import google.generativeai as genai
 import re
-from collections import defaultdict
-
-# Add this after your existing global variables
-# Store conversation history keyed by some identifier (could be session ID or user ID)
-conversation_histories = defaultdict(list)
-MAX_HISTORY_LENGTH = 10  # Limit history to prevent tokens getting too large
+import json
+from cache import get_cache, all_cache_stats, purge_all_expired
+from shared_cache import shared_cache_stats
+from singleflight import SingleFlight, all_flight_stats
+from admission import Overloaded, queue_from_env
+from disk_cache import content_digest
+from audio_format import OUTPUT_ENCODINGS, OUTPUT_SAMPLE_RATES, MASTER_ENCODING, MASTER_SAMPLE_RATE
+from providers import configure_llm, warm_upstreams, pool_stats
+from resilience import get_policy, all_policy_stats
+from conversation import chat_model, get_conversation, reset_conversation, normalize_prompt, loose_prompt, GEMINI_MODEL
+from access_log import record_access
+from prewarm import start_prewarming, prewarm_stats
+from metrics import current_route, observe_stage, timed, render_metrics, request_duration, requests_total
 
 # Configure logging
 logging.basicConfig(
@@ -34,19 +45,42 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
 load_dotenv()
 logger.debug("Loading environment variables from .env file")
 
-# Configure Gemini API key
-API_KEY = os.getenv('GEMINI_API_KEY')
-logger.debug(f"Loaded GEMINI_API_KEY: {API_KEY[:4]}...{API_KEY[-4:]}" if API_KEY else "GEMINI_API_KEY not found")  # Partial key for security
-if not API_KEY:
-    logger.error("GEMINI_API_KEY not found in environment variables")
-    raise ValueError("GEMINI_API_KEY not found in environment variables. Please check your .env file.")
+# Configure Gemini API key (LLM_PROVIDER=fake skips it for load testing)
+configure_llm()
 
-genai.configure(api_key=API_KEY)
+# Separately sized, bounded work queues per kind of upstream work, so a burst of slow
+# TTS jobs cannot starve transcription and overload is rejected fast with Retry-After
+tts_queue = queue_from_env("tts", workers=8, max_queue=32, initial_service_time=2.0)
+stt_queue = queue_from_env("stt", workers=4, max_queue=16, initial_service_time=1.5)
+gemini_queue = queue_from_env("gemini", workers=8, max_queue=32, initial_service_time=2.0)
+# Batch conversions get their own queue so a large batch cannot starve interactive TTS
+tts_batch_queue = queue_from_env("tts_batch", workers=4, max_queue=64, initial_service_time=2.0)
+TTS_BATCH_MAX_ITEMS = int(os.getenv("TTS_BATCH_MAX_ITEMS", 1000))
+# Same for bulk transcription; manifests may only name files under STT_BATCH_ROOT
+stt_batch_queue = queue_from_env("stt_batch", workers=4, max_queue=64, initial_service_time=1.5)
+STT_BATCH_MAX_ITEMS = int(os.getenv("STT_BATCH_MAX_ITEMS", 1000))
+STT_BATCH_ROOT = os.getenv("STT_BATCH_ROOT")
+TTS_DEADLINE = 15  # Seconds, matching the result timeouts below
+STT_DEADLINE = 20
+GEMINI_DEADLINE = 20
 
-# Optimization: Setup request queue and response cache
-request_queue = queue.Queue()
-response_cache = {}
+# Optimization: Setup response cache
 CACHE_EXPIRY = 3600  # 1 hour
+response_cache = get_cache("responses", ttl=CACHE_EXPIRY)
+
+# Coalesces identical in-flight Gemini requests
+gemini_flight = SingleFlight("gemini")
+# Deadline, hedging and circuit breaker for Gemini calls (see resilience.py); the deadline
+# leaves room inside GEMINI_DEADLINE for queueing
+gemini_policy = get_policy("gemini", deadline=15)
+# Also match trivial rephrasings ("Hey, can you tell me why the sky is blue?") of a cached prompt
+GEMINI_NEAR_DUPLICATES = os.getenv("GEMINI_NEAR_DUPLICATES", "0") == "1"
+
+VALID_VOICES = ['default', 'male', 'female']
+AUDIO_MAX_AGE = 86400  # Synthesized audio for a given text/voice/speed/format never changes
+
+# Set USE_X_SENDFILE=1 when running behind a proxy that serves X-Sendfile paths (zero-copy)
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '0') == '1'
 
 # Request tracking for better error handling
 active_requests = {}
@@ -59,6 +93,62 @@ def get_request_id():
         request_counter += 1
         return f"req-{request_counter}"
 
+def validate_tts_params(voice, speed):
+    """Return an error message for invalid TTS voice/speed parameters, or None."""
+    if speed < 0.5 or speed > 2.0:
+        return "Speed must be between 0.5 and 2.0"
+    if voice.lower() not in VALID_VOICES:
+        return f"Voice must be one of: {', '.join(VALID_VOICES)}"
+    return None
+
+def overloaded_response(req_id, error):
+    """Build a 429/503 JSON response with Retry-After for a request rejected by admission control."""
+    logger.warning(f"[{req_id}] Rejected by admission control: {str(error)}")
+    if req_id in active_requests:
+        del active_requests[req_id]
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def track_stream(req_id, stream):
+    """Wrap a streamed response body so request tracking is cleaned up when it ends."""
+    try:
+        yield from stream
+    except Exception as e:
+        logger.error(f"[{req_id}] Streaming response error: {str(e)}", exc_info=True)
+        raise
+    finally:
+        if req_id in active_requests:
+            del active_requests[req_id]
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    current_route.set(request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.after_request
+def record_request_metrics(response):
+    """Record end-to-end latency and the time spent writing the body once the server closes it."""
+    route = current_route.get()
+    request_start = g.get('request_start', time.perf_counter())
+    write_start = time.perf_counter()
+    status = str(response.status_code)
+
+    def on_close():
+        now = time.perf_counter()
+        observe_stage("response_write", now - write_start, status, route=route)
+        request_duration.observe(now - request_start, route=route, status=status)
+        requests_total.inc(route=route, status=status)
+
+    if response.direct_passthrough:
+        # send_file bodies go straight to the server's file wrapper and Werkzeug never
+        # calls close callbacks for them, so record at hand-off
+        on_close()
+    else:
+        response.call_on_close(on_close)
+    return response
+
 @app.route('/api/convert', methods=['POST'])
 def convert_text():
     req_id = get_request_id()
@@ -66,7 +156,8 @@ def convert_text():
     active_requests[req_id] = {"start_time": time.time(), "status": "processing"}
     
     try:
-        data = request.json
+        with timed("request_parse"):
+            data = request.json
         if not data:
             logger.warning(f"[{req_id}] No data provided")
             return jsonify({"error": "No data provided"}), 400
@@ -75,19 +166,25 @@ def convert_text():
         voice = data.get('voice', 'default')
         speed = float(data.get('speed', 1.0))
         streaming = data.get('streaming', False)  # New parameter for streaming
-        logger.debug(f"[{req_id}] TTS parameters: text={text[:20]}..., voice={voice}, speed={speed}, streaming={streaming}")
+        encoding = data.get('encoding', MASTER_ENCODING)
+        sample_rate = int(data.get('sample_rate', MASTER_SAMPLE_RATE))
+        logger.debug(f"[{req_id}] TTS parameters: text={text[:20]}..., voice={voice}, speed={speed}, streaming={streaming}, "
+                     f"format={encoding}/{sample_rate}")
         
         if not text:
             return jsonify({"error": "Text is required"}), 400
-        if not isinstance(speed, (int, float)) or speed < 0.5 or speed > 2.0:
-            return jsonify({"error": "Speed must be between 0.5 and 2.0"}), 400
-
-        valid_voices = ['default', 'male', 'female']
-        if voice.lower() not in valid_voices:
-            return jsonify({"error": f"Voice must be one of: {', '.join(valid_voices)}"}), 400
+        param_error = validate_tts_params(voice, speed)
+        if param_error:
+            return jsonify({"error": param_error}), 400
+        if encoding not in OUTPUT_ENCODINGS:
+            return jsonify({"error": f"Encoding must be one of: {', '.join(OUTPUT_ENCODINGS)}"}), 400
+        if sample_rate not in OUTPUT_SAMPLE_RATES:
+            return jsonify({"error": f"Sample rate must be one of: {', '.join(str(r) for r in OUTPUT_SAMPLE_RATES)}"}), 400
+        is_master_format = encoding == MASTER_ENCODING and sample_rate == MASTER_SAMPLE_RATE
         
-        # For streaming mode, we handle differently
-        if streaming:
+        # For streaming mode, we handle differently. Other formats are transcoded from the
+        # complete master, so they are always sent as a whole file.
+        if streaming and is_master_format:
             try:
                 # Get streaming generator from TTS function
                 audio_stream = text_to_speech(text, voice, speed, streaming=True)
@@ -103,55 +200,65 @@ def convert_text():
                 logger.error(f"[{req_id}] TTS streaming error: {str(tts_error)}", exc_info=True)
                 return jsonify({"error": f"TTS streaming failed: {str(tts_error)}"}), 500
         
-        # For non-streaming mode, continue with existing code
-        # Check cache first for faster response
-        cache_key = f"tts:{text[:100]}:{voice}:{speed}"
-        if cache_key in response_cache:
-            cache_entry = response_cache[cache_key]
-            if time.time() - cache_entry['timestamp'] < CACHE_EXPIRY:
-                logger.debug(f"[{req_id}] TTS cache hit")
-                audio_data = cache_entry['data']
-                audio_io = io.BytesIO(audio_data)
-                audio_io.seek(0)
-                return send_file(
-                    audio_io,
-                    mimetype='audio/wav',
-                    as_attachment=True,
-                    download_name='speech.wav'
-                )
-        
-        try:
-            # Submit TTS task to thread pool
-            future = executor.submit(text_to_speech, text, voice, speed, False)
-            # Add small timeout for better error handling
-            audio_data = future.result(timeout=15)
-            
-            if not audio_data or len(audio_data) < 100:
-                return jsonify({"error": "Generated audio data is invalid or empty"}), 500
+        # For non-streaming mode, serve straight from the disk cache file: send_file streams it
+        # with the WSGI file wrapper (or X-Sendfile) and handles If-None-Match and Range
+        cache_key = rendition_cache_key(text, voice, speed, encoding, sample_rate)
+        cached_entry = tts_disk_cache.lookup(cache_key)
+        if cached_entry is not None:
+            logger.debug(f"[{req_id}] TTS cache hit")
+            record_tts_access(cache_key, text, voice, speed, encoding, sample_rate)
+        else:
+            try:
+                # Submit TTS task to the TTS work queue (rejects fast when overloaded)
+                future = tts_queue.submit(TTS_DEADLINE, text_to_speech_rendition, text, voice, speed, encoding, sample_rate)
+                # Add small timeout for better error handling
+                audio_data = future.result(timeout=TTS_DEADLINE)
+                
+                if not audio_data or len(audio_data) < 100:
+                    return jsonify({"error": "Generated audio data is invalid or empty"}), 500
                 
-            # Update cache
-            response_cache[cache_key] = {
-                'data': audio_data,
-                'timestamp': time.time()
-            }
+                logger.debug(f"[{req_id}] TTS conversion successful, audio size: {len(audio_data)} bytes")
+            except Overloaded as overload:
+                return overloaded_response(req_id, overload)
+            except Exception as tts_error:
+                logger.error(f"[{req_id}] TTS module error: {str(tts_error)}", exc_info=True)
+                return jsonify({"error": f"TTS conversion failed: {str(tts_error)}"}), 500
             
-            logger.debug(f"[{req_id}] TTS conversion successful, audio size: {len(audio_data)} bytes")
-        except Exception as tts_error:
-            logger.error(f"[{req_id}] TTS module error: {str(tts_error)}", exc_info=True)
-            return jsonify({"error": f"TTS conversion failed: {str(tts_error)}"}), 500
-        
-        audio_io = io.BytesIO(audio_data)
-        audio_io.seek(0)
+            cached_entry = tts_disk_cache.lookup(cache_key)
         
         # Clean up request tracking
         if req_id in active_requests:
             del active_requests[req_id]
-            
+        
+        if cached_entry is not None:
+            audio_path, digest = cached_entry
+            # POST responses are never made conditional by Werkzeug, so honour If-None-Match here;
+            # seeking and resuming go through the GET URL in X-Audio-URL
+            if digest in request.if_none_match:
+                response = app.response_class(status=304)
+                response.set_etag(digest)
+                return response
+            response = send_file(
+                os.path.abspath(audio_path),
+                mimetype='audio/wav',
+                as_attachment=True,
+                download_name='speech.wav',
+                etag=digest,
+                max_age=AUDIO_MAX_AGE
+            )
+            response.headers['X-Audio-URL'] = f"/api/audio/{cache_key}"
+            return response
+        
+        # Evicted between synthesis and lookup - fall back to the bytes we already have
+        audio_io = io.BytesIO(audio_data)
+        audio_io.seek(0)
         return send_file(
             audio_io,
             mimetype='audio/wav',
             as_attachment=True,
-            download_name='speech.wav'
+            download_name='speech.wav',
+            etag=content_digest(audio_data),
+            max_age=AUDIO_MAX_AGE
         )
         
     except Exception as e:
@@ -161,6 +268,254 @@ def convert_text():
             del active_requests[req_id]
         return jsonify({"error": str(e)}), 500
 
+def fan_out(work_queue, deadline, jobs, parallelism):
+    """
+    Run batch jobs on a work queue with at most `parallelism` of them in flight.
+    
+    The first window is submitted before returning, so the work overlaps with whatever
+    the caller sends meanwhile.
+    
+    Args:
+        work_queue (WorkQueue): Queue to run the jobs on.
+        deadline (float): Per-job deadline in seconds.
+        jobs (list): (key, fn, *args) tuples.
+        parallelism (int): Maximum concurrent jobs for this batch.
+        
+    Returns:
+        generator: (key, result or None, error or None) in completion order.
+    """
+    pending_jobs = iter(jobs)
+    in_flight = {}
+    failed = []
+    
+    def submit_next():
+        job = next(pending_jobs, None)
+        if job is None:
+            return False
+        try:
+            in_flight[work_queue.submit(deadline, *job[1:])] = job[0]
+        except Overloaded as overload:
+            failed.append((job[0], None, overload))
+        return True
+    
+    def fill_window():
+        while len(in_flight) < parallelism and submit_next():
+            pass
+    
+    fill_window()
+    
+    def completions():
+        while in_flight or failed:
+            while failed:
+                yield failed.pop()
+            if not in_flight:
+                continue
+            done, _ = wait(in_flight, timeout=deadline, return_when=FIRST_COMPLETED)
+            if not done:
+                # Nothing finished within a full deadline; report the rest of the window as timed out
+                for future, key in in_flight.items():
+                    future.cancel()
+                    yield key, None, TimeoutError(f"{work_queue.name} job timed out")
+                in_flight.clear()
+            for future in done:
+                key = in_flight.pop(future)
+                try:
+                    yield key, future.result(), None
+                except Exception as e:
+                    yield key, None, e
+            fill_window()
+    
+    return completions()
+
+@app.route('/api/convert/batch', methods=['POST'])
+def convert_batch():
+    """
+    Convert many texts to speech in one request.
+    
+    Expects JSON with "texts" (a list of strings) or "items" (a list of objects with
+    "text" and optional "voice"/"speed"), plus default "voice", "speed", "encoding",
+    "sample_rate", an optional "parallelism" and "format" ("multipart" or "zip").
+    
+    Identical items are synthesized once and renditions already on disk are sent without
+    touching the queue; the misses are fanned out on the batch work queue. The multipart
+    response streams one audio/wav part per distinct rendition as it becomes ready (the
+    X-Batch-Items header lists the item indices it serves), then a JSON manifest with a
+    status per item. The zip response holds the same audio files plus manifest.json.
+    """
+    req_id = get_request_id()
+    logger.debug(f"Received batch TTS request [{req_id}]")
+    active_requests[req_id] = {"start_time": time.time(), "status": "processing"}
+    
+    try:
+        with timed("request_parse"):
+            data = request.json
+        if not data:
+            del active_requests[req_id]
+            return jsonify({"error": "No data provided"}), 400
+        
+        items = data.get('items')
+        if items is None:
+            items = [{"text": text} for text in data.get('texts', [])]
+        default_voice = data.get('voice', 'default')
+        default_speed = float(data.get('speed', 1.0))
+        encoding = data.get('encoding', MASTER_ENCODING)
+        sample_rate = int(data.get('sample_rate', MASTER_SAMPLE_RATE))
+        response_format = data.get('format', 'multipart')
+        parallelism = max(1, min(int(data.get('parallelism', tts_batch_queue.workers)), tts_batch_queue.workers))
+        
+        error = None
+        if not isinstance(items, list) or not items:
+            error = "Provide a non-empty list of texts or items"
+        elif len(items) > TTS_BATCH_MAX_ITEMS:
+            error = f"At most {TTS_BATCH_MAX_ITEMS} items per batch"
+        elif encoding not in OUTPUT_ENCODINGS:
+            error = f"Encoding must be one of: {', '.join(OUTPUT_ENCODINGS)}"
+        elif sample_rate not in OUTPUT_SAMPLE_RATES:
+            error = f"Sample rate must be one of: {', '.join(str(r) for r in OUTPUT_SAMPLE_RATES)}"
+        elif response_format not in ('multipart', 'zip'):
+            error = "Format must be 'multipart' or 'zip'"
+        if error:
+            del active_requests[req_id]
+            return jsonify({"error": error}), 400
+    except Exception as e:
+        logger.error(f"[{req_id}] Batch TTS request error: {str(e)}", exc_info=True)
+        if req_id in active_requests:
+            del active_requests[req_id]
+        return jsonify({"error": str(e)}), 400
+    
+    # Validate per item and de-duplicate by rendition key; bad items fail alone
+    manifest = []
+    indices_by_key = {}
+    misses = []
+    cached_keys = []
+    for index, item in enumerate(items):
+        entry = {"index": index}
+        manifest.append(entry)
+        try:
+            text = item.get('text', '') if isinstance(item, dict) else item
+            voice = item.get('voice', default_voice) if isinstance(item, dict) else default_voice
+            speed = float(item.get('speed', default_speed)) if isinstance(item, dict) else default_speed
+            if not isinstance(text, str) or not text:
+                raise ValueError("Text is required")
+            param_error = validate_tts_params(voice, speed)
+            if param_error:
+                raise ValueError(param_error)
+        except (AttributeError, TypeError, ValueError) as item_error:
+            entry.update(status="error", error=str(item_error))
+            continue
+        cache_key = rendition_cache_key(text, voice, speed, encoding, sample_rate)
+        entry.update(cache_key=cache_key, audio_url=f"/api/audio/{cache_key}")
+        if cache_key in indices_by_key:
+            indices_by_key[cache_key].append(index)
+            continue
+        indices_by_key[cache_key] = [index]
+        if tts_disk_cache.lookup(cache_key) is not None:
+            record_tts_access(cache_key, text, voice, speed, encoding, sample_rate)
+            cached_keys.append((cache_key, text, voice, speed))
+        else:
+            misses.append((cache_key, text_to_speech_rendition, text, voice, speed, encoding, sample_rate))
+    logger.debug(f"[{req_id}] Batch of {len(items)} items: {len(indices_by_key)} distinct, "
+                 f"{len(cached_keys)} cached, {len(misses)} to synthesize with parallelism {parallelism}")
+    
+    # Optimization: Start the misses first so synthesis overlaps with sending cached audio
+    completions = fan_out(tts_batch_queue, TTS_DEADLINE, misses, parallelism)
+    
+    def results():
+        for cache_key, text, voice, speed in cached_keys:
+            audio_data = tts_disk_cache.read(cache_key)
+            if audio_data is None:
+                # Evicted since the lookup above; render it here instead
+                try:
+                    audio_data = text_to_speech_rendition(text, voice, speed, encoding, sample_rate)
+                except Exception as e:
+                    yield cache_key, None, e, "synthesized"
+                    continue
+            yield cache_key, audio_data, None, "cached"
+        for cache_key, audio_data, error in completions:
+            yield cache_key, audio_data, error, "synthesized"
+    
+    def record(cache_key, audio_data, error, status):
+        for index in indices_by_key[cache_key]:
+            if error is None:
+                manifest[index].update(status=status, bytes=len(audio_data))
+            else:
+                manifest[index].update(status="error", error=str(error))
+                if isinstance(error, Overloaded):
+                    manifest[index]["retry_after"] = error.retry_after
+        if error is not None:
+            logger.error(f"[{req_id}] Batch item {cache_key[:8]}... failed: {str(error)}")
+    
+    def summary():
+        counts = {}
+        for entry in manifest:
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return {"items": manifest, "counts": counts}
+    
+    if response_format == 'zip':
+        try:
+            # Spill large archives to disk instead of holding them in memory
+            archive = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024)
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+                for cache_key, audio_data, error, status in results():
+                    record(cache_key, audio_data, error, status)
+                    if error is None:
+                        file_name = f"{indices_by_key[cache_key][0]:04d}.wav"
+                        for index in indices_by_key[cache_key]:
+                            manifest[index]["file"] = file_name
+                        zf.writestr(file_name, audio_data)
+                zf.writestr("manifest.json", json.dumps(summary()))
+            archive.seek(0)
+        finally:
+            if req_id in active_requests:
+                del active_requests[req_id]
+        return send_file(archive, mimetype='application/zip', as_attachment=True, download_name='speech.zip')
+    
+    boundary = f"ttsbatch-{req_id}"
+    
+    def generate_parts():
+        for cache_key, audio_data, error, status in results():
+            record(cache_key, audio_data, error, status)
+            if error is None:
+                items_header = ",".join(str(index) for index in indices_by_key[cache_key])
+                yield (f"--{boundary}\r\nContent-Type: audio/wav\r\nContent-Length: {len(audio_data)}\r\n"
+                       f"X-Batch-Items: {items_header}\r\nX-Cache-Key: {cache_key}\r\n\r\n").encode()
+                yield audio_data
+                yield b"\r\n"
+        yield f"--{boundary}\r\nContent-Type: application/json\r\n\r\n{json.dumps(summary())}\r\n".encode()
+        yield f"--{boundary}--\r\n".encode()
+        logger.debug(f"[{req_id}] Batch TTS completed")
+    
+    return app.response_class(
+        track_stream(req_id, generate_parts()),
+        content_type=f'multipart/mixed; boundary={boundary}'
+    )
+
+@app.route('/api/audio/<cache_key>', methods=['GET'])
+def cached_audio(cache_key):
+    """
+    Serve a cached TTS rendition by cache key, as returned in X-Audio-URL.
+    
+    Supports If-None-Match (304) and Range (206) so clients can replay, seek and
+    resume audio they already hold without downloading it again.
+    """
+    if not re.fullmatch(r'[0-9a-f]{32}', cache_key):
+        return jsonify({"error": "Invalid audio id"}), 400
+    
+    cached_entry = tts_disk_cache.lookup(cache_key)
+    if cached_entry is None:
+        return jsonify({"error": "Audio not found"}), 404
+    record_access("tts", cache_key)
+    
+    audio_path, digest = cached_entry
+    return send_file(
+        os.path.abspath(audio_path),
+        mimetype='audio/wav',
+        download_name='speech.wav',
+        conditional=True,
+        etag=digest,
+        max_age=AUDIO_MAX_AGE
+    )
+
 @app.route('/api/transcribe', methods=['POST'])
 def transcribe():
     req_id = get_request_id()
@@ -168,12 +523,15 @@ def transcribe():
     active_requests[req_id] = {"start_time": time.time(), "status": "processing"}
     
     try:
+        with timed("request_parse"):
+            uploaded_files = request.files
+        
         # Check if audio file is provided
-        if 'audio' not in request.files:
+        if 'audio' not in uploaded_files:
             logger.warning(f"[{req_id}] No audio file provided")
             return jsonify({"error": "No audio file provided"}), 400
         
-        audio_file = request.files['audio']
+        audio_file = uploaded_files['audio']
         if audio_file.filename == '':
             logger.warning(f"[{req_id}] No selected file")
             return jsonify({"error": "No selected file"}), 400
@@ -191,9 +549,9 @@ def transcribe():
             logger.warning(f"[{req_id}] Audio file too small, likely empty/noise")
             return jsonify({"transcript": "No speech detected, please try again."}), 200
             
-        # Submit transcription task to thread pool
-        future = executor.submit(transcribe_audio, buffer_data)
-        transcript = future.result(timeout=20)  # Add timeout for better error handling
+        # Submit transcription task to the STT work queue (rejects fast when overloaded)
+        future = stt_queue.submit(STT_DEADLINE, transcribe_audio, buffer_data)
+        transcript = future.result(timeout=STT_DEADLINE)  # Add timeout for better error handling
         
         # Clean up empty transcripts
         if not transcript or transcript.strip() == "":
@@ -210,6 +568,8 @@ def transcribe():
             "confidence": 0.9  # Add confidence for Flutter app
         })
 
+    except Overloaded as overload:
+        return overloaded_response(req_id, overload)
     except Exception as e:
         logger.error(f"[{req_id}] STT error: {str(e)}", exc_info=True)
         # Clean up request tracking
@@ -217,6 +577,309 @@ def transcribe():
             del active_requests[req_id]
         return jsonify({"error": str(e)}), 500
 
+def resolve_batch_path(path):
+    """Resolve a manifest path under STT_BATCH_ROOT, or raise ValueError if it escapes it."""
+    root = os.path.realpath(STT_BATCH_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError("Path is outside the batch root")
+    if not os.path.isfile(resolved):
+        raise ValueError("File not found")
+    return resolved
+
+def transcribe_path(path):
+    """Read a local audio file and transcribe it; used for manifest batches so bytes aren't held meanwhile."""
+    with open(path, 'rb') as f:
+        return transcribe_audio(f.read())
+
+@app.route('/api/transcribe/batch', methods=['POST'])
+def transcribe_batch():
+    """
+    Transcribe many recordings in one request.
+    
+    Accepts either a multipart upload with several 'audio' files, or JSON with "paths":
+    files relative to STT_BATCH_ROOT on the server (disabled when it is unset). An
+    optional "concurrency" (form field or JSON) caps parallel transcriptions, up to the
+    stt_batch queue's worker count.
+    
+    Files are keyed by content hash: duplicates within the batch are transcribed once and
+    transcripts already cached are returned without queueing. Results stream back as
+    NDJSON, one line per item as soon as it finishes, then a summary line.
+    """
+    req_id = get_request_id()
+    logger.debug(f"Received batch STT request [{req_id}]")
+    active_requests[req_id] = {"start_time": time.time(), "status": "processing"}
+    
+    results = []  # (index, status, fields) for items settled while parsing
+    indices_by_key = {}
+    cached = []
+    misses = []
+    
+    def add_item(index, audio_key, job):
+        if audio_key in indices_by_key:
+            indices_by_key[audio_key].append(index)
+            return
+        indices_by_key[audio_key] = [index]
+        transcript = get_cached_transcript(audio_key)
+        if transcript is not None:
+            cached.append((audio_key, transcript))
+        else:
+            misses.append((audio_key, *job))
+    
+    try:
+        with timed("request_parse"):
+            if request.is_json:
+                data = request.json or {}
+                paths = data.get('paths')
+                concurrency = data.get('concurrency', stt_batch_queue.workers)
+                uploads = None
+            else:
+                uploads = request.files.getlist('audio')
+                concurrency = request.form.get('concurrency', stt_batch_queue.workers)
+                paths = None
+        concurrency = max(1, min(int(concurrency), stt_batch_queue.workers))
+        
+        error = None
+        if paths is not None and not STT_BATCH_ROOT:
+            error = "Manifest batches are disabled; set STT_BATCH_ROOT on the server"
+        elif paths is not None and not isinstance(paths, list):
+            error = "paths must be a list"
+        items = paths if paths is not None else uploads
+        if not error and not items:
+            error = "Provide 'audio' files or a list of paths"
+        elif not error and len(items) > STT_BATCH_MAX_ITEMS:
+            error = f"At most {STT_BATCH_MAX_ITEMS} files per batch"
+        if error:
+            del active_requests[req_id]
+            return jsonify({"error": error}), 400
+        
+        names = []
+        for index, item in enumerate(items):
+            if uploads is not None:
+                names.append(item.filename)
+                audio_data = item.read()
+                if len(audio_data) < 1000:
+                    # Same "too small to be meaningful" guard as /api/transcribe
+                    results.append((index, "no_speech", {"transcript": ""}))
+                    continue
+                add_item(index, audio_cache_key(audio_data), (transcribe_audio, audio_data))
+            else:
+                names.append(str(item))
+                try:
+                    path = resolve_batch_path(str(item))
+                    audio_key = audio_file_cache_key(path)
+                except (OSError, ValueError) as item_error:
+                    results.append((index, "error", {"error": str(item_error)}))
+                    continue
+                add_item(index, audio_key, (transcribe_path, path))
+    except Exception as e:
+        logger.error(f"[{req_id}] Batch STT request error: {str(e)}", exc_info=True)
+        if req_id in active_requests:
+            del active_requests[req_id]
+        return jsonify({"error": str(e)}), 400
+    logger.debug(f"[{req_id}] Batch of {len(names)} files: {len(indices_by_key)} distinct, "
+                 f"{len(cached)} cached, {len(misses)} to transcribe with concurrency {concurrency}")
+    
+    # Optimization: Start transcribing before the cached results are written
+    completions = fan_out(stt_batch_queue, STT_DEADLINE, misses, concurrency)
+    
+    def generate_lines():
+        counts = {}
+        
+        def line(index, status, **fields):
+            counts[status] = counts.get(status, 0) + 1
+            return json.dumps({"index": index, "name": names[index], "status": status, **fields}) + "\n"
+        
+        for index, status, fields in results:
+            yield line(index, status, **fields)
+        
+        def finished():
+            for audio_key, transcript in cached:
+                yield audio_key, transcript, None, "cached"
+            for audio_key, transcript, item_error in completions:
+                yield audio_key, transcript, item_error, "transcribed"
+        
+        for audio_key, transcript, item_error, status in finished():
+            for index in indices_by_key[audio_key]:
+                if item_error is not None:
+                    extra = {"retry_after": item_error.retry_after} if isinstance(item_error, Overloaded) else {}
+                    yield line(index, "error", audio_key=audio_key, error=str(item_error), **extra)
+                elif not transcript or not transcript.strip():
+                    yield line(index, "no_speech", audio_key=audio_key, transcript="")
+                else:
+                    yield line(index, status, audio_key=audio_key, transcript=transcript)
+            if item_error is not None:
+                logger.error(f"[{req_id}] Batch transcription of {audio_key[:8]}... failed: {str(item_error)}")
+        
+        yield json.dumps({"done": True, "items": len(names), "counts": counts}) + "\n"
+        logger.debug(f"[{req_id}] Batch STT completed: {counts}")
+    
+    return app.response_class(track_stream(req_id, generate_lines()), mimetype='application/x-ndjson')
+
+
+def reply_cache_keys(prompt, history_digest):
+    """
+    Response cache keys for a prompt in a given conversation context, exact key first.
+    
+    Keys cover the model, the whole normalized prompt and a digest of the history Gemini
+    will see, but not the user: every conversation with the same (usually empty) history
+    shares replies, while a follow-up in a different context never gets a stale answer.
+    
+    Args:
+        prompt (str): The user's message.
+        history_digest (str): Conversation.snapshot digest of the preceding history.
+        
+    Returns:
+        list: One or two hex digest cache keys.
+    """
+    forms = [normalize_prompt(prompt)]
+    if GEMINI_NEAR_DUPLICATES:
+        forms.append("~" + loose_prompt(prompt))
+    return [hashlib.blake2b(f"gemini\0{GEMINI_MODEL}\0{history_digest}\0{form}".encode(),
+                            digest_size=16).hexdigest() for form in forms]
+
+def get_cached_reply(cache_keys):
+    """Return a cached Gemini reply for the first key that has a fresh one, else None."""
+    for cache_key in cache_keys:
+        cached_reply = response_cache.get(cache_key)
+        if cached_reply is not None:
+            return cached_reply
+    return None
+
+def cache_reply(cache_keys, result_text):
+    """Store a finished reply under all of its cache keys."""
+    for cache_key in cache_keys:
+        response_cache.set(cache_key, result_text)
+
+def generate_gemini_reply(user_id, prompt, req_id=""):
+    """
+    Generate a Gemini reply for a user, using and updating their conversation history.
+    
+    Args:
+        user_id (str): The conversation owner (client IP today).
+        prompt (str): The user's message.
+        req_id (str): Request id for log correlation.
+        
+    Returns:
+        str: The reply text with asterisks stripped.
+    """
+    conversation = get_conversation(user_id)
+    conversation_contents, history_digest = conversation.snapshot(prompt)
+    cache_keys = reply_cache_keys(prompt, history_digest)
+    
+    # Optimization: Same prompt in the same context, from any user, is answered from cache
+    result_text = get_cached_reply(cache_keys)
+    if result_text is not None:
+        logger.debug(f"[{req_id}] Gemini cache hit")
+    else:
+        # Identical in-flight requests (e.g. the same FAQ from several users) share one Gemini call
+        result_text = gemini_flight.do(cache_keys[0], _generate_uncached_reply,
+                                       conversation_contents, cache_keys, req_id)
+    
+    conversation.record(prompt, result_text)
+    return result_text
+
+def _generate_uncached_reply(conversation_contents, cache_keys, req_id):
+    logger.debug(f"[{req_id}] Generating content with conversation history ({len(conversation_contents)} messages)")
+    with timed("gemini", "complete"):
+        result_text = gemini_policy.call(_request_reply, conversation_contents)
+    
+    cache_reply(cache_keys, result_text)
+    return result_text
+
+def _request_reply(conversation_contents, timeout):
+    """One Gemini request; the client abandons it after timeout seconds."""
+    response = chat_model.generate_content(conversation_contents, request_options={"timeout": timeout})
+    # Remove asterisks if any still appear
+    return response.text.replace('*', '')
+
+def stream_gemini_reply(user_id, prompt, req_id=""):
+    """
+    Stream a Gemini reply as text deltas, committing the full reply once it completes.
+    
+    Args:
+        user_id (str): The conversation owner (client IP today).
+        prompt (str): The user's message.
+        req_id (str): Request id for log correlation.
+        
+    Yields:
+        str: Reply text fragments with asterisks stripped.
+    """
+    conversation = get_conversation(user_id)
+    conversation_contents, history_digest = conversation.snapshot(prompt)
+    cache_keys = reply_cache_keys(prompt, history_digest)
+    
+    cached_reply = get_cached_reply(cache_keys)
+    if cached_reply is not None:
+        logger.debug(f"[{req_id}] Gemini cache hit")
+        conversation.record(prompt, cached_reply)
+        yield cached_reply
+        return
+    
+    parts = []
+    for delta in gemini_flight.do_stream(cache_keys[0], _stream_uncached_reply,
+                                         conversation_contents, cache_keys, req_id):
+        parts.append(delta)
+        yield delta
+    conversation.record(prompt, "".join(parts))
+
+def _stream_uncached_reply(conversation_contents, cache_keys, req_id):
+    logger.debug(f"[{req_id}] Streaming content with conversation history ({len(conversation_contents)} messages)")
+    # Streams cannot be hedged, but they still respect the circuit breaker and deadline
+    gemini_policy.allow()
+    start_time = time.perf_counter()
+    outcome = None
+    try:
+        response = chat_model.generate_content(conversation_contents, stream=True,
+                                               request_options={"timeout": gemini_policy.deadline})
+        
+        parts = []
+        for chunk in response:
+            if not parts:
+                observe_stage("gemini", time.perf_counter() - start_time, "first_chunk")
+            try:
+                delta = chunk.text.replace('*', '')
+            except ValueError:
+                # Chunks without text parts (e.g. safety or finish metadata only)
+                continue
+            parts.append(delta)
+            yield delta
+        outcome = True
+    except Exception:
+        outcome = False
+        raise
+    finally:
+        # A client that disconnects mid-stream leaves outcome None: neither success nor failure
+        gemini_policy.record(outcome, time.perf_counter() - start_time)
+    observe_stage("gemini", time.perf_counter() - start_time, "complete")
+    
+    cache_reply(cache_keys, "".join(parts))
+
+
+def sse_event(event, payload):
+    """Format one Server-Sent Event with a JSON data line."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def gemini_event_stream(user_id, prompt, req_id):
+    """
+    Stream a Gemini reply as Server-Sent Events.
+    
+    Emits a 'delta' event ({"text": ...}) per text fragment as it arrives, then a
+    'done' event with the full reply, or an 'error' event if generation fails midway
+    (the HTTP status has already been sent by then).
+    """
+    parts = []
+    try:
+        for delta in stream_gemini_reply(user_id, prompt, req_id):
+            parts.append(delta)
+            yield sse_event("delta", {"text": delta})
+    except Exception as e:
+        logger.error(f"[{req_id}] Gemini streaming error: {str(e)}", exc_info=True)
+        yield sse_event("error", {"error": f"Failed to get Gemini response: {str(e)}"})
+        return
+    yield sse_event("done", {"response": "".join(parts)})
+    logger.debug(f"[{req_id}] Gemini response streamed successfully")
+
 
 @app.route('/api/gemini', methods=['POST'])
 def gemini_endpoint():
@@ -225,7 +888,8 @@ def gemini_endpoint():
     active_requests[req_id] = {"start_time": time.time(), "status": "processing"}
     
     try:
-        data = request.get_json()
+        with timed("request_parse"):
+            data = request.get_json()
         if not data:
             logger.warning(f"[{req_id}] No data provided")
             return jsonify({"error": "No data provided"}), 400
@@ -241,68 +905,34 @@ def gemini_endpoint():
         
         # Check if this is a new conversation (optional reset mechanism)
         if data.get('reset_conversation', False):
-            conversation_histories[user_id] = []
-            
-        # Optimization: Check cache first for exact same prompt (less useful with conversation history)
-        cache_key = f"gemini:{user_id}:{prompt[:100]}"
-        if cache_key in response_cache:
-            cache_entry = response_cache[cache_key]
-            if time.time() - cache_entry['timestamp'] < CACHE_EXPIRY:
-                logger.debug(f"[{req_id}] Gemini cache hit")
-                return jsonify({'response': cache_entry['data']})
-
-        # Add instructions for keeping responses short and removing special characters
-        system_instruction = """
-        Respond using clear, grammatically correct, and well-structured language. Keep your responses concise and direct. 
-        For simple topics, use 3-4 short sentences. For complex topics, provide a brief explanation of 5-7 sentences maximum.
-        
-        Do not use asterisks, special characters, or emojis. Maintain a conversational, helpful tone as if you're speaking
-        directly to the person. Answer questions directly without unnecessary preamble.
-        
-        Consider the conversation history when responding. Make your response relevant to the entire conversation,
-        not just the most recent message.
-        """
-        
-        # Build conversation history prompt
-        conversation_prompt = system_instruction + "\n\nConversation history:\n"
-        
-        # Add previous exchanges from history
-        for i, (old_prompt, old_response) in enumerate(conversation_histories[user_id]):
-            conversation_prompt += f"User: {old_prompt}\n"
-            conversation_prompt += f"Assistant: {old_response}\n"
-        
-        # Add current prompt
-        conversation_prompt += f"\nUser: {prompt}\nAssistant:"
-        
-        logger.debug(f"[{req_id}] Generating content with conversation history (total exchanges: {len(conversation_histories[user_id])})")
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content(
-            conversation_prompt,
-            generation_config={
-                "temperature": 0.2,
-                "max_output_tokens": 400,  # Reduced for even shorter responses
-                "top_p": 0.9,
-                "top_k": 40
-            }
-        )
-
-        result_text = response.text
+            reset_conversation(user_id)
         
-        # Remove asterisks if any still appear
-        result_text = result_text.replace('*', '')
-        
-        # Store in conversation history
-        conversation_histories[user_id].append((prompt, result_text))
-        
-        # Limit history size to prevent token overflow
-        if len(conversation_histories[user_id]) > MAX_HISTORY_LENGTH:
-            conversation_histories[user_id] = conversation_histories[user_id][-MAX_HISTORY_LENGTH:]
+        # Pipeline mode: stream Gemini output sentence by sentence into TTS and return audio
+        if data.get('pipeline', False):
+            voice = data.get('voice', 'default')
+            speed = float(data.get('speed', 1.0))
+            param_error = validate_tts_params(voice, speed)
+            if param_error:
+                del active_requests[req_id]
+                return jsonify({"error": param_error}), 400
+            
+            audio_stream = pipelined_text_to_speech(stream_gemini_reply(user_id, prompt, req_id), voice, speed)
+            return app.response_class(
+                track_stream(req_id, audio_stream),
+                mimetype='audio/wav',
+                headers={'Content-Disposition': 'attachment; filename=speech.wav'}
+            )
         
-        # Update cache
-        response_cache[cache_key] = {
-            'data': result_text,
-            'timestamp': time.time()
-        }
+        # Optimization: Stream mode forwards text deltas as Server-Sent Events as Gemini produces them
+        if data.get('stream', False):
+            return app.response_class(
+                track_stream(req_id, gemini_event_stream(user_id, prompt, req_id)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+            
+        future = gemini_queue.submit(GEMINI_DEADLINE, generate_gemini_reply, user_id, prompt, req_id)
+        result_text = future.result(timeout=GEMINI_DEADLINE)
         
         logger.debug(f"[{req_id}] Gemini response generated successfully")
         
@@ -312,6 +942,8 @@ def gemini_endpoint():
             
         return jsonify({'response': result_text})
 
+    except Overloaded as overload:
+        return overloaded_response(req_id, overload)
     except genai.errors.GenerativeError as e:
         logger.error(f"[{req_id}] Gemini API specific error: {str(e)}", exc_info=True)
         # Clean up request tracking
@@ -324,6 +956,120 @@ def gemini_endpoint():
         if req_id in active_requests:
             del active_requests[req_id]
         return jsonify({"error": f"Failed to get Gemini response: {str(e)}"}), 500
+
+@app.route('/api/voice-turn', methods=['POST'])
+def voice_turn():
+    """
+    Run a full voice turn (STT -> Gemini -> TTS) in one round trip.
+    
+    Expects a multipart upload with an 'audio' file and optional 'voice', 'speed',
+    'pipeline' and 'reset_conversation' form fields. Responds with a streamed
+    multipart/mixed body: a JSON part with the transcript and reply text, followed by
+    an audio/wav part (or a JSON error part if speech synthesis fails).
+    
+    In pipeline mode the reply is synthesized sentence by sentence while Gemini is
+    still generating, so the audio part comes before a final JSON part with the reply.
+    """
+    req_id = get_request_id()
+    logger.debug(f"Received voice turn request [{req_id}]")
+    active_requests[req_id] = {"start_time": time.time(), "status": "processing"}
+    
+    try:
+        with timed("request_parse"):
+            uploaded_files = request.files
+        
+        if 'audio' not in uploaded_files:
+            logger.warning(f"[{req_id}] No audio file provided")
+            del active_requests[req_id]
+            return jsonify({"error": "No audio file provided"}), 400
+        
+        buffer_data = uploaded_files['audio'].read()
+        voice = request.form.get('voice', 'default')
+        speed = float(request.form.get('speed', 1.0))
+        pipeline = request.form.get('pipeline', 'false').lower() in ('1', 'true', 'yes')
+        reset_requested = request.form.get('reset_conversation', 'false').lower() in ('1', 'true', 'yes')
+        
+        param_error = validate_tts_params(voice, speed)
+        if param_error:
+            del active_requests[req_id]
+            return jsonify({"error": param_error}), 400
+        
+        # Same "too small to be meaningful" guard as /api/transcribe - skip Gemini and TTS entirely
+        if len(buffer_data) < 1000:
+            logger.warning(f"[{req_id}] Audio file too small, likely empty/noise")
+            del active_requests[req_id]
+            return jsonify({"transcript": "No speech detected, please try again.", "response": ""}), 200
+        
+        transcript = stt_queue.submit(STT_DEADLINE, transcribe_audio, buffer_data).result(timeout=STT_DEADLINE)
+        if not transcript or transcript.strip() == "":
+            del active_requests[req_id]
+            return jsonify({"transcript": "No speech detected, please try again.", "response": ""}), 200
+        logger.debug(f"[{req_id}] Voice turn transcript: {transcript[:50]}...")
+        
+        user_id = request.remote_addr
+        if reset_requested:
+            reset_conversation(user_id)
+        
+        if pipeline:
+            reply_parts = []
+            
+            def reply_stream():
+                for delta in stream_gemini_reply(user_id, transcript, req_id):
+                    reply_parts.append(delta)
+                    yield delta
+            
+            audio_stream = pipelined_text_to_speech(reply_stream(), voice, speed)
+        else:
+            result_text = gemini_queue.submit(GEMINI_DEADLINE, generate_gemini_reply, user_id, transcript, req_id).result(timeout=GEMINI_DEADLINE)
+            # Start synthesis now so it overlaps with sending the text part
+            tts_future = tts_queue.submit(TTS_DEADLINE, text_to_speech, result_text, voice, speed, False)
+    except Overloaded as overload:
+        return overloaded_response(req_id, overload)
+    except Exception as e:
+        logger.error(f"[{req_id}] Voice turn error: {str(e)}", exc_info=True)
+        if req_id in active_requests:
+            del active_requests[req_id]
+        return jsonify({"error": str(e)}), 500
+    
+    boundary = f"voiceturn-{req_id}"
+    
+    def json_part(payload):
+        return (f"--{boundary}\r\nContent-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n").encode()
+    
+    def generate_parts():
+        if pipeline:
+            yield json_part({"transcript": transcript, "confidence": 0.9})
+            yield f"--{boundary}\r\nContent-Type: audio/wav\r\n\r\n".encode()
+            try:
+                yield from audio_stream
+                yield b"\r\n"
+                yield json_part({"response": "".join(reply_parts)})
+            except Exception as tts_error:
+                logger.error(f"[{req_id}] Voice turn pipeline error: {str(tts_error)}", exc_info=True)
+                yield b"\r\n"
+                yield json_part({"response": "".join(reply_parts), "error": f"TTS conversion failed: {str(tts_error)}"})
+        else:
+            yield json_part({"transcript": transcript, "response": result_text, "confidence": 0.9})
+            try:
+                audio_data = tts_future.result(timeout=TTS_DEADLINE)
+                if not audio_data or len(audio_data) < 100:
+                    raise ValueError("Generated audio data is invalid or empty")
+            except Exception as tts_error:
+                logger.error(f"[{req_id}] Voice turn TTS error: {str(tts_error)}", exc_info=True)
+                yield json_part({"error": f"TTS conversion failed: {str(tts_error)}"})
+            else:
+                yield (f"--{boundary}\r\nContent-Type: audio/wav\r\n"
+                       f"Content-Length: {len(audio_data)}\r\n\r\n").encode()
+                yield audio_data
+                yield b"\r\n"
+        
+        yield f"--{boundary}--\r\n".encode()
+        logger.debug(f"[{req_id}] Voice turn completed")
+    
+    return app.response_class(
+        track_stream(req_id, generate_parts()),
+        content_type=f'multipart/mixed; boundary={boundary}'
+    )
     
 @app.route('/api/status', methods=['GET'])
 def api_status():
@@ -336,11 +1082,17 @@ def api_status():
         # Count active requests
         active_count = len(active_requests)
         
-        # Count cached items
+        # Count cached items (O(1) from the disk cache indexes)
+        tts_disk_stats = tts_disk_cache.stats()
+        stt_disk_stats = stt_disk_cache.stats()
         cache_stats = {
-            "tts_cache_size": len([f for f in os.listdir("tts_cache") if f.endswith('.wav')]) if tts_ok else 0,
-            "stt_cache_size": len([f for f in os.listdir("stt_cache") if f.endswith('.txt')]) if stt_ok else 0,
-            "memory_cache_size": len(response_cache)
+            "tts_cache_size": tts_disk_stats["entries"],
+            "stt_cache_size": stt_disk_stats["entries"],
+            "disk_caches": {"tts": tts_disk_stats, "stt": stt_disk_stats},
+            "memory_cache_size": len(response_cache),
+            "memory_caches": all_cache_stats(),
+            "shared_cache": shared_cache_stats(),
+            "acoustic_index": acoustic_index.stats()
         }
         
         return jsonify({
@@ -351,13 +1103,23 @@ def api_status():
                 "gemini": "ok"  # We can't easily test this without making a real request
             },
             "active_requests": active_count,
+            "coalescing": all_flight_stats(),
+            "work_queues": {q.name: q.stats() for q in (tts_queue, tts_batch_queue, stt_queue, stt_batch_queue, gemini_queue)},
+            "upstream_pools": pool_stats(),
+            "resilience": all_policy_stats(),
             "cache_stats": cache_stats,
+            "prewarm": prewarm_stats(),
             "uptime_seconds": time.time() - app.config.get('START_TIME', time.time())
         }), 200
     except Exception as e:
         logger.error(f"Status endpoint error: {str(e)}", exc_info=True)
         return jsonify({"status": "degraded", "error": str(e)}), 200  # Still return 200 to avoid monitoring failures
 
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """Per-stage latency histograms and request counters in Prometheus text format."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/', methods=['GET'])
 def health_check():
     """Simple health check endpoint."""
@@ -371,29 +1133,15 @@ def clean_cache_periodically():
             # Sleep first to allow server to start properly
             time.sleep(3600)  # Clean every hour
             
-            # Clean memory cache
-            current_time = time.time()
-            expired_keys = [k for k, v in response_cache.items() 
-                           if current_time - v['timestamp'] > CACHE_EXPIRY]
+            # Clean memory caches (size limits are enforced on insert; this drops expired entries)
+            expired_count = purge_all_expired()
+            logger.info(f"Cleaned {expired_count} items from memory cache")
             
-            for key in expired_keys:
-                del response_cache[key]
+            # Clean file caches not accessed in 24 hours (byte quotas are enforced on write)
+            tts_removed = tts_disk_cache.remove_idle(86400)
+            stt_removed = stt_disk_cache.remove_idle(86400)
                 
-            logger.info(f"Cleaned {len(expired_keys)} items from memory cache")
-            
-            # Clean file caches (older than 24 hours)
-            tts_files = [os.path.join("tts_cache", f) for f in os.listdir("tts_cache") 
-                        if f.endswith('.wav') and 
-                        os.path.getmtime(os.path.join("tts_cache", f)) < current_time - 86400]
-            
-            stt_files = [os.path.join("stt_cache", f) for f in os.listdir("stt_cache") 
-                        if f.endswith('.txt') and 
-                        os.path.getmtime(os.path.join("stt_cache", f)) < current_time - 86400]
-            
-            for file_path in tts_files + stt_files:
-                os.remove(file_path)
-                
-            logger.info(f"Cleaned {len(tts_files)} TTS files and {len(stt_files)} STT files")
+            logger.info(f"Cleaned {tts_removed} TTS files and {stt_removed} STT files")
             
         except Exception as e:
             logger.error(f"Error in cache cleaning thread: {e}")
@@ -410,6 +1158,12 @@ if __name__ == '__main__':
     cache_cleaner = threading.Thread(target=clean_cache_periodically, daemon=True)
     cache_cleaner.start()
     
+    # Open upstream connections now so the first requests don't pay for TCP/TLS setup
+    warm_upstreams()
+    
+    # Refill the memory caches with what was popular before the restart
+    start_prewarming()
+    
     logger.info(f"Starting server on {host}:{port}")
     app.run(debug=True, host=host, port=port, threaded=True)
     logger.info(f"Server running on http://{host}:{port}")
\ No newline at end of file
@@ -0,0 +1,459 @@
+"""
+Asyncio serving mode for the /api/* routes.
+
+Runs the single-item endpoints of app.py on aiohttp, awaiting the async Deepgram,
+Cartesia and Gemini clients instead of parking a WSGI thread (plus an executor thread)
+on every upstream call. One process can hold hundreds of slow upstream calls at once.
+Caches, conversation history and request tracking are shared with app.py.
+
+The batch routes and the streamed modes of app.py (/api/convert with "streaming",
+/api/gemini with "stream" or "pipeline") are not served here; requests for those
+modes are rejected with a 400 rather than silently answered as a whole response.
+
+Only this server offers live transcription over a WebSocket at /api/transcribe/stream:
+the client sends binary audio frames while the user speaks (any container Deepgram
+detects, or raw PCM described by ?encoding=linear16&sample_rate=16000) and a text
+message {"type": "stop"} when they are done. The server answers with
+{"type": "partial", "transcript": ..., "is_final": ...} messages as recognition
+progresses and one {"type": "final", "transcript": ...} before closing.
+
+Usage: python async_server.py
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from aiohttp import web
+
+from app import (
+    active_requests, get_request_id, reply_cache_keys, cache_reply,
+    get_cached_reply, gemini_policy, AUDIO_MAX_AGE,
+    validate_tts_params, tts_disk_cache, stt_disk_cache
+)
+from tts import text_to_speech_rendition_async, text_to_speech_async, rendition_cache_key
+from stt import transcribe_audio_async, LiveTranscription
+from cache import all_cache_stats
+from shared_cache import shared_cache_stats
+from access_log import record_access
+from prewarm import start_prewarming, prewarm_stats
+from singleflight import AsyncSingleFlight, all_flight_stats
+from audio_format import OUTPUT_ENCODINGS, OUTPUT_SAMPLE_RATES, MASTER_ENCODING, MASTER_SAMPLE_RATE
+from conversation import chat_model, get_conversation, reset_conversation
+from metrics import current_route, timed, render_metrics, request_duration, requests_total
+from providers import warm_upstreams_async, pool_stats
+from resilience import all_policy_stats
+
+logger = logging.getLogger(__name__)
+
+TTS_TIMEOUT = 15
+STT_TIMEOUT = 20
+GEMINI_TIMEOUT = 20
+LIVE_IDLE_TIMEOUT = 10  # Close live sessions that stop sending audio
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 25 * 1024 * 1024))
+
+gemini_async_flight = AsyncSingleFlight("gemini_async")
+
+
+def error_response(message, status):
+    return web.json_response({"error": message}, status=status)
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """Mirror flask-cors: allow any origin on /api/* and answer preflight requests."""
+    if request.method == "OPTIONS":
+        response = web.Response(status=204)
+    else:
+        response = await handler(request)
+    if request.path.startswith("/api/"):
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Range, If-None-Match"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        response.headers["Access-Control-Expose-Headers"] = "ETag, X-Audio-URL, Content-Range"
+    return response
+
+
+@web.middleware
+async def tracking_middleware(request, handler):
+    """Register every /api/* request in the shared active_requests table."""
+    if not request.path.startswith("/api/") or request.path in ("/api/status", "/api/metrics"):
+        return await handler(request)
+    req_id = get_request_id()
+    request["req_id"] = req_id
+    active_requests[req_id] = {"start_time": time.time(), "status": "processing"}
+    try:
+        return await handler(request)
+    finally:
+        active_requests.pop(req_id, None)
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """Label stage metrics with the matched route and record end-to-end latency."""
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "unmatched"
+    current_route.set(route)
+    start_time = time.perf_counter()
+    status = "500"
+    try:
+        response = await handler(request)
+        status = str(response.status)
+        return response
+    except web.HTTPException as e:
+        status = str(e.status)
+        raise
+    finally:
+        request_duration.observe(time.perf_counter() - start_time, route=route, status=status)
+        requests_total.inc(route=route, status=status)
+
+
+async def request_reply(conversation_contents, timeout):
+    """One async Gemini request; a losing hedge is cancelled."""
+    response = await chat_model.generate_content_async(conversation_contents, request_options={"timeout": timeout})
+    return response.text.replace('*', '')
+
+
+async def generate_gemini_reply_async(user_id, prompt, req_id=""):
+    """Asyncio version of app.generate_gemini_reply using generate_content_async."""
+    conversation = get_conversation(user_id)
+    # With SHARED_CACHE set, history and reply lookups are SQLite or Redis round trips,
+    # so they run on worker threads instead of blocking the event loop
+    conversation_contents, history_digest = await asyncio.to_thread(conversation.snapshot, prompt)
+    cache_keys = reply_cache_keys(prompt, history_digest)
+    result_text = await asyncio.to_thread(get_cached_reply, cache_keys)
+    if result_text is not None:
+        logger.debug(f"[{req_id}] Gemini cache hit")
+        await asyncio.to_thread(conversation.record, prompt, result_text)
+        return result_text
+
+    async def generate():
+        logger.debug(f"[{req_id}] Generating content asynchronously ({len(conversation_contents)} messages)")
+        with timed("gemini", "complete"):
+            text = await gemini_policy.call_async(request_reply, conversation_contents)
+        await asyncio.to_thread(cache_reply, cache_keys, text)
+        return text
+
+    result_text = await gemini_async_flight.do(cache_keys[0], generate)
+    await asyncio.to_thread(conversation.record, prompt, result_text)
+    return result_text
+
+
+async def convert_text(request):
+    req_id = request["req_id"]
+    try:
+        with timed("request_parse"):
+            data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = None
+    if not data:
+        return error_response("No data provided", 400)
+
+    text = data.get('text', '')
+    voice = data.get('voice', 'default')
+    speed = float(data.get('speed', 1.0))
+    encoding = data.get('encoding', MASTER_ENCODING)
+    sample_rate = int(data.get('sample_rate', MASTER_SAMPLE_RATE))
+
+    if not text:
+        return error_response("Text is required", 400)
+    param_error = validate_tts_params(voice, speed)
+    if param_error:
+        return error_response(param_error, 400)
+    if encoding not in OUTPUT_ENCODINGS:
+        return error_response(f"Encoding must be one of: {', '.join(OUTPUT_ENCODINGS)}", 400)
+    if sample_rate not in OUTPUT_SAMPLE_RATES:
+        return error_response(f"Sample rate must be one of: {', '.join(str(r) for r in OUTPUT_SAMPLE_RATES)}", 400)
+    # Like app.py, only the master format could stream; other formats are whole files there too
+    if data.get('streaming', False) and encoding == MASTER_ENCODING and sample_rate == MASTER_SAMPLE_RATE:
+        return error_response("Streaming is not supported by the async server", 400)
+
+    cache_key = rendition_cache_key(text, voice, speed, encoding, sample_rate)
+    try:
+        audio_data = await asyncio.wait_for(
+            text_to_speech_rendition_async(text, voice, speed, encoding, sample_rate), TTS_TIMEOUT
+        )
+    except Exception as tts_error:
+        logger.error(f"[{req_id}] TTS module error: {str(tts_error)}", exc_info=True)
+        return error_response(f"TTS conversion failed: {str(tts_error)}", 500)
+
+    cached_entry = await asyncio.to_thread(tts_disk_cache.lookup, cache_key)
+    if cached_entry is not None:
+        audio_path, digest = cached_entry
+        if f'"{digest}"' in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers={"ETag": f'"{digest}"'})
+        etag = f'"{digest}"'
+    else:
+        etag = None
+
+    headers = {
+        "Content-Disposition": "attachment; filename=speech.wav",
+        "Cache-Control": f"public, max-age={AUDIO_MAX_AGE}",
+        "X-Audio-URL": f"/api/audio/{cache_key}",
+    }
+    if etag:
+        headers["ETag"] = etag
+    return web.Response(body=audio_data, content_type="audio/wav", headers=headers)
+
+
+class DigestFileResponse(web.FileResponse):
+    """
+    FileResponse (sendfile, Range requests) that keeps a content-digest ETag.
+
+    FileResponse always replaces the ETag with one derived from the file's mtime and
+    size, which never matches the digest ETag that /api/convert and the Flask routes
+    hand out. The caller answers If-None-Match itself.
+    """
+
+    def __init__(self, path, digest, **kwargs):
+        super().__init__(path, **kwargs)
+        self._digest_etag = f'"{digest}"'
+        self.headers["ETag"] = self._digest_etag
+
+    @property
+    def etag(self):
+        return super().etag
+
+    @etag.setter
+    def etag(self, value):
+        self.headers["ETag"] = self._digest_etag
+
+
+async def cached_audio(request):
+    cache_key = request.match_info["cache_key"]
+    if not re.fullmatch(r'[0-9a-f]{32}', cache_key):
+        return error_response("Invalid audio id", 400)
+    cached_entry = await asyncio.to_thread(tts_disk_cache.lookup, cache_key)
+    if cached_entry is None:
+        return error_response("Audio not found", 404)
+    await asyncio.to_thread(record_access, "tts", cache_key)
+    audio_path, digest = cached_entry
+    headers = {"Cache-Control": f"public, max-age={AUDIO_MAX_AGE}"}
+    # Same digest ETag as /api/convert, so a client revalidating the X-Audio-URL link gets a 304
+    if f'"{digest}"' in request.headers.get("If-None-Match", ""):
+        return web.Response(status=304, headers={"ETag": f'"{digest}"', **headers})
+    return DigestFileResponse(audio_path, digest, headers={"Content-Type": "audio/wav", **headers})
+
+
+async def read_audio_upload(request):
+    """Return the bytes of the 'audio' part of a multipart upload, or None."""
+    with timed("request_parse"):
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "audio":
+                return bytes(await part.read())
+    return None
+
+
+async def transcribe(request):
+    req_id = request["req_id"]
+    try:
+        buffer_data = await read_audio_upload(request)
+    except Exception:
+        buffer_data = None
+    if buffer_data is None:
+        return error_response("No audio file provided", 400)
+    if not buffer_data:
+        return error_response("Empty audio file", 400)
+
+    if len(buffer_data) < 1000:
+        logger.warning(f"[{req_id}] Audio file too small, likely empty/noise")
+        return web.json_response({"transcript": "No speech detected, please try again."})
+
+    try:
+        transcript = await asyncio.wait_for(transcribe_audio_async(buffer_data), STT_TIMEOUT)
+    except Exception as e:
+        logger.error(f"[{req_id}] STT error: {str(e)}", exc_info=True)
+        return error_response(str(e), 500)
+
+    if not transcript or transcript.strip() == "":
+        transcript = "No speech detected, please try again."
+    return web.json_response({"transcript": transcript, "confidence": 0.9})
+
+
+async def transcribe_stream(request):
+    req_id = request["req_id"]
+    ws = web.WebSocketResponse(receive_timeout=LIVE_IDLE_TIMEOUT, max_msg_size=1024 * 1024)
+    await ws.prepare(request)
+
+    async def send_update(transcript, is_final):
+        if not ws.closed:
+            await ws.send_json({"type": "partial", "transcript": transcript, "is_final": is_final})
+
+    query = request.query
+    session = LiveTranscription(send_update, encoding=query.get("encoding"),
+                                sample_rate=int(query.get("sample_rate", 16000)),
+                                channels=int(query.get("channels", 1)))
+    # Optimization: Audio is recognized while the user is still talking, so only the
+    # flush after the last frame is left on the critical path
+    try:
+        await session.start()
+        async for msg in ws:
+            if msg.type == web.WSMsgType.BINARY:
+                if session.audio_bytes + len(msg.data) > MAX_UPLOAD_BYTES:
+                    await ws.send_json({"type": "error", "error": "Audio stream too large"})
+                    break
+                await session.send(msg.data)
+            elif msg.type == web.WSMsgType.TEXT and json.loads(msg.data).get("type") == "stop":
+                transcript = await session.finish()
+                logger.debug(f"[{req_id}] Live transcription finished after {session.audio_bytes} bytes")
+                await ws.send_json({"type": "final", "transcript": transcript or "No speech detected, please try again."})
+                break
+    except asyncio.TimeoutError:
+        logger.warning(f"[{req_id}] Live transcription idle for {LIVE_IDLE_TIMEOUT}s, closing")
+        if not ws.closed:
+            await ws.send_json({"type": "error", "error": "No audio received, closing"})
+    except Exception as e:
+        logger.error(f"[{req_id}] Live STT error: {str(e)}", exc_info=True)
+        if not ws.closed:
+            await ws.send_json({"type": "error", "error": str(e)})
+    finally:
+        await session.close()
+        await ws.close()
+    return ws
+
+
+async def gemini_endpoint(request):
+    req_id = request["req_id"]
+    try:
+        with timed("request_parse"):
+            data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = None
+    if not data:
+        return error_response("No data provided", 400)
+    prompt = data.get('prompt', '')
+    if not prompt:
+        return error_response("No prompt provided", 400)
+    for mode in ('stream', 'pipeline'):
+        if data.get(mode, False):
+            return error_response(f"'{mode}' is not supported by the async server", 400)
+
+    user_id = request.remote
+    if data.get('reset_conversation', False):
+        await asyncio.to_thread(reset_conversation, user_id)
+
+    try:
+        result_text = await asyncio.wait_for(generate_gemini_reply_async(user_id, prompt, req_id), GEMINI_TIMEOUT)
+    except Exception as e:
+        logger.error(f"[{req_id}] Unexpected error: {str(e)}", exc_info=True)
+        return error_response(f"Failed to get Gemini response: {str(e)}", 500)
+    return web.json_response({'response': result_text})
+
+
+async def voice_turn(request):
+    req_id = request["req_id"]
+    fields = {}
+    buffer_data = None
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name == "audio":
+            buffer_data = bytes(await part.read())
+        elif part.name:
+            fields[part.name] = await part.text()
+    if buffer_data is None:
+        return error_response("No audio file provided", 400)
+
+    voice = fields.get('voice', 'default')
+    speed = float(fields.get('speed', 1.0))
+    param_error = validate_tts_params(voice, speed)
+    if param_error:
+        return error_response(param_error, 400)
+
+    if len(buffer_data) < 1000:
+        return web.json_response({"transcript": "No speech detected, please try again.", "response": ""})
+
+    try:
+        transcript = await asyncio.wait_for(transcribe_audio_async(buffer_data), STT_TIMEOUT)
+        if not transcript or transcript.strip() == "":
+            return web.json_response({"transcript": "No speech detected, please try again.", "response": ""})
+
+        user_id = request.remote
+        if fields.get('reset_conversation', 'false').lower() in ('1', 'true', 'yes'):
+            await asyncio.to_thread(reset_conversation, user_id)
+        result_text = await asyncio.wait_for(generate_gemini_reply_async(user_id, transcript, req_id), GEMINI_TIMEOUT)
+    except Exception as e:
+        logger.error(f"[{req_id}] Voice turn error: {str(e)}", exc_info=True)
+        return error_response(str(e), 500)
+
+    boundary = f"voiceturn-{req_id}"
+    response = web.StreamResponse(headers={"Content-Type": f"multipart/mixed; boundary={boundary}"})
+    await response.prepare(request)
+
+    # Start synthesis before writing the text part so the two overlap
+    tts_task = asyncio.ensure_future(asyncio.wait_for(text_to_speech_async(result_text, voice, speed), TTS_TIMEOUT))
+    text_part = json.dumps({"transcript": transcript, "response": result_text, "confidence": 0.9})
+    await response.write(f"--{boundary}\r\nContent-Type: application/json\r\n\r\n{text_part}\r\n".encode())
+    try:
+        audio_data = await tts_task
+        await response.write(f"--{boundary}\r\nContent-Type: audio/wav\r\nContent-Length: {len(audio_data)}\r\n\r\n".encode())
+        await response.write(audio_data)
+        await response.write(b"\r\n")
+    except Exception as tts_error:
+        logger.error(f"[{req_id}] Voice turn TTS error: {str(tts_error)}", exc_info=True)
+        error_part = json.dumps({"error": f"TTS conversion failed: {str(tts_error)}"})
+        await response.write(f"--{boundary}\r\nContent-Type: application/json\r\n\r\n{error_part}\r\n".encode())
+    await response.write(f"--{boundary}--\r\n".encode())
+    await response.write_eof()
+    return response
+
+
+async def api_status(request):
+    tts_disk_stats = await asyncio.to_thread(tts_disk_cache.stats)
+    stt_disk_stats = await asyncio.to_thread(stt_disk_cache.stats)
+    return web.json_response({
+        "status": "healthy",
+        "mode": "async",
+        "services": {"tts": "ok", "stt": "ok", "gemini": "ok"},
+        "active_requests": len(active_requests),
+        "coalescing": all_flight_stats(),
+        "upstream_pools": pool_stats(),
+        "resilience": all_policy_stats(),
+        "cache_stats": {
+            "tts_cache_size": tts_disk_stats["entries"],
+            "stt_cache_size": stt_disk_stats["entries"],
+            "disk_caches": {"tts": tts_disk_stats, "stt": stt_disk_stats},
+            "memory_caches": all_cache_stats(),
+            "shared_cache": shared_cache_stats()
+        },
+        "prewarm": prewarm_stats(),
+        "uptime_seconds": time.time() - request.app["start_time"]
+    })
+
+
+async def api_metrics(request):
+    return web.Response(text=render_metrics(), content_type="text/plain")
+
+
+async def health_check(request):
+    return web.json_response({"status": "healthy", "message": "Server is running"})
+
+
+async def warm_connections(aio_app):
+    # The asyncio connection pools belong to the serving loop, so they are warmed once it runs
+    await warm_upstreams_async()
+
+
+def create_app():
+    aio_app = web.Application(middlewares=[metrics_middleware, cors_middleware, tracking_middleware],
+                              client_max_size=MAX_UPLOAD_BYTES)
+    aio_app["start_time"] = time.time()
+    aio_app.on_startup.append(warm_connections)
+    aio_app.router.add_post('/api/convert', convert_text)
+    aio_app.router.add_get('/api/audio/{cache_key}', cached_audio)
+    aio_app.router.add_post('/api/transcribe', transcribe)
+    aio_app.router.add_get('/api/transcribe/stream', transcribe_stream)
+    aio_app.router.add_post('/api/gemini', gemini_endpoint)
+    aio_app.router.add_post('/api/voice-turn', voice_turn)
+    aio_app.router.add_get('/api/status', api_status)
+    aio_app.router.add_get('/api/metrics', api_metrics)
+    aio_app.router.add_get('/', health_check)
+    return aio_app
+
+
+if __name__ == "__main__":
+    print("Starting async server...")
+    print("Server running on http://0.0.0.0:5000")
+    start_prewarming()
+    web.run_app(create_app(), host='0.0.0.0', port=5000)
@@ -0,0 +1,275 @@
+import io
+import shutil
+import struct
+import logging
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Canonical master format requested from Cartesia and kept in the caches
+MASTER_ENCODING = "pcm_f32le"
+MASTER_SAMPLE_RATE = 44100
+
+OUTPUT_ENCODINGS = ("pcm_f32le", "pcm_s16le", "pcm_mulaw")
+OUTPUT_SAMPLE_RATES = (16000, 22050, 24000, 44100)
+
+# WAV format tags
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_MULAW = 7
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format tag, bits per sample) for each output encoding
+ENCODING_LAYOUT = {
+    "pcm_f32le": (WAVE_FORMAT_IEEE_FLOAT, 32),
+    "pcm_s16le": (WAVE_FORMAT_PCM, 16),
+    "pcm_mulaw": (WAVE_FORMAT_MULAW, 8),
+}
+
+# Compressed uploads (webm/ogg/mp3) are decoded through pydub, which shells out to ffmpeg
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+
+
+def parse_wav(wav_data):
+    """
+    Locate the fmt and data chunks of a RIFF/WAVE byte string without decoding samples.
+
+    Args:
+        wav_data (bytes): A complete WAV file.
+
+    Returns:
+        tuple: (fmt_chunk_body, pcm_bytes). Streamed WAVs with a placeholder data size
+        are handled by taking everything after the data chunk header.
+    """
+    if len(wav_data) < 12 or wav_data[:4] != b'RIFF' or wav_data[8:12] != b'WAVE':
+        raise ValueError("Audio data is not a RIFF/WAVE file")
+
+    fmt_chunk = None
+    offset = 12
+    while offset + 8 <= len(wav_data):
+        chunk_id = wav_data[offset:offset + 4]
+        chunk_size = struct.unpack('<I', wav_data[offset + 4:offset + 8])[0]
+        body_start = offset + 8
+        if chunk_id == b'fmt ':
+            fmt_chunk = wav_data[body_start:body_start + chunk_size]
+        elif chunk_id == b'data':
+            if fmt_chunk is None:
+                raise ValueError("WAV data chunk appears before fmt chunk")
+            return fmt_chunk, wav_data[body_start:min(body_start + chunk_size, len(wav_data))]
+        # Chunks are word-aligned
+        offset = body_start + chunk_size + (chunk_size & 1)
+
+    raise ValueError("WAV file has no data chunk")
+
+
+def streaming_wav_header(fmt_chunk):
+    """
+    Build a WAV header for a stream of unknown length.
+
+    Uses the 0xFFFFFFFF size placeholder that players treat as "read until EOF".
+
+    Args:
+        fmt_chunk (bytes): The fmt chunk body copied from a source WAV.
+
+    Returns:
+        bytes: RIFF header, fmt chunk and data chunk header.
+    """
+    return (b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE' +
+            b'fmt ' + struct.pack('<I', len(fmt_chunk)) + fmt_chunk +
+            b'data' + struct.pack('<I', 0xFFFFFFFF))
+
+
+def parse_fmt(fmt_chunk):
+    """Return (format_tag, channels, sample_rate, bits_per_sample) from a fmt chunk body."""
+    format_tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', fmt_chunk[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt_chunk) >= 26:
+        # The real format tag is the first two bytes of the SubFormat GUID
+        format_tag = struct.unpack('<H', fmt_chunk[24:26])[0]
+    return format_tag, channels, sample_rate, bits
+
+
+def build_wav(pcm, encoding, sample_rate, channels=1):
+    """
+    Wrap encoded sample bytes in a complete WAV header.
+
+    Non-PCM encodings get the 18-byte fmt chunk and fact chunk the WAV spec asks for.
+    """
+    format_tag, bits = ENCODING_LAYOUT[encoding]
+    block_align = channels * bits // 8
+    fmt_body = struct.pack('<HHIIHH', format_tag, channels, sample_rate, sample_rate * block_align, block_align, bits)
+    if format_tag != WAVE_FORMAT_PCM:
+        fmt_body += struct.pack('<H', 0)
+    return wav_from_fmt(fmt_body, pcm)
+
+
+def wav_from_fmt(fmt_chunk, pcm):
+    """Wrap sample bytes in a complete WAV header around an existing fmt chunk body."""
+    format_tag = parse_fmt(fmt_chunk)[0]
+    block_align = struct.unpack('<H', fmt_chunk[12:14])[0]
+    chunks = b'fmt ' + struct.pack('<I', len(fmt_chunk)) + fmt_chunk
+    if format_tag != WAVE_FORMAT_PCM:
+        chunks += b'fact' + struct.pack('<II', 4, len(pcm) // block_align)
+    data_chunk = b'data' + struct.pack('<I', len(pcm)) + pcm + (b'\x00' if len(pcm) & 1 else b'')
+    body = b'WAVE' + chunks + data_chunk
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def concat_wavs(wavs):
+    """
+    Join WAV files of identical format under one header without decoding any samples.
+
+    Args:
+        wavs (list): Complete WAV files, all with the same fmt chunk.
+
+    Returns:
+        bytes: One WAV file holding the sample data of each input in order.
+    """
+    fmt_chunk = None
+    pcm_parts = []
+    for wav in wavs:
+        wav_fmt, pcm = parse_wav(wav)
+        if fmt_chunk is None:
+            fmt_chunk = wav_fmt
+        elif wav_fmt[:16] != fmt_chunk[:16]:
+            raise ValueError("Cannot join WAV files with different formats")
+        pcm_parts.append(pcm)
+    if fmt_chunk is None:
+        raise ValueError("No WAV files to join")
+    return wav_from_fmt(fmt_chunk, b"".join(pcm_parts))
+
+
+def decode_wav(wav_data):
+    """
+    Decode a WAV file into float32 samples in [-1, 1].
+
+    Returns:
+        tuple: (samples as an array of shape (frames, channels), sample_rate)
+    """
+    fmt_chunk, pcm = parse_wav(wav_data)
+    format_tag, channels, sample_rate, bits = parse_fmt(fmt_chunk)
+
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        samples = np.frombuffer(pcm[:len(pcm) - len(pcm) % 4], dtype='<f4').astype(np.float32)
+    elif format_tag == WAVE_FORMAT_PCM and bits == 16:
+        samples = np.frombuffer(pcm[:len(pcm) - len(pcm) % 2], dtype='<i2').astype(np.float32) / 32768.0
+    elif format_tag == WAVE_FORMAT_MULAW and bits == 8:
+        samples = mulaw_decode(np.frombuffer(pcm, dtype=np.uint8)).astype(np.float32) / 32768.0
+    else:
+        raise ValueError(f"Unsupported WAV format tag {format_tag} with {bits} bits per sample")
+
+    frames = len(samples) // channels
+    return samples[:frames * channels].reshape(frames, channels), sample_rate
+
+
+def is_wav(audio_data):
+    return audio_data[:4] == b'RIFF' and audio_data[8:12] == b'WAVE'
+
+
+def decode_upload(audio_data):
+    """
+    Decode an uploaded recording into float32 samples for analysis.
+
+    WAV is decoded directly; other containers need pydub with an ffmpeg binary on PATH.
+
+    Returns:
+        tuple or None: (samples as an array of shape (frames, channels), sample_rate),
+        or None if the upload can't be decoded here.
+    """
+    if is_wav(audio_data):
+        try:
+            return decode_wav(audio_data)
+        except (ValueError, struct.error) as e:
+            logger.debug(f"Cannot decode WAV upload: {str(e)}")
+            return None
+    if not FFMPEG_AVAILABLE:
+        return None
+    try:
+        from pydub import AudioSegment
+        segment = AudioSegment.from_file(io.BytesIO(audio_data))
+        scale = float(1 << (8 * segment.sample_width - 1))
+        samples = np.array(segment.get_array_of_samples(), dtype=np.float32) / scale
+        return samples.reshape(-1, segment.channels), segment.frame_rate
+    except Exception as e:
+        logger.debug(f"Cannot decode upload: {str(e)}")
+        return None
+
+
+def lowpass(samples, cutoff_ratio, taps=63):
+    """Windowed-sinc FIR low-pass along axis 0; cutoff_ratio is cutoff / input sample rate."""
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = np.sinc(2 * cutoff_ratio * n) * np.hamming(taps)
+    kernel /= kernel.sum()
+    return np.stack([np.convolve(samples[:, c], kernel, mode='same') for c in range(samples.shape[1])], axis=1)
+
+
+def resample(samples, from_rate, to_rate):
+    """Resample (frames, channels) float samples with an anti-aliasing filter and linear interpolation."""
+    if from_rate == to_rate or len(samples) == 0:
+        return samples
+    if to_rate < from_rate:
+        # Cut just below the new Nyquist frequency before decimating
+        samples = lowpass(samples, 0.45 * to_rate / from_rate)
+    out_frames = int(round(len(samples) * to_rate / from_rate))
+    positions = np.arange(out_frames) * (from_rate / to_rate)
+    source_index = np.arange(len(samples))
+    return np.stack([np.interp(positions, source_index, samples[:, c]) for c in range(samples.shape[1])],
+                    axis=1).astype(np.float32)
+
+
+def mulaw_encode(pcm16):
+    """Vectorized G.711 mu-law encoding of int16 samples."""
+    values = pcm16.astype(np.int32)
+    sign = (values < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(values), MULAW_CLIP) + MULAW_BIAS
+    exponent = np.clip(np.floor(np.log2(magnitude)).astype(np.int32) - 7, 0, 7)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+def mulaw_decode(encoded):
+    """Vectorized G.711 mu-law decoding to int16 samples."""
+    values = ~encoded.astype(np.int32) & 0xFF
+    sign = values & 0x80
+    exponent = (values >> 4) & 0x07
+    mantissa = values & 0x0F
+    magnitude = (((mantissa << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS
+    return np.where(sign != 0, -magnitude, magnitude).astype(np.int16)
+
+
+def encode_samples(samples, encoding):
+    """Encode float samples in [-1, 1] to interleaved bytes in the target encoding."""
+    interleaved = np.clip(samples.reshape(-1), -1.0, 1.0)
+    if encoding == "pcm_f32le":
+        return interleaved.astype('<f4').tobytes()
+    pcm16 = (interleaved * 32767.0).astype('<i2')
+    if encoding == "pcm_s16le":
+        return pcm16.tobytes()
+    if encoding == "pcm_mulaw":
+        return mulaw_encode(pcm16).tobytes()
+    raise ValueError(f"Encoding must be one of: {', '.join(OUTPUT_ENCODINGS)}")
+
+
+def transcode_wav(wav_data, encoding, sample_rate):
+    """
+    Convert a WAV file to another encoding and sample rate.
+
+    Args:
+        wav_data (bytes): Source WAV (typically the f32 44.1 kHz master).
+        encoding (str): One of OUTPUT_ENCODINGS.
+        sample_rate (int): One of OUTPUT_SAMPLE_RATES.
+
+    Returns:
+        bytes: The converted WAV file.
+    """
+    if encoding not in OUTPUT_ENCODINGS:
+        raise ValueError(f"Encoding must be one of: {', '.join(OUTPUT_ENCODINGS)}")
+    if sample_rate not in OUTPUT_SAMPLE_RATES:
+        raise ValueError(f"Sample rate must be one of: {', '.join(str(r) for r in OUTPUT_SAMPLE_RATES)}")
+
+    samples, source_rate = decode_wav(wav_data)
+    samples = resample(samples, source_rate, sample_rate)
+    return build_wav(encode_samples(samples, encoding), encoding, sample_rate, channels=samples.shape[1])
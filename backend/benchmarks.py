@@ -0,0 +1,276 @@
+"""
+Microbenchmarks for the per-request hot paths, with stored baselines.
+
+    python benchmarks.py                 # run and compare against benchmarks_baseline.json
+    python benchmarks.py --save          # run and store the results as the new baseline
+    python benchmarks.py -k fingerprint  # only benchmarks whose name contains "fingerprint"
+
+Each case is timed in several repeats of an auto-calibrated loop; the median
+per-call time is compared with the baseline and cases slower by more than
+--threshold (default 25%) are flagged and make the exit status non-zero.
+Baselines are machine specific: save one per machine before comparing.
+
+Upstream clients are replaced by the local fakes and caches are created in a
+temporary directory, so running the suite needs no API keys and leaves no files.
+Logging is disabled so the numbers measure the code rather than log formatting.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks_baseline.json")
+MIN_REPEAT_SECONDS = 0.05
+REPEATS = 5
+
+AUDIO_SIZES = {"10KB": 10 * 1024, "100KB": 100 * 1024, "1MB": 1024 * 1024, "10MB": 10 * 1024 * 1024}
+
+BENCHMARKS = []
+
+
+def benchmark(name, params):
+    """Register a case. The function takes one param and returns the zero-argument callable to time."""
+    def register(setup):
+        BENCHMARKS.append((name, params, setup))
+        return setup
+    return register
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+# --- STT cache keys and acoustic matching ---
+
+@benchmark("stt.audio_cache_key", AUDIO_SIZES)
+def bench_audio_cache_key(size):
+    import stt
+    data = random_bytes(size)
+    return lambda: stt.audio_cache_key(data)
+
+
+@benchmark("acoustic_fingerprint.acoustic_fingerprint", {"3s": 3, "30s": 30})
+def bench_acoustic_fingerprint(seconds):
+    import numpy as np
+    from acoustic_fingerprint import acoustic_fingerprint
+    noise = np.random.default_rng(3).standard_normal(seconds * 16000).astype(np.float32)[:, None] * 0.2
+    return lambda: acoustic_fingerprint(noise, 16000)
+
+
+@benchmark("acoustic_fingerprint.FingerprintIndex.match", {"1k_entries": 1000})
+def bench_acoustic_match(entries):
+    import numpy as np
+    from acoustic_fingerprint import FingerprintIndex
+    rng = np.random.default_rng(4)
+    index = FingerprintIndex(max_entries=entries)
+    for i in range(entries):
+        index.add(f"{i:032x}", rng.integers(1, 1 << 16, size=94, dtype=np.uint32))
+    query = rng.integers(1, 1 << 16, size=94, dtype=np.uint32)
+    return lambda: index.match(query)
+
+
+@benchmark("stt.prepare_audio", {"3s": 3, "30s": 30})
+def bench_prepare_audio(seconds):
+    import numpy as np
+    import stt
+    from audio_format import build_wav, encode_samples
+    rng = np.random.default_rng(5)
+    samples = rng.standard_normal(seconds * 16000).astype(np.float32) * 0.001
+    samples[16000:-16000] += np.sin(np.arange(len(samples) - 32000) / 7).astype(np.float32) * 0.3
+    wav = build_wav(encode_samples(samples[:, None], "pcm_s16le"), "pcm_s16le", 16000)
+    return lambda: stt.prepare_audio(wav)
+
+
+# --- Memory cache ---
+
+@benchmark("cache.LRUCache.set_evicting", {"1k_entries": 1000, "10k_entries": 10000})
+def bench_memory_set_evicting(entries):
+    from cache import LRUCache
+    value = random_bytes(4096)
+    lru = LRUCache("bench", max_bytes=entries * 4096)
+    for i in range(entries):
+        lru.set(f"warm-{i}", value, size=4096)
+    counter = iter(range(10 ** 9))
+    return lambda: lru.set(f"new-{next(counter)}", value, size=4096)
+
+
+@benchmark("cache.LRUCache.get_hit", {"10k_entries": 10000})
+def bench_memory_get(entries):
+    from cache import LRUCache
+    lru = LRUCache("bench", max_bytes=entries * 64)
+    keys = [f"key-{i}" for i in range(entries)]
+    for key in keys:
+        lru.set(key, "transcript", size=64)
+    picks = iter(random.Random(1).choices(keys, k=10 ** 6))
+    return lambda: lru.get(next(picks))
+
+
+# --- Disk cache ---
+
+@benchmark("disk_cache.DiskCache.write_evicting", {"500_entries": 500, "5k_entries": 5000})
+def bench_disk_write_evicting(entries):
+    from disk_cache import DiskCache
+    value = random_bytes(8192)
+    cache = DiskCache(tempfile.mkdtemp(dir="."), ".bin", max_bytes=entries * 8192)
+    for i in range(entries):
+        cache.write(f"{i:032x}", value)
+    counter = iter(range(entries, 10 ** 9))
+    return lambda: cache.write(f"{next(counter):032x}", value)
+
+
+@benchmark("disk_cache.DiskCache.lookup_hit", {"5k_entries": 5000})
+def bench_disk_lookup(entries):
+    from disk_cache import DiskCache
+    cache = DiskCache(tempfile.mkdtemp(dir="."), ".bin", max_bytes=entries * 1024)
+    keys = [f"{i:032x}" for i in range(entries)]
+    for key in keys:
+        cache.write(key, b"x" * 1024)
+    picks = iter(random.Random(2).choices(keys, k=10 ** 6))
+    return lambda: cache.lookup(next(picks))
+
+
+# --- TTS output ---
+
+@benchmark("tts.collect_audio", {"10x4KB": (10, 4096), "100x4KB": (100, 4096), "1000x4KB": (1000, 4096)})
+def bench_collect_audio(shape):
+    import tts
+    count, size = shape
+    chunks = [random_bytes(size, seed=i) for i in range(count)]
+
+    def generate():
+        yield from chunks
+    return lambda: tts.collect_audio(generate())
+
+
+@benchmark("audio_format.concat_wavs", {"10x3s": 10})
+def bench_concat_wavs(count):
+    import numpy as np
+    from audio_format import build_wav, encode_samples, concat_wavs
+    samples = (0.3 * np.sin(np.arange(3 * 44100) / 10)).astype(np.float32)[:, None]
+    sentences = [build_wav(encode_samples(samples, "pcm_f32le"), "pcm_f32le", 44100)] * count
+    return lambda: concat_wavs(sentences)
+
+
+@benchmark("audio_format.transcode_wav", {"1s": 1, "10s": 10})
+def bench_transcode(seconds):
+    import numpy as np
+    from audio_format import build_wav, encode_samples, transcode_wav
+    samples = (0.3 * np.sin(np.arange(seconds * 44100) / 10)).astype(np.float32)[:, None]
+    master = build_wav(encode_samples(samples, "pcm_f32le"), "pcm_f32le", 44100)
+    return lambda: transcode_wav(master, "pcm_s16le", 16000)
+
+
+# --- Gemini prompt assembly ---
+
+@benchmark("conversation.Conversation.contents", {"10_turns": 10, "100_turns": 100})
+def bench_conversation_contents(turns):
+    from conversation import Conversation
+    conversation = Conversation()
+    reply = "This is a reasonably long assistant answer that goes on for a few sentences. " * 4
+    for i in range(turns):
+        # Fill directly so the long history is not summarized away
+        conversation.turns.append(({"role": "user", "parts": [f"question {i}"]},
+                                   {"role": "model", "parts": [reply]}, 80))
+    return lambda: conversation.contents("And what about tomorrow?")
+
+
+def time_case(fn):
+    """Return per-call seconds for each repeat, calibrating the loop count first."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_REPEAT_SECONDS or loops >= 10 ** 6:
+            break
+        loops *= 10 if elapsed < MIN_REPEAT_SECONDS / 10 else 2
+    timings = [elapsed / loops]
+    for _ in range(REPEATS - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - start) / loops)
+    return timings
+
+
+def run(selected):
+    results = {}
+    for name, params, setup in BENCHMARKS:
+        if selected and selected not in name:
+            continue
+        for label, param in params.items():
+            timings = time_case(setup(param))
+            results[f"{name}[{label}]"] = {"median_s": statistics.median(timings), "min_s": min(timings)}
+    return results
+
+
+def format_time(seconds):
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def compare(results, baseline, threshold):
+    """Print the results table and return the names of regressed cases."""
+    regressions = []
+    print(f"{'benchmark':<52}{'median':>12}{'baseline':>12}{'change':>9}")
+    for case, result in results.items():
+        reference = baseline.get(case)
+        if reference is None:
+            print(f"{case:<52}{format_time(result['median_s']):>12}{'-':>12}{'new':>9}")
+            continue
+        change = result["median_s"] / reference["median_s"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(case)
+        print(f"{case:<52}{format_time(result['median_s']):>12}{format_time(reference['median_s']):>12}"
+              f"{change:>+8.0%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for server hot paths")
+    parser.add_argument("-k", dest="selected", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--save", action="store_true", help="Store results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Flag cases slower than baseline by this fraction")
+    args = parser.parse_args(argv)
+    baseline_path = os.path.abspath(args.baseline)
+
+    # Fake upstreams and a scratch working directory for the module-level caches
+    os.environ.setdefault("UPSTREAM_PROVIDER", "fake")
+    scratch = tempfile.TemporaryDirectory()
+    os.chdir(scratch.name)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    logging.disable(logging.CRITICAL)
+
+    results = run(args.selected)
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f).get("results", {})
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        merged = {**baseline, **results}
+        with open(baseline_path, "w") as f:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(), "results": merged},
+                      f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {baseline_path}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+from metrics import observe_stage
+from shared_cache import shared_store
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Byte budgets per namespace, overridable from the environment
+DEFAULT_NAMESPACE_BUDGETS = {
+    "tts": int(os.getenv("TTS_MEMORY_CACHE_BYTES", 128 * 1024 * 1024)),
+    "stt": int(os.getenv("STT_MEMORY_CACHE_BYTES", 8 * 1024 * 1024)),
+    "responses": int(os.getenv("RESPONSE_CACHE_BYTES", 64 * 1024 * 1024)),
+}
+DEFAULT_TTL = 3600  # 1 hour, matching app.py's CACHE_EXPIRY
+
+
+def sizeof(value):
+    """Approximate the payload size of a cached value in bytes."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache bounded by total payload bytes.
+    
+    All lookups, inserts and evictions are O(1): entries live in an OrderedDict in
+    recency order, so the least recently used entry is always at the front.
+    Expired entries are dropped lazily on access and by purge_expired().
+    
+    With a shared store (shared_cache.py) the cache becomes the first of two tiers:
+    local misses are looked up in the store, and sets are written through to it, so
+    every worker process benefits from work done by any of them.
+    """
+    
+    def __init__(self, name, max_bytes, ttl=DEFAULT_TTL, sliding_ttl=False, shared=None):
+        """
+        Args:
+            name (str): Namespace name, used in logs and stats.
+            max_bytes (int): Total payload byte budget for this namespace.
+            ttl (float): Seconds an entry stays valid, or None for no expiry.
+            sliding_ttl (bool): Whether a hit restarts the entry's TTL.
+            shared (SQLiteStore or RedisStore): Optional cross-process second tier.
+        """
+        self.name = name
+        self.shared = shared
+        if shared is not None:
+            shared.register(name, max_bytes, ttl=ttl, sliding_ttl=sliding_ttl)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sliding_ttl = sliding_ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key, default=None):
+        """Return the cached value for key, or default on a miss or expiry."""
+        start = time.perf_counter()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                now = time.time()
+                if expires_at is not None and now >= expires_at:
+                    self._remove(key)
+                    self.expirations += 1
+                else:
+                    if self.sliding_ttl and self.ttl is not None:
+                        self._entries[key] = (value, size, now + self.ttl)
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    observe_stage("memory_cache_lookup", time.perf_counter() - start, "hit")
+                    return value
+            
+            if self.shared is None:
+                self.misses += 1
+                observe_stage("memory_cache_lookup", time.perf_counter() - start, "miss")
+                return default
+        
+        # Optimization: A local miss may still have been computed by another worker
+        try:
+            value = self.shared.get(self.name, key)
+        except Exception as e:
+            logger.warning(f"[{self.name}] Shared cache lookup failed: {str(e)}")
+            value = None
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            observe_stage("memory_cache_lookup", time.perf_counter() - start, "miss")
+            return default
+        self._set_local(key, value, sizeof(value))
+        with self._lock:
+            self.hits += 1
+            self.shared_hits += 1
+        observe_stage("memory_cache_lookup", time.perf_counter() - start, "shared_hit")
+        return value
+    
+    async def get_async(self, key, default=None):
+        """get() for event-loop callers: a shared-store lookup runs on a worker thread."""
+        if self.shared is None:
+            return self.get(key, default)
+        return await asyncio.to_thread(self.get, key, default)
+    
+    def set(self, key, value, size=None, share=True):
+        """
+        Insert or replace an entry, evicting least recently used entries to stay in budget.
+        
+        Args:
+            key (str): Cache key.
+            value: Cached value (str or bytes when a shared store is used).
+            size (int): Payload size, computed with sizeof() if omitted.
+            share (bool): Also write the entry to the shared store, if any.
+        """
+        if size is None:
+            size = sizeof(value)
+        if share and self.shared is not None:
+            try:
+                self.shared.set(self.name, key, value)
+            except Exception as e:
+                logger.warning(f"[{self.name}] Shared cache write failed: {str(e)}")
+        self._set_local(key, value, size)
+    
+    async def set_async(self, key, value, size=None, share=True):
+        """set() for event-loop callers: a shared-store write runs on a worker thread."""
+        if share and self.shared is not None:
+            await asyncio.to_thread(self.set, key, value, size, share)
+        else:
+            self.set(key, value, size, share)
+    
+    def _set_local(self, key, value, size):
+        if size > self.max_bytes:
+            logger.debug(f"[{self.name}] Not caching {size} byte entry larger than the {self.max_bytes} byte budget")
+            # Drop any older value so the key stops serving stale data
+            with self._lock:
+                if key in self._entries:
+                    self._remove(key)
+            return
+        
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+            
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+    
+    def delete(self, key):
+        """Remove an entry if present."""
+        if self.shared is not None:
+            try:
+                self.shared.delete(self.name, key)
+            except Exception as e:
+                logger.warning(f"[{self.name}] Shared cache delete failed: {str(e)}")
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+    
+    def purge_expired(self):
+        """Drop every expired entry. Returns the number of entries removed."""
+        now = time.time()
+        with self._lock:
+            expired_keys = [k for k, (_, _, expires_at) in self._entries.items()
+                            if expires_at is not None and now >= expires_at]
+            for key in expired_keys:
+                self._remove(key)
+            self.expirations += len(expired_keys)
+        return len(expired_keys)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+    
+    def stats(self):
+        """Return entry/byte usage and hit, miss and eviction counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_hits": self.shared_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+    
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _remove(self, key):
+        # Caller must hold the lock
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+# Registry of shared namespaces so every module sees the same cache instances
+_namespaces = {}
+_namespaces_lock = threading.Lock()
+
+
+def get_cache(namespace, max_bytes=None, ttl=DEFAULT_TTL, sliding_ttl=False):
+    """
+    Return the shared cache for a namespace, creating it on first use.
+    
+    Args:
+        namespace (str): Namespace name, e.g. "tts", "stt" or "responses".
+        max_bytes (int): Byte budget; defaults to DEFAULT_NAMESPACE_BUDGETS or 16 MB.
+        ttl (float): Entry lifetime in seconds, or None for no expiry.
+        sliding_ttl (bool): Whether a hit restarts the entry's TTL.
+        
+    Returns:
+        LRUCache: The namespace's cache, backed by the shared store when SHARED_CACHE is set.
+    """
+    with _namespaces_lock:
+        cache = _namespaces.get(namespace)
+        if cache is None:
+            if max_bytes is None:
+                max_bytes = DEFAULT_NAMESPACE_BUDGETS.get(namespace, 16 * 1024 * 1024)
+            cache = LRUCache(namespace, max_bytes, ttl=ttl, sliding_ttl=sliding_ttl, shared=shared_store())
+            _namespaces[namespace] = cache
+        return cache
+
+
+def all_cache_stats():
+    """Return stats for every registered namespace."""
+    with _namespaces_lock:
+        caches = list(_namespaces.values())
+    return {cache.name: cache.stats() for cache in caches}
+
+
+def purge_all_expired():
+    """Purge expired entries from every namespace and the shared store. Returns the total removed."""
+    with _namespaces_lock:
+        caches = list(_namespaces.values())
+    removed = sum(cache.purge_expired() for cache in caches)
+    store = shared_store()
+    if store is not None:
+        removed += store.purge_expired()
+    return removed
@@ -0,0 +1,272 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import logging
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from providers import create_generative_model
+from shared_cache import shared_store
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = 'gemini-2.0-flash'
+
+SYSTEM_INSTRUCTION = """
+Respond using clear, grammatically correct, and well-structured language. Keep your responses concise and direct.
+For simple topics, use 3-4 short sentences. For complex topics, provide a brief explanation of 5-7 sentences maximum.
+
+Do not use asterisks, special characters, or emojis. Maintain a conversational, helpful tone as if you're speaking
+directly to the person. Answer questions directly without unnecessary preamble.
+
+Consider the conversation history when responding. Make your response relevant to the entire conversation,
+not just the most recent message.
+"""
+
+GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "max_output_tokens": 400,  # Reduced for even shorter responses
+    "top_p": 0.9,
+    "top_k": 40
+}
+
+# History is budgeted in tokens, not turns: a few long answers must not blow up the prompt
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))
+SUMMARY_TOKEN_BUDGET = 200
+CHARS_PER_TOKEN = 4  # Rough English average; avoids a count_tokens round trip per turn
+SUMMARY_TIMEOUT = 60  # Seconds after which a summary that never landed no longer blocks the next one
+
+# With SHARED_CACHE set, histories live in the shared store so every worker sees the same conversation
+CONVERSATION_NAMESPACE = "conversations"
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", 86400))  # Idle conversations are forgotten
+CONVERSATION_STORE_BYTES = int(os.getenv("CONVERSATION_STORE_BYTES", 64 * 1024 * 1024))
+
+SUMMARY_INSTRUCTION = (
+    "Summarize the conversation below for use as context in later turns. Keep names, facts, "
+    "decisions and open questions; drop pleasantries. Write at most 5 plain sentences."
+)
+
+# Optimization: Build the models once. The system instruction travels as its own field
+# instead of being pasted in front of every prompt
+chat_model = create_generative_model(GEMINI_MODEL, system_instruction=SYSTEM_INSTRUCTION,
+                                    generation_config=GENERATION_CONFIG)
+summary_model = create_generative_model(GEMINI_MODEL, system_instruction=SUMMARY_INSTRUCTION,
+                                       generation_config={"temperature": 0.0, "max_output_tokens": SUMMARY_TOKEN_BUDGET})
+
+# Cheap rephrasings that never change what is being asked; stripped for near-duplicate matching
+FILLER_WORDS = re.compile(r"\b(?:please|pls|kindly)\b")
+FILLER_PREFIX = re.compile(
+    r"^(?:(?:hey|hi|hello|ok|okay|so|um|uh|well)\s+)*"
+    r"(?:(?:can|could|would|will) you\s+(?:tell me\s+|explain\s+)?)?"
+)
+
+# Summaries run off the request path
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarizer")
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def normalize_prompt(prompt):
+    """Canonical form of a prompt for cache keys: Unicode-normalized, case-folded, single-spaced, without trailing punctuation."""
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    return " ".join(text.split()).rstrip(" ?!.")
+
+
+def loose_prompt(prompt):
+    """normalize_prompt with filler words and punctuation dropped, for near-duplicate matching."""
+    text = " ".join(re.sub(r"[^\w\s']", " ", FILLER_WORDS.sub(" ", normalize_prompt(prompt))).split())
+    return FILLER_PREFIX.sub("", text)
+
+
+def history_digest(summary, turns):
+    """Digest of the context Gemini sees before the new message; empty history always hashes the same."""
+    history = [summary] + [[user["parts"][0], model["parts"][0]] for user, model, _ in turns]
+    return hashlib.blake2b(json.dumps(history).encode(), digest_size=16).hexdigest()
+
+
+class Conversation:
+    """
+    One user's chat state: a running summary of older turns plus recent turns kept verbatim.
+
+    Turns are stored as ready-made Gemini contents, so a new turn only appends the new
+    message instead of re-concatenating the whole history. When the verbatim turns exceed
+    HISTORY_TOKEN_BUDGET the oldest ones are folded into the summary in the background;
+    they stay in the context until their summary lands.
+
+    With a shared store the state is reloaded before each read and every change is an
+    atomic read-modify-write of the stored state, so requests from one user may land
+    on any worker process.
+    """
+
+    def __init__(self, user_id=None, store=None):
+        self.user_id = user_id
+        self._store = store
+        self._lock = threading.Lock()
+        self.summary = ""
+        self.turns = deque()  # (user content, model content, tokens)
+        self.history_tokens = 0
+        self.generation = 0  # Bumped on reset so late summaries are discarded
+        self.summarizing = 0.0  # When a pending summary was started, 0 if none
+
+    def __len__(self):
+        return len(self.turns)
+
+    def contents(self, prompt):
+        """Return the Gemini contents for a new user message: summary, recent turns, message."""
+        with self._lock:
+            self._load()
+            return self._contents(prompt)
+
+    def snapshot(self, prompt):
+        """Return (contents for a new message, digest of the history they contain) from one consistent state."""
+        with self._lock:
+            self._load()
+            return self._contents(prompt), history_digest(self.summary, self.turns)
+
+    def record(self, prompt, reply):
+        """Append a finished exchange and schedule summarization if over budget."""
+        tokens = estimate_tokens(prompt) + estimate_tokens(reply)
+
+        def append():
+            self.turns.append(({"role": "user", "parts": [prompt]}, {"role": "model", "parts": [reply]}, tokens))
+            self.history_tokens += tokens
+            if (self.history_tokens <= HISTORY_TOKEN_BUDGET or len(self.turns) < 2
+                    or time.time() - self.summarizing < SUMMARY_TIMEOUT):
+                return None
+            # Fold the oldest turns until the rest fit in half the budget, always keeping the latest
+            folded = []
+            remaining = self.history_tokens
+            for turn in list(self.turns)[:-1]:
+                if remaining <= HISTORY_TOKEN_BUDGET // 2:
+                    break
+                folded.append(turn)
+                remaining -= turn[2]
+            self.summarizing = time.time()
+            return self.summary, folded, self.generation
+
+        pending = self._update(append)
+        if pending is not None:
+            summary_executor.submit(self._summarize, *pending)
+
+    def reset(self):
+        def clear():
+            self._clear()
+            self.generation += 1
+        self._update(clear)
+
+    def _contents(self, prompt):
+        # Caller must hold the lock
+        contents = []
+        if self.summary:
+            contents.append({"role": "user", "parts": [f"Summary of our earlier conversation: {self.summary}"]})
+            contents.append({"role": "model", "parts": ["Got it."]})
+        for user_content, model_content, _ in self.turns:
+            contents.append(user_content)
+            contents.append(model_content)
+        contents.append({"role": "user", "parts": [prompt]})
+        return contents
+
+    def _clear(self):
+        # Caller must hold the lock
+        self.summary = ""
+        self.turns.clear()
+        self.history_tokens = 0
+        self.summarizing = 0.0
+
+    def _state(self):
+        return {"summary": self.summary, "generation": self.generation, "summarizing": self.summarizing,
+                "turns": [[user["parts"][0], model["parts"][0], tokens] for user, model, tokens in self.turns]}
+
+    def _apply_state(self, data):
+        # Caller must hold the lock; data is the stored JSON state, or None if there is none
+        self._clear()
+        if data is None:
+            return
+        state = json.loads(data)
+        self.summary = state["summary"]
+        self.generation = state["generation"]
+        self.summarizing = state["summarizing"]
+        for prompt, reply, tokens in state["turns"]:
+            self.turns.append(({"role": "user", "parts": [prompt]}, {"role": "model", "parts": [reply]}, tokens))
+            self.history_tokens += tokens
+
+    def _load(self):
+        # Caller must hold the lock; picks up turns recorded by other worker processes
+        if self._store is None:
+            return
+        try:
+            self._apply_state(self._store.get(CONVERSATION_NAMESPACE, self.user_id))
+        except Exception as e:
+            logger.warning(f"Could not load shared conversation state, using local copy: {str(e)}")
+
+    def _update(self, change):
+        """Apply change() to the latest state, persist it if shared, and return change's result."""
+        with self._lock:
+            if self._store is None:
+                return change()
+            result = []
+
+            def apply(data):
+                self._apply_state(data)
+                result.append(change())
+                return json.dumps(self._state())
+
+            try:
+                self._store.update(CONVERSATION_NAMESPACE, self.user_id, apply)
+            except Exception as e:
+                logger.warning(f"Could not update shared conversation state, keeping it locally: {str(e)}")
+                if not result:
+                    result.append(change())
+            return result[0]
+
+    def _summarize(self, previous_summary, folded, generation):
+        transcript = "".join(f"User: {u['parts'][0]}\nAssistant: {m['parts'][0]}\n" for u, m, _ in folded)
+        if previous_summary:
+            transcript = f"Earlier summary: {previous_summary}\n\n{transcript}"
+        try:
+            summary = summary_model.generate_content(transcript).text.replace('*', '').strip()
+        except Exception as e:
+            # Without a summary the folded turns are simply dropped, like the old turn cap
+            logger.warning(f"Conversation summarization failed, dropping {len(folded)} old turns: {str(e)}")
+            summary = previous_summary
+
+        def fold():
+            # A reset, or another worker folding these turns first, makes this summary stale
+            if generation != self.generation or list(self.turns)[:len(folded)] != folded:
+                return False
+            for _ in folded:
+                _, _, tokens = self.turns.popleft()
+                self.history_tokens -= tokens
+            self.summary = summary
+            self.summarizing = 0.0
+            return True
+
+        if self._update(fold):
+            logger.debug(f"Folded {len(folded)} turns into a {estimate_tokens(summary)} token summary, "
+                         f"{self.history_tokens} tokens of history remain")
+
+
+store = shared_store()
+if store is not None:
+    store.register(CONVERSATION_NAMESPACE, CONVERSATION_STORE_BYTES, ttl=CONVERSATION_TTL, sliding_ttl=True)
+
+conversations = {}
+conversations_lock = threading.Lock()
+
+
+def get_conversation(user_id):
+    with conversations_lock:
+        conversation = conversations.get(user_id)
+        if conversation is None:
+            conversation = conversations[user_id] = Conversation(user_id, store)
+        return conversation
+
+
+def reset_conversation(user_id):
+    get_conversation(user_id).reset()
@@ -0,0 +1,322 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+from metrics import observe_stage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.db"
+TOUCH_FLUSH_THRESHOLD = 64  # Batch access-time updates so hits don't each write to SQLite
+EVICTION_BATCH_SIZE = 64
+LOW_WATERMARK = 0.9  # Evict down to 90% of quota so we don't evict on every write
+BUSY_TIMEOUT_MS = 5000  # How long SQLite waits for another worker's write to the shared index
+
+
+def content_digest(data):
+    """Fast content hash used for ETags."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_content_digest(path):
+    """content_digest of a file's bytes, hashed in chunks instead of reading it whole."""
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+
+class DiskCache:
+    """
+    Sharded, content-addressed file cache with an on-disk SQLite index.
+
+    Files live at <root>/<key[:2]>/<key><ext>. The index tracks size, last access
+    and hit count per key, so quota eviction picks victims with an indexed query
+    instead of scanning the directory. Every worker process shares the index, so
+    byte totals are always read from it rather than kept per process.
+    """
+
+    def __init__(self, root, ext, max_bytes, policy="lru", adopt_legacy=True):
+        """
+        Args:
+            root (str): Cache directory.
+            ext (str): File extension for entries, e.g. ".wav".
+            max_bytes (int): Total byte quota for all entries.
+            policy (str): "lru" (least recently used) or "lfu" (least hits, then oldest access).
+            adopt_legacy (bool): Move files from the old flat layout into the index. Pass
+                False when the key scheme changed since, so those files are deleted instead
+                of occupying quota under keys nothing looks up.
+        """
+        if policy not in ("lru", "lfu"):
+            raise ValueError("policy must be 'lru' or 'lfu'")
+        self.root = root
+        self.ext = ext
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._pending_touches = {}  # key -> (last_access, extra_hits)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, INDEX_FILENAME), check_same_thread=False)
+        self._db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                digest TEXT
+            )
+        """)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(entries)")]
+        if "digest" not in columns:
+            self._db.execute("ALTER TABLE entries ADD COLUMN digest TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_hits ON entries(hits, last_access)")
+        self._db.commit()
+
+        if adopt_legacy:
+            self._adopt_legacy_files()
+        else:
+            self._discard_legacy_files()
+
+        count, total = self._totals()
+        logger.debug(f"Disk cache {root}: {count} entries, {total} bytes (quota {max_bytes})")
+
+    def path_for(self, key):
+        """Return the sharded file path for a key (whether or not it exists)."""
+        return os.path.join(self.root, key[:2], f"{key}{self.ext}")
+
+    def contains(self, key):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def get_path(self, key):
+        """
+        Look up a key and record the access.
+
+        Returns:
+            str or None: Path of the cached file, or None on a miss.
+        """
+        entry = self.lookup(key)
+        return entry[0] if entry is not None else None
+
+    def lookup(self, key):
+        """
+        Look up a key, record the access and return its content digest for ETags.
+
+        Returns:
+            tuple or None: (path, digest) of the cached file, or None on a miss.
+        """
+        start = time.perf_counter()
+        path = self.path_for(key)
+        with self._lock:
+            row = self._db.execute("SELECT size, digest FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                observe_stage("disk_cache_lookup", time.perf_counter() - start, "miss")
+                return None
+            if not os.path.exists(path):
+                # File removed behind our back - drop the stale index row
+                self._delete_rows([(key, row[0])])
+                self._db.commit()
+                self.misses += 1
+                observe_stage("disk_cache_lookup", time.perf_counter() - start, "miss")
+                return None
+
+            self.hits += 1
+            _, extra_hits = self._pending_touches.get(key, (0, 0))
+            self._pending_touches[key] = (time.time(), extra_hits + 1)
+            if len(self._pending_touches) >= TOUCH_FLUSH_THRESHOLD:
+                self._flush_touches()
+            digest = row[1]
+
+        if digest is None:
+            # Entries adopted from the legacy layout are hashed on first use
+            digest = file_content_digest(path)
+            with self._lock:
+                self._db.execute("UPDATE entries SET digest = ? WHERE key = ?", (digest, key))
+                self._db.commit()
+        observe_stage("disk_cache_lookup", time.perf_counter() - start, "hit")
+        return path, digest
+
+    def read(self, key):
+        """Return the cached bytes for key, or None on a miss."""
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def peek(self, key):
+        """Return the cached bytes for key without counting an access (for prewarming), or None."""
+        try:
+            with open(self.path_for(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def read_text(self, key):
+        data = self.read(key)
+        return data.decode("utf-8") if data is not None else None
+
+    def write(self, key, data):
+        """Atomically store bytes under key and evict entries if over quota."""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temp file then rename so readers never see partial files
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        digest = content_digest(data)
+        now = time.time()
+        with self._lock:
+            self._flush_touches()
+            # One IMMEDIATE transaction per write, so the quota check sees every worker's entries
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, size, created, last_access, hits, digest) VALUES (?, ?, ?, ?, 0, ?)",
+                    (key, len(data), now, now, digest)
+                )
+                _, total = self._totals()
+                if total > self.max_bytes:
+                    self._evict_to(total, int(self.max_bytes * LOW_WATERMARK))
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+
+    def write_text(self, key, text):
+        self.write(key, text.encode("utf-8"))
+
+    def remove_idle(self, max_idle_seconds):
+        """Remove entries not accessed for max_idle_seconds. Returns the number removed."""
+        cutoff = time.time() - max_idle_seconds
+        with self._lock:
+            self._flush_touches()
+            rows = self._db.execute("SELECT key, size FROM entries WHERE last_access < ?", (cutoff,)).fetchall()
+            self._delete_rows(rows)
+            self._db.commit()
+        return len(rows)
+
+    def hottest(self, limit):
+        """Return up to limit (key, hits) pairs ordered by hit count, most popular first."""
+        with self._lock:
+            self._flush_touches()
+            return self._db.execute(
+                "SELECT key, hits FROM entries WHERE hits > 0 ORDER BY hits DESC, last_access DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+
+    def stats(self):
+        """Entry and byte totals from the shared index, plus this process's hit counters."""
+        with self._lock:
+            count, total = self._totals()
+            return {
+                "entries": count,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _totals(self):
+        return self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+    def _flush_touches(self):
+        # Caller must hold the lock
+        if not self._pending_touches:
+            return
+        self._db.executemany(
+            "UPDATE entries SET last_access = ?, hits = hits + ? WHERE key = ?",
+            [(last_access, hits, key) for key, (last_access, hits) in self._pending_touches.items()]
+        )
+        self._db.commit()
+        self._pending_touches.clear()
+
+    def _evict_to(self, total_bytes, target_bytes):
+        # Caller must hold the lock and an open write transaction. Evicts in small batches until under target.
+        order = "last_access" if self.policy == "lru" else "hits, last_access"
+        while total_bytes > target_bytes:
+            rows = self._db.execute(
+                f"SELECT key, size FROM entries ORDER BY {order} LIMIT ?", (EVICTION_BATCH_SIZE,)
+            ).fetchall()
+            if not rows:
+                break
+            removed_bytes = 0
+            victims = []
+            for key, size in rows:
+                victims.append((key, size))
+                removed_bytes += size
+                if total_bytes - removed_bytes <= target_bytes:
+                    break
+            self._delete_rows(victims)
+            total_bytes -= removed_bytes
+            self.evictions += len(victims)
+        logger.debug(f"Disk cache {self.root} evicted down to {total_bytes} bytes")
+
+    def _delete_rows(self, rows):
+        # Caller must hold the lock and commit
+        if not rows:
+            return
+        for key, _ in rows:
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+            self._pending_touches.pop(key, None)
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in rows])
+
+    def _adopt_legacy_files(self):
+        # One-time migration of files from the old flat layout into shards + index
+        legacy = [entry for entry in os.scandir(self.root)
+                  if entry.is_file() and entry.name.endswith(self.ext)]
+        if not legacy:
+            return
+        rows = []
+        for entry in legacy:
+            key = entry.name[:-len(self.ext)]
+            stat = entry.stat()
+            target = self.path_for(key)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(entry.path, target)
+            rows.append((key, stat.st_size, stat.st_mtime, stat.st_mtime))
+        self._db.executemany(
+            "INSERT OR REPLACE INTO entries (key, size, created, last_access, hits) VALUES (?, ?, ?, ?, 0)", rows
+        )
+        self._db.commit()
+        logger.info(f"Moved {len(rows)} legacy cache files in {self.root} into the sharded layout")
+
+    def _discard_legacy_files(self):
+        # Legacy flat-layout files, and adopted entries never served since (no digest yet),
+        # are keyed by a retired scheme
+        removed = 0
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.name.endswith(self.ext):
+                os.remove(entry.path)
+                removed += 1
+        rows = self._db.execute("SELECT key, size FROM entries WHERE digest IS NULL").fetchall()
+        for key, _ in rows:
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in rows])
+        self._db.commit()
+        if removed or rows:
+            logger.info(f"Removed {removed + len(rows)} cache files with retired keys from {self.root}")
@@ -0,0 +1,425 @@
+"""
+Local stand-ins for Cartesia, Deepgram, Gemini and the Redis shared cache.
+
+They mimic the slice of each SDK the backend uses, with configurable latency,
+error rate and payload size, so the servers can be load-tested offline without
+spending quota. Select them with UPSTREAM_PROVIDER=fake (or TTS_PROVIDER,
+STT_PROVIDER, LLM_PROVIDER, CACHE_PROVIDER individually; see providers.py).
+
+Per-service settings, where <SVC> is TTS, STT, LLM or CACHE:
+    FAKE_<SVC>_MEDIAN_MS    Median time to first byte (lognormal distribution)
+    FAKE_<SVC>_SIGMA        Lognormal shape; 0 makes latency constant
+    FAKE_<SVC>_ERROR_RATE   Fraction of calls that fail, 0-1
+    FAKE_<SVC>_STALL_RATE   Fraction of calls that hang for STALL_SECONDS (until the request timeout)
+Payload settings:
+    FAKE_TTS_SECONDS_PER_CHAR   Audio length generated per input character
+    FAKE_TTS_CHUNK_MS           Audio per streamed chunk
+    FAKE_TTS_REALTIME_FACTOR    Generation speed relative to playback (chunks are paced accordingly)
+    FAKE_STT_LIVE_BYTES_PER_WORD  Streamed audio per recognized word (live transcription)
+    FAKE_LLM_REPLY_WORDS        Words per reply
+    FAKE_LLM_WORDS_PER_CHUNK    Words per streamed chunk
+    FAKE_LLM_CHUNK_MS           Pause between streamed chunks
+    FAKE_CACHE_MAX_BYTES        Memory limit of the Redis stand-in (evicts least recently used keys)
+"""
+import os
+import math
+import time
+import threading
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+import numpy as np
+from audio_format import build_wav, encode_samples, MASTER_ENCODING, MASTER_SAMPLE_RATE
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+STALL_SECONDS = 60
+FILLER_WORDS = ("the quick answer is that this depends on context and a few practical details "
+                "worth keeping in mind when you plan the next step carefully").split()
+
+
+class FakeUpstreamError(Exception):
+    """Injected upstream failure."""
+
+
+class LatencyProfile:
+    """Lognormal latency plus an injected error rate for one fake service."""
+
+    def __init__(self, service, median_ms, sigma=0.35, error_rate=0.0, stall_rate=0.0):
+        self.service = service
+        self.median = float(os.getenv(f"FAKE_{service}_MEDIAN_MS", median_ms)) / 1000
+        self.sigma = float(os.getenv(f"FAKE_{service}_SIGMA", sigma))
+        self.error_rate = float(os.getenv(f"FAKE_{service}_ERROR_RATE", error_rate))
+        self.stall_rate = float(os.getenv(f"FAKE_{service}_STALL_RATE", stall_rate))
+
+    def sample(self):
+        if self.stall_rate and random.random() < self.stall_rate:
+            return STALL_SECONDS
+        if self.sigma <= 0 or self.median <= 0:
+            return self.median
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+    def maybe_fail(self):
+        if random.random() < self.error_rate:
+            raise FakeUpstreamError(f"Injected {self.service} failure")
+
+    def wait(self, timeout=None):
+        """Sleep for a sampled latency, failing like an SDK would if it exceeds timeout (seconds)."""
+        delay = self.sample()
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise FakeUpstreamError(f"{self.service} request timed out after {timeout:.2f}s")
+        time.sleep(delay)
+        self.maybe_fail()
+
+    async def wait_async(self, timeout=None):
+        delay = self.sample()
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise FakeUpstreamError(f"{self.service} request timed out after {timeout:.2f}s")
+        await asyncio.sleep(delay)
+        self.maybe_fail()
+
+
+def _request_timeout(request_options, name):
+    # SDKs take per-request timeouts in request_options; None means the default (no limit here)
+    return (request_options or {}).get(name)
+
+
+def _transport_timeout(timeout):
+    # Deepgram takes an httpx.Timeout (or plain seconds); the read timeout bounds the wait
+    return getattr(timeout, "read", timeout)
+
+
+# --- Cartesia ---
+
+TTS_SECONDS_PER_CHAR = float(os.getenv("FAKE_TTS_SECONDS_PER_CHAR", 0.06))
+TTS_CHUNK_MS = int(os.getenv("FAKE_TTS_CHUNK_MS", 100))
+TTS_REALTIME_FACTOR = float(os.getenv("FAKE_TTS_REALTIME_FACTOR", 20))
+
+
+def _fake_speech(transcript, output_format):
+    """Render a deterministic tone whose length follows the transcript, in the requested format."""
+    encoding = output_format.get("encoding", MASTER_ENCODING)
+    sample_rate = output_format.get("sample_rate", MASTER_SAMPLE_RATE)
+    frames = max(1, int(len(transcript) * TTS_SECONDS_PER_CHAR * sample_rate))
+    pitch = 120 + (sum(transcript.encode("utf-8")) % 120)
+    t = np.arange(frames, dtype=np.float32) / sample_rate
+    samples = (0.3 * np.sin(2 * np.pi * pitch * t)).astype(np.float32)[:, None]
+    pcm = encode_samples(samples, encoding)
+    return build_wav(pcm, encoding, sample_rate), len(pcm) * sample_rate // frames
+
+
+def _chunk_plan(wav, bytes_per_second):
+    """Split a WAV into streamed chunks and the pause between them."""
+    chunk_bytes = max(1024, int(bytes_per_second * TTS_CHUNK_MS / 1000))
+    pause = TTS_CHUNK_MS / 1000 / TTS_REALTIME_FACTOR
+    return [wav[i:i + chunk_bytes] for i in range(0, len(wav), chunk_bytes)], pause
+
+
+class _FakeTTSResource:
+    def __init__(self, profile):
+        self.profile = profile
+
+    def bytes(self, model_id=None, transcript="", voice=None, language=None, output_format=None,
+              request_options=None, **kwargs):
+        self.profile.wait(_request_timeout(request_options, "timeout_in_seconds"))
+        wav, bytes_per_second = _fake_speech(transcript, output_format or {})
+        chunks, pause = _chunk_plan(wav, bytes_per_second)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(pause)
+            yield chunk
+
+    # The streaming path calls tts.stream with the same arguments
+    stream = bytes
+
+
+class _FakeAsyncTTSResource:
+    def __init__(self, profile):
+        self.profile = profile
+
+    async def bytes(self, model_id=None, transcript="", voice=None, language=None, output_format=None,
+                    request_options=None, **kwargs):
+        await self.profile.wait_async(_request_timeout(request_options, "timeout_in_seconds"))
+        wav, bytes_per_second = _fake_speech(transcript, output_format or {})
+        chunks, pause = _chunk_plan(wav, bytes_per_second)
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(pause)
+            yield chunk
+
+
+class FakeCartesia:
+    def __init__(self, api_key=None):
+        self.tts = _FakeTTSResource(LatencyProfile("TTS", median_ms=250))
+
+
+class FakeAsyncCartesia:
+    def __init__(self, api_key=None):
+        self.tts = _FakeAsyncTTSResource(LatencyProfile("TTS", median_ms=250))
+
+
+# --- Deepgram ---
+
+class _FakeDeepgramResponse:
+    def __init__(self, transcript):
+        self._body = {"results": {"channels": [{"alternatives": [{"transcript": transcript, "confidence": 0.97}]}]}}
+
+    def to_dict(self):
+        return self._body
+
+
+def _fake_transcript(source):
+    # Stable per upload so cache and dedupe behaviour matches the real service
+    audio = source.get("buffer", b"") if isinstance(source, dict) else b""
+    words = max(2, len(audio) // 16000)
+    offset = len(audio) % len(FILLER_WORDS)
+    return " ".join(FILLER_WORDS[(offset + i) % len(FILLER_WORDS)] for i in range(min(words, 40))).capitalize() + "."
+
+
+class _FakeTranscriber:
+    def __init__(self, profile, is_async):
+        self.profile = profile
+        self.is_async = is_async
+
+    def v(self, version):
+        return self
+
+    def transcribe_file(self, source, options=None, timeout=None, **kwargs):
+        if self.is_async:
+            return self._transcribe_file_async(source, _transport_timeout(timeout))
+        self.profile.wait(_transport_timeout(timeout))
+        return _FakeDeepgramResponse(_fake_transcript(source))
+
+    async def _transcribe_file_async(self, source, timeout):
+        await self.profile.wait_async(timeout)
+        return _FakeDeepgramResponse(_fake_transcript(source))
+
+
+STT_LIVE_BYTES_PER_WORD = int(os.getenv("FAKE_STT_LIVE_BYTES_PER_WORD", 8000))
+STT_LIVE_WORDS_PER_SEGMENT = 6
+
+
+class _FakeLiveResult:
+    """The fields of Deepgram's LiveResultResponse the backend reads."""
+
+    def __init__(self, transcript, is_final, from_finalize=False):
+        alternative = type("Alternative", (), {"transcript": transcript, "confidence": 0.95})()
+        self.channel = type("Channel", (), {"alternatives": [alternative]})()
+        self.is_final = is_final
+        self.speech_final = is_final
+        self.from_finalize = from_finalize
+
+
+class _FakeLiveConnection:
+    """
+    Stand-in for Deepgram's asyncio live client: interim results as audio arrives, a final
+    result every few words, and a flushed final result shortly after finalize().
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.handlers = []
+        self.words = 0  # Words recognized so far
+        self.finalized_words = 0
+        self.audio_bytes = 0
+
+    def on(self, event, handler):
+        self.handlers.append(handler)
+
+    async def start(self, options=None, **kwargs):
+        # Opening the socket costs a handshake, not a full transcription
+        await asyncio.sleep(self.profile.sample() / 4)
+        self.profile.maybe_fail()
+        return True
+
+    async def send(self, data):
+        self.audio_bytes += len(data)
+        words = self.audio_bytes // STT_LIVE_BYTES_PER_WORD
+        if words == self.words:
+            return True
+        self.words = words
+        if self.words - self.finalized_words >= STT_LIVE_WORDS_PER_SEGMENT:
+            await self._emit(self._pending_text(), is_final=True)
+            self.finalized_words = self.words
+        else:
+            await self._emit(self._pending_text(), is_final=False)
+        return True
+
+    async def finalize(self):
+        # Latency to flush is a fraction of a full request; the audio is already there
+        await asyncio.sleep(self.profile.sample() / 4)
+        self.profile.maybe_fail()
+        self.words = max(self.words, self.finalized_words + (1 if self.audio_bytes % STT_LIVE_BYTES_PER_WORD else 0))
+        await self._emit(self._pending_text(), is_final=True, from_finalize=True)
+        self.finalized_words = self.words
+        return True
+
+    async def finish(self):
+        return True
+
+    def _pending_text(self):
+        return " ".join(FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(self.finalized_words, self.words))
+
+    async def _emit(self, transcript, is_final, from_finalize=False):
+        result = _FakeLiveResult(transcript, is_final, from_finalize)
+        for handler in self.handlers:
+            await handler(self, result=result)
+
+
+class _FakeLiveFactory:
+    def __init__(self, profile):
+        self.profile = profile
+
+    def v(self, version):
+        return _FakeLiveConnection(self.profile)
+
+
+class _FakeListen:
+    def __init__(self, profile):
+        self.rest = _FakeTranscriber(profile, is_async=False)
+        self.asyncrest = _FakeTranscriber(profile, is_async=True)
+        self.asyncwebsocket = _FakeLiveFactory(profile)
+
+
+class FakeDeepgramClient:
+    def __init__(self, api_key=None):
+        self.listen = _FakeListen(LatencyProfile("STT", median_ms=400))
+
+
+# --- Gemini ---
+
+LLM_REPLY_WORDS = int(os.getenv("FAKE_LLM_REPLY_WORDS", 60))
+LLM_WORDS_PER_CHUNK = int(os.getenv("FAKE_LLM_WORDS_PER_CHUNK", 8))
+LLM_CHUNK_INTERVAL = float(os.getenv("FAKE_LLM_CHUNK_MS", 40)) / 1000
+
+
+class _FakeGenerateResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def _fake_reply(contents):
+    last = contents[-1] if isinstance(contents, list) and contents else contents
+    prompt = last["parts"][0] if isinstance(last, dict) else str(last)
+    words = [FILLER_WORDS[(len(prompt) + i) % len(FILLER_WORDS)] for i in range(LLM_REPLY_WORDS)]
+    sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+    return " ".join(sentences)
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name=None, system_instruction=None, generation_config=None, **kwargs):
+        self.model_name = model_name
+        self.profile = LatencyProfile("LLM", median_ms=600)
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        self.profile.wait(_request_timeout(request_options, "timeout"))
+        reply = _fake_reply(contents)
+        if not stream:
+            return _FakeGenerateResponse(reply)
+        return self._stream(reply)
+
+    def _stream(self, reply):
+        words = reply.split(" ")
+        for i in range(0, len(words), LLM_WORDS_PER_CHUNK):
+            if i:
+                time.sleep(LLM_CHUNK_INTERVAL)
+            yield _FakeGenerateResponse(" ".join(words[i:i + LLM_WORDS_PER_CHUNK]) + " ")
+
+    async def generate_content_async(self, contents, request_options=None, **kwargs):
+        await self.profile.wait_async(_request_timeout(request_options, "timeout"))
+        return _FakeGenerateResponse(_fake_reply(contents))
+
+
+# --- Redis (shared cache) ---
+
+CACHE_MAX_BYTES = int(os.getenv("FAKE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+class FakeRedis:
+    """
+    In-process stand-in for the redis.Redis calls shared_cache.RedisStore makes.
+
+    Behaves like a server with maxmemory and the allkeys-lru policy. One instance
+    shared by several caches in a process stands in for a server shared by workers.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.profile = LatencyProfile("CACHE", median_ms=0.2)
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._bytes = 0
+
+    def get(self, name):
+        self.profile.wait()
+        with self._lock:
+            entry = self._live(name)
+            if entry is None:
+                return None
+            self._data.move_to_end(name)
+            return entry[0]
+
+    def set(self, name, value, px=None, nx=False):
+        self.profile.wait()
+        value = value.encode() if isinstance(value, str) else bytes(value)
+        with self._lock:
+            if nx and self._live(name) is not None:
+                return None
+            self._remove(name)
+            self._data[name] = (value, time.time() + px / 1000 if px is not None else None)
+            self._bytes += len(name) + len(value)
+            while self._bytes > self.max_bytes and len(self._data) > 1:
+                self._remove(next(iter(self._data)))
+            return True
+
+    def delete(self, *names):
+        self.profile.wait()
+        with self._lock:
+            return sum(self._remove(name) for name in names)
+
+    def register_script(self, script):
+        """Return a callable like redis.Script; only the scripts shared_cache.py uses are emulated."""
+        def run(keys=(), args=()):
+            return self.eval(script, len(keys), *keys, *args)
+        return run
+
+    def eval(self, script, numkeys, *keys_and_args):
+        from shared_cache import RELEASE_LOCK_SCRIPT
+        self.profile.wait()
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        if script != RELEASE_LOCK_SCRIPT:
+            raise NotImplementedError("FakeRedis only emulates shared_cache.RELEASE_LOCK_SCRIPT")
+        token = args[0].encode() if isinstance(args[0], str) else bytes(args[0])
+        with self._lock:
+            entry = self._live(keys[0])
+            if entry is None or entry[0] != token:
+                return 0
+            return self._remove(keys[0])
+
+    def pexpire(self, name, milliseconds):
+        with self._lock:
+            entry = self._live(name)
+            if entry is None:
+                return False
+            self._data[name] = (entry[0], time.time() + milliseconds / 1000)
+            return True
+
+    def _live(self, name):
+        # Caller must hold the lock
+        entry = self._data.get(name)
+        if entry is not None and entry[1] is not None and time.time() >= entry[1]:
+            self._remove(name)
+            return None
+        return entry
+
+    def _remove(self, name):
+        # Caller must hold the lock
+        entry = self._data.pop(name, None)
+        if entry is None:
+            return 0
+        self._bytes -= len(name) + len(entry[0])
+        return 1
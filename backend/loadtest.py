@@ -0,0 +1,183 @@
+"""
+Closed-loop load generator for /api/transcribe, /api/convert and /api/gemini.
+
+Run the server against the local stand-in upstreams so no quota is spent:
+
+    UPSTREAM_PROVIDER=fake python wsgi.py
+    python loadtest.py --concurrency 32 --duration 60
+
+Each worker sends one request at a time, picking the endpoint by the --mix
+weights. A --unique fraction of requests get fresh payloads so the caches see a
+realistic mix of hits and misses. The report has throughput, error counts and
+p50/p95/p99 latency per endpoint; --json prints the same as JSON for CI diffing.
+"""
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import itertools
+import numpy as np
+import requests
+from audio_format import build_wav, encode_samples
+
+PHRASES = [
+    "Hello, how can I help you today?",
+    "The weather tomorrow looks sunny with a light breeze.",
+    "Your appointment has been moved to three o'clock.",
+    "Please hold on while I look that up for you.",
+    "Thanks for calling, have a great day!",
+]
+PROMPTS = [
+    "What is a good way to learn a new language?",
+    "Give me a quick tip for better sleep.",
+    "How do I make a simple tomato sauce?",
+    "Why is the sky blue?",
+]
+
+
+def make_wav(seconds, seed):
+    """A short 16 kHz s16 tone; the seed varies pitch so uploads differ in content."""
+    rate = 16000
+    t = np.arange(int(seconds * rate), dtype=np.float32) / rate
+    samples = (0.3 * np.sin(2 * np.pi * (180 + seed % 200) * t)).astype(np.float32)[:, None]
+    return build_wav(encode_samples(samples, "pcm_s16le"), "pcm_s16le", rate)
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.samples = []  # (endpoint, status, seconds, bytes)
+        self.cached_wavs = [make_wav(args.audio_seconds, seed) for seed in range(4)]
+
+    def next_request(self):
+        """Return (endpoint, requests kwargs) for the next request."""
+        endpoint = random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        unique = random.random() < self.args.unique
+        n = next(self.counter)
+        if endpoint == "convert":
+            text = random.choice(PHRASES) + (f" Reference {n}." if unique else "")
+            return endpoint, {"json": {"text": text, "voice": "default", "speed": 1.0}}
+        if endpoint == "gemini":
+            prompt = random.choice(PROMPTS) + (f" (variant {n})" if unique else "")
+            return endpoint, {"json": {"prompt": prompt}}
+        wav = make_wav(self.args.audio_seconds, 1000 + n) if unique else random.choice(self.cached_wavs)
+        return endpoint, {"files": {"audio": ("clip.wav", io.BytesIO(wav), "audio/wav")}}
+
+    def worker(self, deadline, remaining):
+        session = requests.Session()
+        while time.time() < deadline:
+            if remaining is not None:
+                with self.lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+            endpoint, kwargs = self.next_request()
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{self.args.url}/api/{endpoint}", timeout=self.args.timeout, **kwargs)
+                status, size = response.status_code, len(response.content)
+            except requests.RequestException:
+                status, size = 0, 0  # Connection error or client timeout
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.samples.append((endpoint, status, elapsed, size))
+
+    def run(self):
+        deadline = time.time() + self.args.duration
+        remaining = [self.args.requests] if self.args.requests else None
+        threads = [threading.Thread(target=self.worker, args=(deadline, remaining), daemon=True)
+                   for _ in range(self.args.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(self.samples, time.perf_counter() - start)
+
+
+def parse_mix(spec):
+    """Parse 'transcribe=1,convert=2,gemini=1' into endpoint weights."""
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ("transcribe", "convert", "gemini"):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(np.ceil(pct / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, wall_seconds):
+    """Aggregate raw samples into per-endpoint and overall latency/throughput stats."""
+    report = {"wall_seconds": round(wall_seconds, 3), "endpoints": {}}
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+    groups["all"] = samples
+    for endpoint, group in groups.items():
+        latencies = sorted(s[2] for s in group)
+        statuses = {}
+        for s in group:
+            statuses[str(s[1])] = statuses.get(str(s[1]), 0) + 1
+        ok = sum(1 for s in group if 200 <= s[1] < 300)
+        report["endpoints"][endpoint] = {
+            "requests": len(group),
+            "ok": ok,
+            "errors": len(group) - ok,
+            "statuses": statuses,
+            "throughput_rps": round(len(group) / wall_seconds, 2) if wall_seconds else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            "mean_response_bytes": int(sum(s[3] for s in group) / len(group)) if group else 0,
+        }
+    return report
+
+
+def print_report(report):
+    print(f"Wall time: {report['wall_seconds']}s")
+    print(f"{'endpoint':<12}{'reqs':>7}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"{endpoint:<12}{stats['requests']:>7}{stats['errors']:>8}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}  {stats['statuses']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the chatbot backend")
+    parser.add_argument("--url", default="http://localhost:5000", help="Server base URL")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent closed-loop workers")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0 = duration only)")
+    parser.add_argument("--mix", default="transcribe=1,convert=2,gemini=1", help="Endpoint weights")
+    parser.add_argument("--unique", type=float, default=0.5, help="Fraction of requests with cache-busting payloads")
+    parser.add_argument("--audio-seconds", type=float, default=3.0, help="Length of uploaded test clips")
+    parser.add_argument("--timeout", type=float, default=30, help="Per-request client timeout")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = LoadTest(args).run()
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+    return report
+
+
+if __name__ == "__main__":
+    main()
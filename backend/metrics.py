@@ -0,0 +1,141 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Route of the request being served; copied into worker threads by admission.WorkQueue
+current_route = contextvars.ContextVar("current_route", default="background")
+
+# Latency buckets in seconds, from sub-millisecond cache lookups to slow upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with a fixed set of label names.
+
+    observe() is a bisect plus two additions under a lock; cumulative bucket
+    counts are only computed when the metrics endpoint is scraped.
+    """
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0] * (len(self.buckets) + 2)
+                self._series[key] = series
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', bound))} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+_registry = []
+
+stage_duration = Histogram(
+    "chatbot_stage_duration_seconds",
+    "Latency of each request processing stage",
+    ("stage", "route", "outcome")
+)
+request_duration = Histogram(
+    "chatbot_request_duration_seconds",
+    "End-to-end request latency until the response body is written",
+    ("route", "status")
+)
+requests_total = Counter(
+    "chatbot_requests_total",
+    "Requests served",
+    ("route", "status")
+)
+
+
+def observe_stage(stage, seconds, outcome="", route=None):
+    """Record one stage timing, labelled with the current request's route."""
+    stage_duration.observe(seconds, stage=stage, route=route or current_route.get(), outcome=outcome)
+
+
+@contextmanager
+def timed(stage, outcome=""):
+    """
+    Time a block as a stage. The yielded dict can set 'outcome' (e.g. hit/miss);
+    exceptions are recorded with outcome 'error'.
+    """
+    labels = {"outcome": outcome}
+    start = time.perf_counter()
+    try:
+        yield labels
+    except BaseException:
+        labels["outcome"] = "error"
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start, labels["outcome"])
+
+
+def render_metrics():
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,152 @@
+"""
+Popularity-driven cache prewarming.
+
+After a deploy or restart the in-memory caches start empty, while the disk caches
+and the access log (access_log.py) survive. On startup and then every
+PREWARM_INTERVAL seconds, the most requested TTS renditions and transcripts are
+loaded from disk into memory, hottest last so they are the least likely to be
+evicted. Popular renditions that are no longer on disk at all are synthesized
+again, up to PREWARM_SYNTH_LIMIT per run at PREWARM_SYNTH_PER_MINUTE, so
+prewarming never competes with live traffic for much Cartesia capacity.
+
+Every worker preloads its own memory caches, but synthesis and access-log decay
+touch state shared by all of them, so only the worker holding the "prewarm" lease
+in the access log does those.
+"""
+import os
+import time
+import uuid
+import threading
+import logging
+import tts
+import stt
+from access_log import access_log
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") == "1"
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", 1800))
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", 500))
+PREWARM_MEMORY_FRACTION = 0.5  # Leave the rest of each memory budget to live traffic
+PREWARM_SYNTH_LIMIT = int(os.getenv("PREWARM_SYNTH_LIMIT", 20))
+PREWARM_SYNTH_PER_MINUTE = float(os.getenv("PREWARM_SYNTH_PER_MINUTE", 10))
+MAX_CONSECUTIVE_FAILURES = 3
+POPULARITY_HALF_LIFE = 7 * 86400  # Seconds for an access to count half as much
+LEASE_NAME = "prewarm"
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+last_run = {}
+_started = False
+_start_lock = threading.Lock()
+
+
+def preload(namespace, memory_cache, disk_cache, decode=None):
+    """
+    Copy the hottest disk entries of a namespace into its memory cache.
+
+    Returns:
+        tuple: (number of entries loaded, [(key, payload)] of popular keys missing on disk)
+    """
+    budget = memory_cache.max_bytes * PREWARM_MEMORY_FRACTION
+    loaded = []
+    missing = []
+    used = 0
+    for key, _, payload in access_log.hottest(namespace, PREWARM_TOP_N):
+        if key in memory_cache:
+            continue
+        data = disk_cache.peek(key)
+        if data is None:
+            missing.append((key, payload))
+            continue
+        if used + len(data) > budget:
+            break
+        used += len(data)
+        loaded.append((key, decode(data) if decode else data))
+    # Insert the hottest last so the LRU evicts it last. Every worker prewarms itself
+    # from the same disk cache, so the entries are not copied to the shared store too
+    for key, value in reversed(loaded):
+        memory_cache.set(key, value, share=False)
+    return len(loaded), missing
+
+
+def synthesize_missing(missing, limit=PREWARM_SYNTH_LIMIT, per_minute=PREWARM_SYNTH_PER_MINUTE):
+    """Re-synthesize popular renditions that fell out of the disk cache, within the rate budget."""
+    interval = 60.0 / per_minute if per_minute > 0 else 0
+    synthesized = 0
+    failures = 0
+    for key, payload in missing:
+        if synthesized >= limit or payload is None:
+            continue
+        start = time.time()
+        try:
+            if "segment" in payload:
+                tts.synthesize_segment(payload["segment"], payload["voice"], payload["speed"])
+            else:
+                tts.text_to_speech_rendition(payload["text"], payload["voice"], payload["speed"],
+                                             payload["encoding"], payload["sample_rate"])
+            synthesized += 1
+            failures = 0
+        except Exception as e:
+            failures += 1
+            logger.warning(f"Prewarm synthesis of {key[:8]}... failed: {str(e)}")
+            if failures >= MAX_CONSECUTIVE_FAILURES:
+                logger.warning("Stopping prewarm synthesis after repeated failures")
+                break
+        time.sleep(max(0.0, interval - (time.time() - start)))
+    return synthesized
+
+
+def prewarm(synthesize=True):
+    """
+    Run one prewarming pass and return what it did.
+
+    Args:
+        synthesize (bool): Also re-synthesize popular renditions missing on disk.
+    """
+    start = time.time()
+    tts_loaded, tts_missing = preload("tts", tts.memory_cache, tts.disk_cache)
+    stt_loaded, _ = preload("stt", stt.memory_cache, stt.disk_cache, decode=lambda data: data.decode("utf-8"))
+    synthesized = synthesize_missing(tts_missing) if synthesize else 0
+
+    result = {
+        "finished_at": time.time(),
+        "seconds": round(time.time() - start, 3),
+        "tts_preloaded": tts_loaded,
+        "stt_preloaded": stt_loaded,
+        "tts_missing": len(tts_missing),
+        "tts_synthesized": synthesized,
+        "leader": synthesize,
+    }
+    last_run.clear()
+    last_run.update(result)
+    logger.info(f"Prewarmed caches: {result}")
+    return result
+
+
+def prewarm_stats():
+    return {"enabled": PREWARM_ENABLED, "interval_seconds": PREWARM_INTERVAL,
+            "last_run": dict(last_run), "access_log": access_log.stats()}
+
+
+def start_prewarming(interval=PREWARM_INTERVAL):
+    """Prewarm now and then every interval seconds on a daemon thread (once per process)."""
+    global _started
+    with _start_lock:
+        if _started or not PREWARM_ENABLED:
+            return
+        _started = True
+
+    def loop():
+        while True:
+            try:
+                # The lease outlives one interval so a leader that is a little late keeps it
+                leader = access_log.try_lease(LEASE_NAME, WORKER_ID, interval * 2)
+                prewarm(synthesize=leader)
+                if leader:
+                    access_log.decay(0.5 ** (interval / POPULARITY_HALF_LIFE))
+            except Exception as e:
+                logger.error(f"Error in prewarm thread: {e}", exc_info=True)
+            time.sleep(interval)
+
+    threading.Thread(target=loop, daemon=True, name="prewarm").start()
@@ -0,0 +1,263 @@
+import os
+import asyncio
+import threading
+import logging
+import importlib.util
+import httpx
+from dotenv import load_dotenv
+
+# Provider selection and API keys may come from .env, so load it before anything reads them
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Provider names per upstream service; "fake" selects the local stand-ins in fake_upstreams.py.
+# UPSTREAM_PROVIDER sets the default for all of them, <SERVICE>_PROVIDER overrides one.
+DEFAULT_PROVIDERS = {"TTS": "cartesia", "STT": "deepgram", "LLM": "gemini", "CACHE": "redis"}
+
+
+def provider_for(service):
+    """Return the configured provider name for TTS, STT, LLM or CACHE."""
+    default = "fake" if os.getenv("UPSTREAM_PROVIDER") == "fake" else DEFAULT_PROVIDERS[service]
+    provider = os.getenv(f"{service}_PROVIDER", default)
+    if provider not in (DEFAULT_PROVIDERS[service], "fake"):
+        raise ValueError(f"{service}_PROVIDER must be '{DEFAULT_PROVIDERS[service]}' or 'fake'")
+    return provider
+
+
+# Optimization: Each upstream gets one long-lived keep-alive connection pool, sized to the
+# worker threads that can call it at once (see the admission queues in app.py), so TLS
+# handshakes happen at startup instead of on the request path. <SERVICE>_POOL_SIZE overrides.
+POOL_WORKERS = {
+    "TTS": [("TTS_WORKERS", 8), ("TTS_BATCH_WORKERS", 4), ("TTS_SEGMENT_WORKERS", 8)],
+    "STT": [("STT_WORKERS", 4), ("STT_BATCH_WORKERS", 4)],
+}
+UPSTREAM_BASE_URLS = {"TTS": "https://api.cartesia.ai", "STT": "https://api.deepgram.com"}
+KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_SECONDS", 120))
+UPSTREAM_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+WARM_CONNECTIONS = int(os.getenv("UPSTREAM_WARM_CONNECTIONS", 4))
+# HTTP/2 multiplexes requests over one connection; it needs the optional h2 package
+HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+pools = {}
+_generative_models = []
+
+
+def pool_size(service):
+    """Connections to keep for an upstream: one per worker thread that may call it concurrently."""
+    workers = sum(int(os.getenv(name, default)) for name, default in POOL_WORKERS[service])
+    return int(os.getenv(f"{service}_POOL_SIZE", workers))
+
+
+class _KeepOpenTransport(httpx.BaseTransport):
+    """Delegates to a pool's transport but ignores close(), so clients built per request reuse the pool."""
+
+    def __init__(self, pool, transport):
+        self._pool = pool
+        self._transport = transport
+
+    def handle_request(self, request):
+        self._pool.count_request()
+        return self._transport.handle_request(request)
+
+    def close(self):
+        pass
+
+
+class _KeepOpenAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, pool, transport):
+        self._pool = pool
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        self._pool.count_request()
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+
+class UpstreamPool:
+    """
+    Persistent keep-alive connection pools (sync and asyncio) for one upstream.
+
+    SDKs that keep a client get one built on the pool (client / async_client). SDKs that
+    open an httpx client per request, like Deepgram's REST client, take transport /
+    async_transport instead; those ignore close(), so connections outlive each request.
+    """
+
+    def __init__(self, service, size, base_url):
+        self.service = service
+        self.size = size
+        self.base_url = base_url
+        limits = httpx.Limits(max_connections=size, max_keepalive_connections=size, keepalive_expiry=KEEPALIVE_EXPIRY)
+        self._sync = httpx.HTTPTransport(http2=HTTP2, limits=limits, retries=1)
+        self._async = httpx.AsyncHTTPTransport(http2=HTTP2, limits=limits, retries=1)
+        self.transport = _KeepOpenTransport(self, self._sync)
+        self.async_transport = _KeepOpenAsyncTransport(self, self._async)
+        self.client = httpx.Client(transport=self.transport, timeout=UPSTREAM_TIMEOUT, follow_redirects=True)
+        self.async_client = httpx.AsyncClient(transport=self.async_transport, timeout=UPSTREAM_TIMEOUT,
+                                              follow_redirects=True)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.peak_active = 0
+        self.warmed = 0
+
+    def count_request(self):
+        active = self._pool_stats(self._sync)["active"] + self._pool_stats(self._async)["active"]
+        with self._lock:
+            self.requests += 1
+            # A request arriving while all max_connections are active has to wait for one
+            self.peak_active = max(self.peak_active, active)
+
+    def warm(self, connections=WARM_CONNECTIONS):
+        """Open up to connections keep-alive connections with concurrent requests to the API host."""
+        def touch():
+            try:
+                self.client.get(self.base_url)
+                return True
+            except httpx.HTTPError as e:
+                logger.warning(f"Could not warm {self.service} connection: {str(e)}")
+                return False
+
+        threads = [threading.Thread(target=touch) for _ in range(min(connections, self.size))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.warmed = self._pool_stats(self._sync)["open"]
+
+    async def warm_async(self, connections=WARM_CONNECTIONS):
+        """asyncio version of warm for the async pool; run it on the serving event loop."""
+        results = await asyncio.gather(*(self.async_client.get(self.base_url)
+                                         for _ in range(min(connections, self.size))), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Could not warm {self.service} async connection: {str(result)}")
+        self.warmed = self._pool_stats(self._sync)["open"] + self._pool_stats(self._async)["open"]
+
+    def stats(self):
+        """Pool utilization: open, active (in use) and idle connections for each pool, plus request counts."""
+        return {
+            "max_connections": self.size,
+            "http2": HTTP2,
+            "sync": self._pool_stats(self._sync),
+            "async": self._pool_stats(self._async),
+            "requests": self.requests,
+            "peak_active": self.peak_active,
+            "warmed_connections": self.warmed,
+        }
+
+    @staticmethod
+    def _pool_stats(transport):
+        connections = list(transport._pool.connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {"open": len(connections), "active": len(connections) - idle, "idle": idle}
+
+
+def upstream_pool(service):
+    """Return the shared connection pool for TTS or STT, creating it on first use."""
+    pool = pools.get(service)
+    if pool is None:
+        pool = pools[service] = UpstreamPool(service, pool_size(service), UPSTREAM_BASE_URLS[service])
+    return pool
+
+
+def warm_upstreams():
+    """
+    Establish upstream connections before serving, so the first requests skip TCP/TLS setup.
+
+    Warms the sync pools of the real (non-fake) TTS and STT providers and Gemini's gRPC
+    channel. Failures are logged and never block startup.
+    """
+    for service, pool in pools.items():
+        if provider_for(service) != "fake":
+            pool.warm()
+    if _generative_models and provider_for("LLM") != "fake":
+        try:
+            # count_tokens is free and opens the channel every GenerativeModel shares
+            _generative_models[0].count_tokens("warm up")
+        except Exception as e:
+            logger.warning(f"Could not warm Gemini connection: {str(e)}")
+    logger.info(f"Warmed upstream connections: {pool_stats()}")
+
+
+async def warm_upstreams_async():
+    """Warm the asyncio pools of the real TTS and STT providers on the running event loop."""
+    await asyncio.gather(*(pool.warm_async() for service, pool in pools.items() if provider_for(service) != "fake"))
+
+
+def pool_stats():
+    return {service: pool.stats() for service, pool in pools.items()}
+
+
+def _require_key(name):
+    api_key = os.environ.get(name)
+    if not api_key:
+        logger.error(f"{name} is not set in environment variables")
+        raise ValueError(f"{name} is not set. Please check your .env file.")
+    return api_key
+
+
+def create_tts_clients():
+    """
+    Build the sync and async TTS clients.
+
+    Returns:
+        tuple: (client, async_client) exposing Cartesia's tts.bytes / tts.stream.
+    """
+    if provider_for("TTS") == "fake":
+        from fake_upstreams import FakeCartesia, FakeAsyncCartesia
+        logger.warning("Using fake TTS provider")
+        return FakeCartesia(), FakeAsyncCartesia()
+    from cartesia import Cartesia, AsyncCartesia
+    api_key = _require_key("CARTESIA_API_KEY")
+    pool = upstream_pool("TTS")
+    return (Cartesia(api_key=api_key, httpx_client=pool.client),
+            AsyncCartesia(api_key=api_key, httpx_client=pool.async_client, max_num_connections=pool.size))
+
+
+def create_stt_client():
+    """Build the speech-to-text client exposing Deepgram's listen.rest / listen.asyncrest."""
+    if provider_for("STT") == "fake":
+        from fake_upstreams import FakeDeepgramClient
+        logger.warning("Using fake STT provider")
+        return FakeDeepgramClient()
+    from deepgram import DeepgramClient
+    return DeepgramClient(_require_key("DEEPGRAM_API_KEY"))
+
+
+def configure_llm():
+    """Configure the Gemini SDK with GEMINI_API_KEY (a no-op for the fake provider)."""
+    if provider_for("LLM") == "fake":
+        logger.warning("Using fake LLM provider")
+        return
+    import google.generativeai as genai
+    api_key = os.getenv('GEMINI_API_KEY')
+    logger.debug(f"Loaded GEMINI_API_KEY: {api_key[:4]}...{api_key[-4:]}" if api_key else "GEMINI_API_KEY not found")  # Partial key for security
+    if not api_key:
+        logger.error("GEMINI_API_KEY not found in environment variables")
+        raise ValueError("GEMINI_API_KEY not found in environment variables. Please check your .env file.")
+    genai.configure(api_key=api_key)
+
+
+def create_generative_model(model_name, **kwargs):
+    """Build a GenerativeModel (or its fake) with the given system_instruction / generation_config."""
+    if provider_for("LLM") == "fake":
+        from fake_upstreams import FakeGenerativeModel
+        return FakeGenerativeModel(model_name, **kwargs)
+    import google.generativeai as genai
+    model = genai.GenerativeModel(model_name, **kwargs)
+    _generative_models.append(model)
+    return model
+
+
+def create_cache_client(url):
+    """Build the Redis client for the shared cache (see shared_cache.py), or its in-process stand-in."""
+    if provider_for("CACHE") == "fake":
+        from fake_upstreams import FakeRedis
+        logger.warning("Using fake shared cache provider")
+        return FakeRedis()
+    import redis
+    return redis.Redis.from_url(url)
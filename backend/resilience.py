@@ -0,0 +1,347 @@
+"""
+Hedged requests, deadlines and circuit breakers for upstream calls.
+
+Each provider (cartesia, deepgram, gemini) gets an UpstreamPolicy:
+
+- Deadlines: every attempt is told how much time is left and passes it to the SDK
+  as its request timeout, so a hung call ends and frees its thread instead of
+  outliving the client that gave up on it. <NAME>_CALL_DEADLINE overrides the default.
+- Hedging: when an attempt is still running after the provider's recent
+  HEDGE_PERCENTILE latency, one duplicate is sent and the first good answer wins.
+  Hedges are capped at HEDGE_BUDGET of calls so they cannot double the load during
+  an incident; <NAME>_HEDGE=0 disables them for a provider.
+- Circuit breaker: when at least BREAKER_FAILURE_RATE of the calls in the last
+  BREAKER_WINDOW seconds failed, calls fail fast with CircuitOpen (a 503 with
+  Retry-After, like admission control) for BREAKER_COOLDOWN seconds. After that,
+  single probe calls decide whether to close it again. Callers can catch the
+  failure and degrade instead (tts.py serves a cached rendition in another voice).
+
+Streaming calls cannot be hedged; they use allow() / record() around the stream.
+"""
+import os
+import math
+import time
+import asyncio
+import threading
+import contextvars
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from admission import Overloaded
+from metrics import observe_stage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", 0.1))  # Fraction of calls that may be hedged
+HEDGE_MIN_DELAY = 0.05  # Seconds; never hedge sooner than this
+HEDGE_MIN_SAMPLES = 20  # Latencies needed before the percentile is trusted
+LATENCY_WINDOW = 200  # Recent successful attempt latencies kept per provider
+
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", 30))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 10))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", 0.5))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 15))
+
+# Attempts run here so the caller can wait on several and walk away at the deadline
+attempt_executor = ThreadPoolExecutor(max_workers=int(os.getenv("UPSTREAM_ATTEMPT_WORKERS", 64)),
+                                      thread_name_prefix="upstream-attempt")
+
+
+class CircuitOpen(Overloaded):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable, retry later", retry_after, status=503)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when no attempt at an upstream call answered within its deadline."""
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker over a sliding time window.
+
+    closed: calls pass and outcomes are counted. open: calls are rejected until the
+    cooldown ends. half_open: one probe at a time passes; a success closes the
+    breaker, a failure opens it for another cooldown.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._outcomes = deque()  # (time, ok)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probing = False
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go ahead now."""
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + BREAKER_COOLDOWN - time.time()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpen(self.name, max(remaining, 1))
+
+    def record(self, ok):
+        """Count a call's outcome; ok=None means the caller abandoned it (e.g. a client disconnect)."""
+        now = time.time()
+        with self._lock:
+            if ok is None:
+                if self.state == "half_open":
+                    self._probing = False
+                return
+            if self.state == "half_open":
+                self._probing = False
+                if ok:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                    logger.info(f"Circuit breaker for {self.name} closed")
+                else:
+                    self._open(now)
+                return
+            if self.state == "open":
+                return  # Late result of a call started before the breaker opened
+            self._outcomes.append((now, ok))
+            while self._outcomes and self._outcomes[0][0] < now - BREAKER_WINDOW:
+                self._outcomes.popleft()
+            failures = sum(1 for _, outcome in self._outcomes if not outcome)
+            if len(self._outcomes) >= BREAKER_MIN_CALLS and failures >= BREAKER_FAILURE_RATE * len(self._outcomes):
+                self._open(now)
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "recent_calls": len(self._outcomes),
+                    "recent_failures": sum(1 for _, ok in self._outcomes if not ok),
+                    "trips": self.trips, "rejected": self.rejected}
+
+    def _open(self, now):
+        # Caller must hold the lock
+        self.state = "open"
+        self.opened_at = now
+        self.trips += 1
+        self._outcomes.clear()
+        logger.warning(f"Circuit breaker for {self.name} opened for {BREAKER_COOLDOWN}s")
+
+
+class UpstreamPolicy:
+    """Deadline, hedging and circuit breaking for calls to one provider."""
+
+    def __init__(self, name, deadline, hedge=True):
+        """
+        Args:
+            name (str): Provider name, used for metrics stages, logs and env overrides.
+            deadline (float): Default seconds a call may take, all attempts included.
+            hedge (bool): Whether slow calls get a duplicate request.
+        """
+        self.name = name
+        self.deadline = float(os.getenv(f"{name.upper()}_CALL_DEADLINE", deadline))
+        self.hedge = os.getenv(f"{name.upper()}_HEDGE", "1" if hedge else "0") == "1"
+        self.breaker = CircuitBreaker(name)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._hedge_tokens = 1.0
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging: the recent HEDGE_PERCENTILE latency, or None if unknown."""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(math.ceil(HEDGE_PERCENTILE / 100 * len(ordered))) - 1)
+        return min(max(ordered[index], HEDGE_MIN_DELAY), self.deadline / 2)
+
+    def allow(self):
+        """Fail fast with CircuitOpen if the provider is considered down (for streaming calls)."""
+        self.breaker.allow()
+
+    def record(self, ok, seconds=None):
+        """Report the outcome (and latency of a success) of a call made outside call(); see CircuitBreaker.record."""
+        if ok and seconds is not None:
+            with self._lock:
+                self._latencies.append(seconds)
+        self.breaker.record(ok)
+
+    def call(self, fn, *args):
+        """
+        Call fn(*args, timeout=seconds_left) with the deadline, hedging and breaker.
+
+        Args:
+            fn (callable): One attempt at the upstream call; must honour timeout.
+            *args: Arguments for fn.
+
+        Returns:
+            The first successful attempt's result.
+
+        Raises:
+            CircuitOpen: The breaker is open; nothing was sent.
+            DeadlineExceeded: No attempt answered in time.
+            Exception: Whatever the last failed attempt raised, if all of them failed.
+        """
+        self.breaker.allow()
+        start = time.monotonic()
+        deadline_at = start + self.deadline
+        hedge_at = self._plan_hedge()
+        attempts = [self._submit(fn, args, deadline_at)]
+        hedge = None
+        error = None
+        while attempts:
+            now = time.monotonic()
+            if now >= deadline_at:
+                error = None  # Attempts still running: report the deadline, not an earlier failure
+                break
+            timeout = deadline_at - now
+            if hedge_at is not None:
+                timeout = min(timeout, max(0.0, start + hedge_at - now))
+            done, _ = wait(attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                attempts.remove(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                self._succeeded(future is hedge)
+                return result
+            if hedge_at is not None and attempts and time.monotonic() >= start + hedge_at:
+                if self._take_hedge():
+                    hedge = self._submit(fn, args, deadline_at)
+                    attempts.append(hedge)
+                    observe_stage(self.name, hedge_at, "hedge")
+                    logger.debug(f"Hedging {self.name} call after {hedge_at:.3f}s")
+                hedge_at = None
+        self._failed(error)
+
+    async def call_async(self, fn, *args):
+        """asyncio version of call for a coroutine function fn; losing attempts are cancelled."""
+        self.breaker.allow()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline_at = start + self.deadline
+        hedge_at = self._plan_hedge()
+        attempts = {asyncio.ensure_future(self._attempt_async(fn, args, deadline_at))}
+        hedge = None
+        error = None
+        try:
+            while attempts:
+                now = loop.time()
+                if now >= deadline_at:
+                    error = None
+                    break
+                timeout = deadline_at - now
+                if hedge_at is not None:
+                    timeout = min(timeout, max(0.0, start + hedge_at - now))
+                done, attempts = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    self._succeeded(task is hedge)
+                    return result
+                if hedge_at is not None and attempts and loop.time() >= start + hedge_at:
+                    if self._take_hedge():
+                        hedge = asyncio.ensure_future(self._attempt_async(fn, args, deadline_at))
+                        attempts.add(hedge)
+                        observe_stage(self.name, hedge_at, "hedge")
+                        logger.debug(f"Hedging {self.name} call after {hedge_at:.3f}s")
+                    hedge_at = None
+        finally:
+            for task in attempts:
+                task.cancel()
+        self._failed(error)
+
+    def stats(self):
+        with self._lock:
+            stats = {"deadline_seconds": self.deadline, "hedging": self.hedge, "calls": self.calls,
+                     "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                     "deadline_exceeded": self.deadline_exceeded}
+        delay = self.hedge_delay()
+        stats["hedge_delay_seconds"] = round(delay, 3) if delay is not None else None
+        stats["breaker"] = self.breaker.stats()
+        return stats
+
+    def _plan_hedge(self):
+        # Refill the hedge budget by HEDGE_BUDGET per call; returns the hedge delay, if hedging
+        with self._lock:
+            self.calls += 1
+            self._hedge_tokens = min(10.0, self._hedge_tokens + HEDGE_BUDGET)
+        if not self.hedge or self.breaker.state != "closed":
+            return None
+        return self.hedge_delay()
+
+    def _take_hedge(self):
+        with self._lock:
+            if self._hedge_tokens < 1:
+                return False
+            self._hedge_tokens -= 1
+            self.hedges += 1
+            return True
+
+    def _submit(self, fn, args, deadline_at):
+        # Copy the context so the attempt's timings keep the request's route label
+        return attempt_executor.submit(contextvars.copy_context().run, self._attempt, fn, args, deadline_at)
+
+    def _attempt(self, fn, args, deadline_at):
+        start = time.perf_counter()
+        result = fn(*args, timeout=max(0.001, deadline_at - time.monotonic()))
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    async def _attempt_async(self, fn, args, deadline_at):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        result = await fn(*args, timeout=max(0.001, deadline_at - loop.time()))
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def _succeeded(self, hedge_won):
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+        self.breaker.record(True)
+
+    def _failed(self, error):
+        # Every attempt failed or the deadline passed
+        self.breaker.record(False)
+        if error is None:
+            with self._lock:
+                self.deadline_exceeded += 1
+            error = DeadlineExceeded(f"{self.name} did not answer within {self.deadline:.1f}s")
+        raise error
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(name, deadline, hedge=True):
+    """Return the shared UpstreamPolicy for a provider, creating it on first use."""
+    with _policies_lock:
+        policy = _policies.get(name)
+        if policy is None:
+            policy = _policies[name] = UpstreamPolicy(name, deadline, hedge=hedge)
+        return policy
+
+
+def all_policy_stats():
+    with _policies_lock:
+        policies = list(_policies.values())
+    return {policy.name: policy.stats() for policy in policies}
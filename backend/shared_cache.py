@@ -0,0 +1,307 @@
+"""
+Cache storage shared by every server process on a host (or across hosts).
+
+With several waitress/gunicorn workers behind a load balancer, each process has its
+own in-memory caches (cache.py) and its own view of each conversation
+(conversation.py). Setting SHARED_CACHE puts a second tier behind them that all
+workers read and write:
+
+    SHARED_CACHE=sqlite   SQLite file at SHARED_CACHE_PATH (default shared_cache.db),
+                          for workers on one host
+    SHARED_CACHE=redis    Redis at SHARED_CACHE_URL (needs `pip install redis`), for
+                          workers on several hosts; CACHE_PROVIDER=fake (or
+                          UPSTREAM_PROVIDER=fake) swaps in the in-process stand-in
+
+Unset, each process keeps using only its own memory, as before. Both stores give
+atomic get/set/delete, per-namespace TTLs (optionally sliding) and an atomic
+read-modify-write (update) for state such as conversation histories. The SQLite
+store evicts least recently used entries per namespace to stay in its byte budget;
+Redis is bounded by the server's maxmemory with an allkeys-lru policy, so only
+entries larger than the namespace budget are refused there.
+"""
+import os
+import time
+import uuid
+import sqlite3
+import threading
+import logging
+from providers import create_cache_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE = os.getenv("SHARED_CACHE", "")
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "shared_cache.db")
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "redis://localhost:6379/0")
+TOUCH_INTERVAL = 30  # Seconds; hits refresh access time at most this often so reads rarely write
+LOW_WATERMARK = 0.9  # Evict down to 90% of the budget so we don't evict on every write
+LOCK_TIMEOUT = 5.0  # Seconds an update may wait for, or hold, a Redis key lock
+
+# Deletes a lock key only while it still holds our token, in one atomic step on the server
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+BUSY_TIMEOUT_MS = 5000  # How long SQLite waits for another process's write
+
+
+def encode_value(value):
+    """Serialize a str or bytes cache value with a one-byte type tag."""
+    if isinstance(value, str):
+        return b"s" + value.encode("utf-8")
+    return b"b" + bytes(value)
+
+
+def decode_value(data):
+    data = bytes(data)
+    if data[:1] == b"s":
+        return data[1:].decode("utf-8")
+    return data[1:]
+
+
+class SQLiteStore:
+    """
+    Host-wide cache in one SQLite file, safe for concurrent use by many processes.
+
+    Every write runs in its own IMMEDIATE transaction, so a get never sees half an
+    update and update() is an atomic read-modify-write across processes. Per-namespace
+    byte totals are kept by triggers, so the budget check after a write is O(1).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.namespaces = {}  # namespace -> (max_bytes, ttl, sliding_ttl)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_access ON entries(namespace, last_access);
+            CREATE TABLE IF NOT EXISTS usage (namespace TEXT PRIMARY KEY, bytes INTEGER NOT NULL);
+            CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+                INSERT INTO usage (namespace, bytes) VALUES (new.namespace, new.size)
+                ON CONFLICT(namespace) DO UPDATE SET bytes = bytes + new.size;
+            END;
+            CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+                UPDATE usage SET bytes = bytes - old.size WHERE namespace = old.namespace;
+            END;
+        """)
+
+    def register(self, namespace, max_bytes, ttl=None, sliding_ttl=False):
+        """Declare a namespace's byte budget and entry lifetime (seconds, or None for no expiry)."""
+        self.namespaces[namespace] = (max_bytes, ttl, sliding_ttl)
+
+    def get(self, namespace, key):
+        """Return the value stored under key, or None if missing or expired."""
+        _, ttl, sliding_ttl = self.namespaces[namespace]
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at, last_access FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            data, expires_at, last_access = row
+            if expires_at is not None and now >= expires_at:
+                self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                                 (namespace, key, now))
+                return None
+            if now - last_access > TOUCH_INTERVAL:
+                self._db.execute(
+                    "UPDATE entries SET last_access = ?, expires_at = ? WHERE namespace = ? AND key = ?",
+                    (now, now + ttl if sliding_ttl and ttl is not None else expires_at, namespace, key)
+                )
+        return decode_value(data)
+
+    def set(self, namespace, key, value):
+        """Store value under key, evicting least recently used entries to stay in budget."""
+        data = encode_value(value)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._write(namespace, key, data)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def update(self, namespace, key, change):
+        """
+        Atomically replace the value under key with change(current value or None).
+
+        No other process can read a half-applied update or interleave its own, so
+        change should be quick (it runs while holding the database write lock).
+
+        Returns:
+            The new value.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT value FROM entries WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (namespace, key, now)
+                ).fetchone()
+                value = change(decode_value(row[0]) if row else None)
+                self._write(namespace, key, encode_value(value))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return value
+
+    def purge_expired(self):
+        with self._lock:
+            return self._db.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def stats(self):
+        with self._lock:
+            usage = dict(self._db.execute("SELECT namespace, bytes FROM usage").fetchall())
+            entries = dict(self._db.execute("SELECT namespace, COUNT(*) FROM entries GROUP BY namespace").fetchall())
+        return {
+            "backend": "sqlite",
+            "namespaces": {namespace: {"entries": entries.get(namespace, 0), "bytes": usage.get(namespace, 0),
+                                       "max_bytes": max_bytes}
+                           for namespace, (max_bytes, _, _) in self.namespaces.items()},
+        }
+
+    def _write(self, namespace, key, data):
+        # Caller must hold the lock inside an IMMEDIATE transaction
+        max_bytes, ttl, _ = self.namespaces[namespace]
+        if len(data) > max_bytes:
+            logger.debug(f"[{namespace}] Not sharing {len(data)} byte entry larger than the {max_bytes} byte budget")
+            return
+        now = time.time()
+        self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        self._db.execute(
+            "INSERT INTO entries (namespace, key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+            (namespace, key, data, len(data), now + ttl if ttl is not None else None, now)
+        )
+        if self._used(namespace) <= max_bytes:
+            return
+        self._db.execute("DELETE FROM entries WHERE namespace = ? AND expires_at <= ?", (namespace, now))
+        excess = self._used(namespace) - int(max_bytes * LOW_WATERMARK)
+        if excess <= 0:
+            return
+        victims = []
+        for rowid, size in self._db.execute(
+                "SELECT rowid, size FROM entries WHERE namespace = ? AND key != ? ORDER BY last_access",
+                (namespace, key)):
+            victims.append((rowid,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM entries WHERE rowid = ?", victims)
+
+    def _used(self, namespace):
+        return self._db.execute("SELECT bytes FROM usage WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+
+class RedisStore:
+    """
+    Cache shared through a Redis server (or the fake_upstreams stand-in).
+
+    Keys are <prefix>:<namespace>:<key>; TTLs are Redis expirations, refreshed on hits
+    for sliding namespaces. update() serializes writers with a short-lived SET NX lock
+    key, released by a compare-and-delete script so a lock that expired and was taken
+    by another writer is never deleted by the old holder.
+    """
+
+    def __init__(self, client, prefix="chatbot"):
+        self.client = client
+        self.prefix = prefix
+        self.namespaces = {}  # namespace -> (max_bytes, ttl, sliding_ttl)
+        self._release_lock = client.register_script(RELEASE_LOCK_SCRIPT)
+
+    def register(self, namespace, max_bytes, ttl=None, sliding_ttl=False):
+        self.namespaces[namespace] = (max_bytes, ttl, sliding_ttl)
+
+    def get(self, namespace, key):
+        _, ttl, sliding_ttl = self.namespaces[namespace]
+        data = self.client.get(self._key(namespace, key))
+        if data is None:
+            return None
+        if sliding_ttl and ttl is not None:
+            self.client.pexpire(self._key(namespace, key), int(ttl * 1000))
+        return decode_value(data)
+
+    def set(self, namespace, key, value):
+        max_bytes, ttl, _ = self.namespaces[namespace]
+        data = encode_value(value)
+        if len(data) > max_bytes:
+            logger.debug(f"[{namespace}] Not sharing {len(data)} byte entry larger than the {max_bytes} byte budget")
+            return
+        self.client.set(self._key(namespace, key), data, px=int(ttl * 1000) if ttl is not None else None)
+
+    def delete(self, namespace, key):
+        self.client.delete(self._key(namespace, key))
+
+    def update(self, namespace, key, change):
+        """Atomically replace the value under key with change(current value or None); returns the new value."""
+        lock_key = self._key(namespace, key) + ":lock"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not self.client.set(lock_key, token, nx=True, px=int(LOCK_TIMEOUT * 1000)):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for the shared cache lock on {namespace}:{key}")
+            time.sleep(0.005)
+        try:
+            value = change(self.get(namespace, key))
+            self.set(namespace, key, value)
+            return value
+        finally:
+            self._release_lock(keys=[lock_key], args=[token])
+
+    def purge_expired(self):
+        return 0  # Redis expires keys itself
+
+    def stats(self):
+        return {"backend": "redis", "namespaces": {namespace: {"max_bytes": max_bytes}
+                                                   for namespace, (max_bytes, _, _) in self.namespaces.items()}}
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}:{namespace}:{key}"
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def shared_store():
+    """Return the process-wide shared store selected by SHARED_CACHE, or None when sharing is off."""
+    global _store
+    if not SHARED_CACHE:
+        return None
+    with _store_lock:
+        if _store is None:
+            if SHARED_CACHE == "sqlite":
+                _store = SQLiteStore(SHARED_CACHE_PATH)
+            elif SHARED_CACHE == "redis":
+                _store = RedisStore(create_cache_client(SHARED_CACHE_URL))
+            else:
+                raise ValueError("SHARED_CACHE must be 'sqlite', 'redis' or empty")
+            logger.info(f"Sharing caches across processes via {SHARED_CACHE}")
+        return _store
+
+
+def shared_cache_stats():
+    store = shared_store()
+    return store.stats() if store is not None else {"backend": None}
@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import logging
+import contextvars
+from concurrent.futures import Future
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class _SharedStream:
+    """A chunk stream pumped once from upstream and replayed to any number of subscribers."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def pump(self, iterator):
+        try:
+            for chunk in iterator:
+                with self.condition:
+                    self.chunks.append(chunk)
+                    self.condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def subscribe(self):
+        # Every subscriber starts from the first chunk, so late joiners still get a complete stream
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.chunks) and not self.done:
+                    self.condition.wait()
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            yield chunk
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight calls so only the first caller does the upstream work.
+
+    Callers with the same key while a call is running wait on the leader's future
+    (or subscribe to its stream) and share the result, including any exception.
+    Once the call finishes the key is released, so later callers go through the
+    caches as usual.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.coalesced = 0
+        _registry.append(self)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) unless an identical call is already in flight.
+
+        Returns:
+            The result of the leader's call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+                is_leader = True
+            else:
+                self.coalesced += 1
+                is_leader = False
+
+        if not is_leader:
+            logger.debug(f"[{self.name}] Joining in-flight call for {key[:16]}...")
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def do_stream(self, key, fn, *args, **kwargs):
+        """
+        Stream fn(*args, **kwargs) unless an identical stream is already in flight.
+
+        The upstream iterator is pumped on its own thread, so a leader whose client
+        disconnects does not stall the followers.
+
+        Returns:
+            generator: Yields every chunk of the shared stream from the beginning.
+        """
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = _SharedStream()
+                self._streams[key] = shared
+                self.leaders += 1
+                is_leader = True
+            else:
+                self.coalesced += 1
+                is_leader = False
+
+        if is_leader:
+            def run():
+                try:
+                    shared.pump(fn(*args, **kwargs))
+                except Exception as e:
+                    # fn itself failed before returning an iterator
+                    shared.pump(_raise(e))
+                finally:
+                    with self._lock:
+                        self._streams.pop(key, None)
+
+            # Keep the leader's context so metrics recorded while pumping carry its route
+            threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+        else:
+            logger.debug(f"[{self.name}] Joining in-flight stream for {key[:16]}...")
+
+        return shared.subscribe()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._streams),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
+
+
+class AsyncSingleFlight:
+    """
+    Asyncio counterpart of SingleFlight for coroutines on a single event loop.
+
+    The shared call runs as a task and each caller awaits it through asyncio.shield,
+    so one caller being cancelled does not cancel the work for everyone else.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._tasks = {}
+        self.leaders = 0
+        self.coalesced = 0
+        _registry.append(self)
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) unless an identical call is already in flight."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            logger.debug(f"[{self.name}] Joining in-flight call for {key[:16]}...")
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._tasks),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+def _raise(error):
+    raise error
+    yield  # Unreachable - makes this function a generator
+
+
+_registry = []
+
+
+def all_flight_stats():
+    """Return stats for every SingleFlight group."""
+    return {flight.name: flight.stats() for flight in _registry}
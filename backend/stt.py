@@ -1,11 +1,22 @@
-from deepgram import DeepgramClient, PrerecordedOptions
-import hashlib
+from deepgram import PrerecordedOptions, LiveOptions, LiveTranscriptionEvents
 import os
 import time
 from concurrent.futures import ThreadPoolExecutor
 import logging
 import io
-import threading
+import asyncio
+import httpx
+from cache import get_cache
+from disk_cache import DiskCache, content_digest, file_content_digest
+from acoustic_fingerprint import FingerprintIndex, acoustic_fingerprint
+from audio_format import decode_upload, is_wav, build_wav, encode_samples
+from vad import find_speech
+from singleflight import SingleFlight, AsyncSingleFlight
+from metrics import timed, observe_stage
+from access_log import record_access
+from providers import create_stt_client, upstream_pool
+from admission import Overloaded
+from resilience import get_policy
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -13,43 +24,224 @@ logger = logging.getLogger(__name__)
 # Create thread pool for parallel processing - shared with app.py
 executor = ThreadPoolExecutor(max_workers=8)
 
-# Initialize the Deepgram client
-DEEPGRAM_API_KEY = "0d98d780e5151b9efdca18cd7d9c966626edff88"
-deepgram = DeepgramClient(DEEPGRAM_API_KEY)
+# Initialize the Deepgram client from DEEPGRAM_API_KEY (STT_PROVIDER=fake for load testing)
+deepgram = create_stt_client()
+# Deepgram's REST client opens an httpx client per request; give it the persistent pool instead
+upstream = upstream_pool("STT")
+# Deadline, hedging and circuit breaker for Deepgram calls (see resilience.py)
+deepgram_policy = get_policy("deepgram", deadline=15)
 
-# Create cache directory if it doesn't exist
+# Sharded, quota-bounded disk cache with an on-disk index
 cache_dir = "stt_cache"
-os.makedirs(cache_dir, exist_ok=True)
+DISK_CACHE_MAX_BYTES = int(os.getenv("STT_DISK_CACHE_BYTES", 64 * 1024 * 1024))
+# Transcripts used to be keyed by an MD5 of the audio, so files from that layout are never hit again
+disk_cache = DiskCache(cache_dir, ".txt", DISK_CACHE_MAX_BYTES, policy=os.getenv("STT_DISK_CACHE_POLICY", "lru"),
+                       adopt_legacy=False)
 
-# In-memory cache for ultra-fast responses - aligned with app.py
-memory_cache = {}
-MEMORY_CACHE_SIZE = 200  # Increased from 100
+# In-memory cache for ultra-fast responses - byte-budgeted LRU shared via cache.py
 MEMORY_CACHE_EXPIRY = 3600  # 1 hour, matching app.py's CACHE_EXPIRY
-memory_cache_lock = threading.Lock()  # Add thread safety
+memory_cache = get_cache("stt", ttl=MEMORY_CACHE_EXPIRY, sliding_ttl=True)
 
-def get_audio_fingerprint(audio_data):
-    """Generate a robust fingerprint for audio content that's less sensitive to minor differences"""
-    # Improved sampling method for more reliable fingerprinting
-    try:
-        # For larger audio files, use a more sophisticated approach
-        if len(audio_data) > 10000:
-            samples = []
-            # Take more samples for better fingerprinting
-            chunk_size = max(1, len(audio_data) // 20)  # 20 samples instead of 10
-            for i in range(0, len(audio_data), chunk_size):
-                if i + 20 < len(audio_data):  # Take more bytes per sample
-                    samples.append(audio_data[i:i+20])
-            
-            fingerprint = hashlib.md5(b''.join(samples)).hexdigest()
-        else:
-            # For smaller files, use a simpler approach
-            fingerprint = hashlib.md5(audio_data).hexdigest()
+# Optimization: Voice activity detection rejects speech-free clips without a Deepgram call
+# and trims leading/trailing silence from WAV uploads
+VAD_ENABLED = os.getenv("STT_VAD", "1") == "1"
+MIN_TRIM_SAVING = 0.9  # Only send the trimmed copy if it is at least 10% smaller
+
+# Optimization: Near-duplicate matching on decoded audio, so re-encoded or trimmed copies of
+# a clip reuse its transcript instead of going back to Deepgram. Opt-in: a false match returns
+# another clip's transcript
+ACOUSTIC_MATCHING = os.getenv("STT_ACOUSTIC_MATCHING", "0") == "1"
+acoustic_index = FingerprintIndex(max_entries=int(os.getenv("STT_ACOUSTIC_INDEX_ENTRIES", 5000)))
+
+# Live sessions give up waiting for the flushed final transcript after this long
+LIVE_FINALIZE_TIMEOUT = float(os.getenv("STT_LIVE_FINALIZE_TIMEOUT", 3.0))
+
+# Coalesces identical in-flight transcription requests
+stt_flight = SingleFlight("stt")
+stt_async_flight = AsyncSingleFlight("stt_async")
+
+def audio_cache_key(audio_data):
+    """Full-content BLAKE2 digest of an upload, shared by the memory and disk transcript caches."""
+    return content_digest(audio_data)
+
+def audio_file_cache_key(path):
+    """audio_cache_key of a file on disk."""
+    return file_content_digest(path)
+
+def get_cached_transcript(audio_key):
+    """Return the cached transcript for an audio key from either tier without transcribing, or None."""
+    record_access("stt", audio_key)
+    transcript = memory_cache.get(audio_key)
+    if transcript is None:
+        transcript = disk_cache.read_text(audio_key)
+        if transcript is not None:
+            memory_cache.set(audio_key, transcript)
+    return transcript
+
+def prepare_audio(audio_data):
+    """
+    Decode an upload once, reject it if it holds no speech and trim surrounding silence.
+    
+    Args:
+        audio_data (bytes): The uploaded audio.
         
-        return fingerprint
+    Returns:
+        tuple: (bytes to send to Deepgram, decoded (samples, rate) of the speech region
+        or None if the upload can't be decoded here, whether the clip holds speech)
+    """
+    if not (VAD_ENABLED or ACOUSTIC_MATCHING):
+        return audio_data, None, True
+    with timed("vad") as stage:
+        decoded = decode_upload(audio_data)
+        if decoded is None:
+            stage["outcome"] = "undecodable"
+            return audio_data, None, True
+        samples, rate = decoded
+        if not VAD_ENABLED:
+            return audio_data, decoded, True
+        
+        region = find_speech(samples, rate)
+        if region is None:
+            stage["outcome"] = "silence"
+            return audio_data, None, False
+        stage["outcome"] = "speech"
+        start, end = region
+        samples = samples[start:end]
+        
+        # Re-encoding only pays off for WAV; compressed uploads would grow as PCM
+        if is_wav(audio_data):
+            trimmed = build_wav(encode_samples(samples, "pcm_s16le"), "pcm_s16le", rate, channels=samples.shape[1])
+            if len(trimmed) < MIN_TRIM_SAVING * len(audio_data):
+                logger.debug(f"Trimmed silence: {len(audio_data)} -> {len(trimmed)} bytes")
+                audio_data = trimmed
+        return audio_data, (samples, rate), True
+
+def find_similar_transcript(decoded):
+    """
+    Look for the transcript of an earlier clip that sounds the same as this one.
+    
+    Catches re-encoded, resampled or slightly trimmed copies whose bytes (and so cache
+    keys) differ. Only used after both exact-key cache tiers miss.
+    
+    Args:
+        decoded (tuple or None): (samples, rate) from prepare_audio.
+        
+    Returns:
+        tuple: (acoustic fingerprint or None, matching transcript or None)
+    """
+    if not ACOUSTIC_MATCHING or decoded is None:
+        return None, None
+    try:
+        fingerprint = acoustic_fingerprint(*decoded)
     except Exception as e:
-        # Fallback to full hash if sampling fails
-        logger.warning(f"Error in fingerprinting: {e}, using full hash")
-        return hashlib.md5(audio_data).hexdigest()
+        logger.warning(f"Acoustic fingerprinting failed: {str(e)}")
+        return None, None
+    if fingerprint is None:
+        return None, None
+    
+    match_key = acoustic_index.match(fingerprint)
+    if match_key is None:
+        return fingerprint, None
+    transcript = memory_cache.get(match_key)
+    if transcript is None:
+        transcript = disk_cache.read_text(match_key)
+    return fingerprint, transcript
+
+def detect_audio_format(audio_data):
+    """Guess the upload's MIME type from its magic bytes."""
+    audio_format = "audio/webm"  # Default assumption
+    if len(audio_data) >= 12:
+        header = audio_data[:12]
+        if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+            audio_format = "audio/wav"
+        elif header[:4] == b'OggS':
+            audio_format = "audio/ogg"
+        elif header[:3] == b'ID3' or header[:2] == b'\xff\xfb':
+            audio_format = "audio/mpeg"
+        elif header[:4] == b'fLaC':
+            audio_format = "audio/flac"
+    return audio_format
+
+def build_prerecorded_options():
+    """Deepgram options for file transcription."""
+    # Enhanced options for better transcription quality
+    return PrerecordedOptions(
+        model="nova-3",
+        language="en-US",
+        smart_format=True,
+        diarize=True,
+        punctuate=True,
+        utterances=True,
+        filler_words=False,
+        detect_language=True  # Auto-detect language for multilingual support
+    )
+
+def extract_transcript(response_dict):
+    """Pull the best transcript out of a Deepgram response, applying the quality check."""
+    # Extract transcript with better error handling
+    try:
+        transcript = response_dict["results"]["channels"][0]["alternatives"][0]["transcript"]
+        confidence = response_dict["results"]["channels"][0]["alternatives"][0].get("confidence", 0)
+        
+        # Simple quality check
+        if confidence < 0.5 and len(transcript.split()) < 2:
+            logger.warning(f"Low confidence transcript: {confidence}")
+            transcript = "Speech unclear, please try again speaking more clearly"
+    except (KeyError, IndexError) as e:
+        logger.error(f"Error extracting transcript: {e}")
+        transcript = "Could not transcribe audio, please try again"
+    return transcript
+
+def _transcribe_upstream(audio_data, audio_key):
+    """Transcribe with Deepgram and store the transcript in both cache tiers."""
+    logger.debug(f"Processing audio for transcription, size: {len(audio_data)} bytes")
+    
+    audio_format = detect_audio_format(audio_data)
+    logger.debug(f"Detected audio format: {audio_format}")
+        
+    source = {
+        "buffer": audio_data,
+        "mimetype": audio_format
+    }
+    
+    # Transcribe audio; slow requests are hedged within the deadline
+    with timed("deepgram", "complete"):
+        response = deepgram_policy.call(_request_transcript, source)
+    transcript = extract_transcript(response.to_dict())
+    
+    # Save transcript to cache
+    disk_cache.write_text(audio_key, transcript)
+        
+    # Also update memory cache (evicts least recently used entries past the byte budget)
+    memory_cache.set(audio_key, transcript)
+    
+    return transcript
+
+def _request_transcript(source, timeout):
+    """One Deepgram request; httpx abandons it after timeout seconds."""
+    return deepgram.listen.rest.v("1").transcribe_file(source, build_prerecorded_options(),
+                                                       transport=upstream.transport, timeout=httpx.Timeout(timeout))
+
+async def _request_transcript_async(source, timeout):
+    return await deepgram.listen.asyncrest.v("1").transcribe_file(source, build_prerecorded_options(),
+                                                                  transport=upstream.async_transport,
+                                                                  timeout=httpx.Timeout(timeout))
+
+async def _transcribe_upstream_async(audio_data, audio_key):
+    """Async twin of _transcribe_upstream using Deepgram's asyncio REST client."""
+    audio_format = detect_audio_format(audio_data)
+    source = {
+        "buffer": audio_data,
+        "mimetype": audio_format
+    }
+    
+    with timed("deepgram", "complete"):
+        response = await deepgram_policy.call_async(_request_transcript_async, source)
+    transcript = extract_transcript(response.to_dict())
+    
+    await asyncio.to_thread(disk_cache.write_text, audio_key, transcript)
+    await memory_cache.set_async(audio_key, transcript)
+    return transcript
 
 def transcribe_audio(audio_data):
     """
@@ -72,116 +264,203 @@ def transcribe_audio(audio_data):
             
         start_time = time.time()
         
-        # Generate fingerprints for the audio data
-        audio_fingerprint = get_audio_fingerprint(audio_data)
-        audio_hash = hashlib.md5(audio_data).hexdigest()
+        # One full-content hash keys both cache tiers
+        audio_key = audio_cache_key(audio_data)
+        record_access("stt", audio_key)
         
-        # Check memory cache first (fastest) with thread safety
-        with memory_cache_lock:
-            if audio_fingerprint in memory_cache:
-                cached_entry = memory_cache[audio_fingerprint]
-                if time.time() - cached_entry['timestamp'] < MEMORY_CACHE_EXPIRY:
-                    logger.debug(f"Found in-memory cached transcript for audio fingerprint: {audio_fingerprint[:8]}...")
-                    # Update timestamp to keep frequently used items fresh
-                    memory_cache[audio_fingerprint]['timestamp'] = time.time()
-                    return cached_entry['transcript']
+        # Check memory cache first (fastest); hits refresh recency and TTL
+        cached_transcript = memory_cache.get(audio_key)
+        if cached_transcript is not None:
+            logger.debug(f"Found in-memory cached transcript for audio key: {audio_key[:8]}...")
+            return cached_transcript
         
         # Then check file cache
-        cache_path = os.path.join(cache_dir, f"{audio_hash}.txt")
-        if os.path.exists(cache_path):
-            logger.debug(f"Found cached transcript for audio hash: {audio_hash[:8]}...")
-            with open(cache_path, "r") as f:
-                transcript = f.read()
-                
-            # Also update memory cache with thread safety
-            with memory_cache_lock:
-                memory_cache[audio_fingerprint] = {
-                    'transcript': transcript,
-                    'timestamp': time.time()
-                }
+        transcript = disk_cache.read_text(audio_key)
+        if transcript is not None:
+            logger.debug(f"Found cached transcript for audio key: {audio_key[:8]}...")
                 
-                # Clean memory cache if too large
-                if len(memory_cache) > MEMORY_CACHE_SIZE:
-                    # Remove oldest entry
-                    oldest_key = min(memory_cache.keys(), key=lambda k: memory_cache[k]['timestamp'])
-                    del memory_cache[oldest_key]
-                    
+            # Also update memory cache
+            memory_cache.set(audio_key, transcript)
             return transcript
         
-        logger.debug(f"Processing audio for transcription, size: {len(audio_data)} bytes")
-        
-        # Improved audio format detection
-        audio_format = "audio/webm"  # Default assumption
-        if len(audio_data) >= 12:
-            header = audio_data[:12]
-            if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
-                audio_format = "audio/wav"
-            elif header[:4] == b'OggS':
-                audio_format = "audio/ogg"
-            elif header[:3] == b'ID3' or header[:2] == b'\xff\xfb':
-                audio_format = "audio/mpeg"
-            elif header[:4] == b'fLaC':
-                audio_format = "audio/flac"
-        
-        logger.debug(f"Detected audio format: {audio_format}")
-            
-        source = {
-            "buffer": audio_data,
-            "mimetype": audio_format
-        }
-        
-        # Enhanced options for better transcription quality
-        options = PrerecordedOptions(
-            model="nova-3",
-            language="en-US",
-            smart_format=True,
-            diarize=True,
-            punctuate=True,
-            utterances=True,
-            filler_words=False,
-            detect_language=True  # Auto-detect language for multilingual support
-        )
-        
-        # Transcribe audio
-        response = deepgram.listen.rest.v("1").transcribe_file(source, options)
-        response_dict = response.to_dict()
-        
-        # Extract transcript with better error handling
-        try:
-            transcript = response_dict["results"]["channels"][0]["alternatives"][0]["transcript"]
-            confidence = response_dict["results"]["channels"][0]["alternatives"][0].get("confidence", 0)
-            
-            # Simple quality check
-            if confidence < 0.5 and len(transcript.split()) < 2:
-                logger.warning(f"Low confidence transcript: {confidence}")
-                transcript = "Speech unclear, please try again speaking more clearly"
-        except (KeyError, IndexError) as e:
-            logger.error(f"Error extracting transcript: {e}")
-            transcript = "Could not transcribe audio, please try again"
-        
-        # Save transcript to cache
-        with open(cache_path, "w") as f:
-            f.write(transcript)
-            
-        # Also update memory cache with thread safety
-        with memory_cache_lock:
-            memory_cache[audio_fingerprint] = {
-                'transcript': transcript,
-                'timestamp': time.time()
-            }
-            
-            # Clean memory cache if too large
-            if len(memory_cache) > MEMORY_CACHE_SIZE:
-                # Remove oldest entries (more aggressive cleanup)
-                keys_by_age = sorted(memory_cache.keys(), key=lambda k: memory_cache[k]['timestamp'])
-                for old_key in keys_by_age[:max(1, len(keys_by_age)//10)]:  # Remove ~10% of oldest entries
-                    del memory_cache[old_key]
+        # Skip Deepgram entirely for clips without speech; the empty transcript is cached
+        upload, speech, has_speech = prepare_audio(audio_data)
+        if not has_speech:
+            logger.debug(f"No speech detected in {audio_key[:8]}..., skipping transcription")
+            memory_cache.set(audio_key, "")
+            return ""
+        
+        # Then a clip that sounds the same under a different encoding
+        fingerprint, transcript = find_similar_transcript(speech)
+        if transcript is not None:
+            # Not cached under this clip's exact key, so a false match is not made permanent
+            logger.debug(f"Found transcript of an acoustically matching clip for {audio_key[:8]}...")
+            return transcript
+        
+        # Identical concurrent uploads share one Deepgram call
+        transcript = stt_flight.do(audio_key, _transcribe_upstream, upload, audio_key)
+        if fingerprint is not None:
+            acoustic_index.add(audio_key, fingerprint)
         
         # Report timing
         processing_time = time.time() - start_time
         logger.debug(f"Transcription completed in {processing_time:.2f}s: {transcript[:50]}...")
         return transcript
         
+    except Overloaded:
+        raise  # Circuit open: surfaces as a 503 with Retry-After
+    except Exception as e:
+        logger.error(f"Transcription error: {str(e)}", exc_info=True)
+        raise Exception(f"Transcription error: {str(e)}")
+
+async def transcribe_audio_async(audio_data):
+    """
+    Asyncio version of transcribe_audio for the async server.
+    
+    Uses the same cache tiers and keys; hashing and disk IO run in worker threads so
+    the event loop only waits on the network.
+    
+    Args:
+        audio_data (bytes): The audio data to transcribe.
+        
+    Returns:
+        str: The transcribed text.
+    """
+    try:
+        if not audio_data:
+            logger.warning("Empty audio data received")
+            return "No speech detected, please try again with audio"
+        if len(audio_data) < 500:
+            logger.warning(f"Audio data too small ({len(audio_data)} bytes), likely no speech content")
+            return "Audio too short, please speak for longer"
+        
+        start_time = time.time()
+        
+        audio_key = await asyncio.to_thread(audio_cache_key, audio_data)
+        await asyncio.to_thread(record_access, "stt", audio_key)
+        
+        cached_transcript = await memory_cache.get_async(audio_key)
+        if cached_transcript is not None:
+            logger.debug(f"Found in-memory cached transcript for audio key: {audio_key[:8]}...")
+            return cached_transcript
+        
+        transcript = await asyncio.to_thread(disk_cache.read_text, audio_key)
+        if transcript is not None:
+            logger.debug(f"Found cached transcript for audio key: {audio_key[:8]}...")
+            await memory_cache.set_async(audio_key, transcript)
+            return transcript
+        
+        upload, speech, has_speech = await asyncio.to_thread(prepare_audio, audio_data)
+        if not has_speech:
+            logger.debug(f"No speech detected in {audio_key[:8]}..., skipping transcription")
+            await memory_cache.set_async(audio_key, "")
+            return ""
+        
+        fingerprint, transcript = await asyncio.to_thread(find_similar_transcript, speech)
+        if transcript is not None:
+            # Not cached under this clip's exact key, so a false match is not made permanent
+            logger.debug(f"Found transcript of an acoustically matching clip for {audio_key[:8]}...")
+            return transcript
+        
+        # Identical concurrent uploads share one Deepgram call
+        transcript = await stt_async_flight.do(audio_key, _transcribe_upstream_async, upload, audio_key)
+        if fingerprint is not None:
+            acoustic_index.add(audio_key, fingerprint)
+        
+        processing_time = time.time() - start_time
+        logger.debug(f"Async transcription completed in {processing_time:.2f}s: {transcript[:50]}...")
+        return transcript
+        
+    except Overloaded:
+        raise  # Circuit open: surfaces as a 503 with Retry-After
     except Exception as e:
         logger.error(f"Transcription error: {str(e)}", exc_info=True)
-        raise Exception(f"Transcription error: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Transcription error: {str(e)}")
+
+def build_live_options(encoding=None, sample_rate=None, channels=1):
+    """Deepgram options for live transcription; raw PCM needs encoding and sample_rate, containers don't."""
+    options = {
+        "model": "nova-3",
+        "language": "en-US",
+        "smart_format": True,
+        "punctuate": True,
+        "interim_results": True,
+        "filler_words": False,
+    }
+    if encoding:
+        options.update(encoding=encoding, sample_rate=sample_rate, channels=channels)
+    return LiveOptions(**options)
+
+class LiveTranscription:
+    """
+    One streaming transcription session on Deepgram's live WebSocket API.
+    
+    Audio is forwarded as it arrives and Deepgram answers with interim results while the
+    user is still talking. on_update(text, is_final) receives the running transcript:
+    finalized segments plus the current interim guess. finish() flushes the recognizer
+    instead of closing and re-sending the audio, so the final transcript is ready a few
+    hundred milliseconds after the last frame.
+    
+    Live transcripts are not cached: they come from the live options (no diarization or
+    language detection) and may be cut short by a flush timeout, so the key /api/transcribe
+    uses only ever holds prerecorded results.
+    """
+    
+    def __init__(self, on_update, encoding=None, sample_rate=None, channels=1):
+        self.on_update = on_update
+        self.options = build_live_options(encoding, sample_rate, channels)
+        self.segments = []
+        self.interim = ""
+        self.audio_bytes = 0
+        self._flushed = asyncio.Event()
+        self._connection = None
+    
+    @property
+    def transcript(self):
+        return " ".join(self.segments)
+    
+    async def start(self):
+        self._connection = deepgram.listen.asyncwebsocket.v("1")
+        self._connection.on(LiveTranscriptionEvents.Transcript, self._on_transcript)
+        if not await self._connection.start(self.options):
+            raise Exception("Could not open a live transcription connection")
+    
+    async def send(self, chunk):
+        self.audio_bytes += len(chunk)
+        await self._connection.send(chunk)
+    
+    async def finish(self):
+        """Flush the recognizer, close the connection and return the final transcript."""
+        stop_time = time.perf_counter()
+        outcome = "finalize"
+        try:
+            if self.audio_bytes:
+                await self._connection.finalize()
+                await asyncio.wait_for(self._flushed.wait(), LIVE_FINALIZE_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Keep whatever was finalized; a trailing interim guess is better than nothing
+            outcome = "timeout"
+            if self.interim:
+                self.segments.append(self.interim)
+        finally:
+            await self.close()
+        observe_stage("deepgram_live", time.perf_counter() - stop_time, outcome)
+        return self.transcript
+    
+    async def close(self):
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            await connection.finish()
+    
+    async def _on_transcript(self, client, result, **kwargs):
+        text = result.channel.alternatives[0].transcript.strip()
+        if result.is_final:
+            if text:
+                self.segments.append(text)
+            self.interim = ""
+            if getattr(result, "from_finalize", False):
+                self._flushed.set()
+        else:
+            self.interim = text
+        running = " ".join(self.segments + ([self.interim] if self.interim else []))
+        await self.on_update(running, bool(result.is_final))
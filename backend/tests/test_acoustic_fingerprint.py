@@ -0,0 +1,49 @@
+import numpy as np
+from audio_format import build_wav, decode_wav, encode_samples, resample
+from acoustic_fingerprint import acoustic_fingerprint, FingerprintIndex
+
+
+def speech_like(seed, rate=16000, seconds=3.0):
+    """Noise whose spectral shape changes every 50 ms, roughly like syllables."""
+    rng = np.random.default_rng(seed)
+    segment = int(rate * 0.05)
+    pieces = []
+    for _ in range(int(seconds / 0.05)):
+        t = np.arange(segment) / rate
+        tones = sum(np.sin(2 * np.pi * rng.uniform(300, 3000) * t + rng.uniform(0, 6.3)) for _ in range(3))
+        pieces.append(tones * rng.uniform(0.2, 1.0) + 0.05 * rng.standard_normal(segment))
+    samples = np.concatenate(pieces)
+    return (0.2 * samples / np.max(np.abs(samples))).astype(np.float32).reshape(-1, 1), rate
+
+
+def test_reencoded_trimmed_copy_matches():
+    samples, rate = speech_like(1)
+    index = FingerprintIndex()
+    index.add("original", acoustic_fingerprint(samples, rate))
+
+    # Quieter, resampled to 8 kHz, mu-law encoded and with the first 300 ms cut off
+    copy = resample(samples[int(0.3 * rate):] * 0.5, rate, 8000)
+    copy, copy_rate = decode_wav(build_wav(encode_samples(copy, "pcm_mulaw"), "pcm_mulaw", 8000))
+    assert index.match(acoustic_fingerprint(copy, copy_rate)) == "original"
+    assert index.stats()["matches"] == 1
+
+
+def test_different_clip_does_not_match():
+    index = FingerprintIndex()
+    index.add("original", acoustic_fingerprint(*speech_like(1)))
+    assert index.match(acoustic_fingerprint(*speech_like(2))) is None
+    assert index.stats()["misses"] == 1
+
+
+def test_short_clips_have_no_fingerprint():
+    samples, rate = speech_like(1, seconds=0.5)
+    assert acoustic_fingerprint(samples, rate) is None
+
+
+def test_index_is_bounded():
+    index = FingerprintIndex(max_entries=2)
+    for seed in range(3):
+        index.add(f"clip{seed}", acoustic_fingerprint(*speech_like(seed)))
+    assert index.stats()["entries"] == 2
+    assert index.match(acoustic_fingerprint(*speech_like(0))) is None
+    assert index.match(acoustic_fingerprint(*speech_like(2))) == "clip2"
@@ -0,0 +1,41 @@
+import time
+import pytest
+from admission import WorkQueue, Overloaded
+
+
+def test_idle_queue_admits_after_slow_jobs():
+    queue = WorkQueue("test", workers=2, max_queue=8, initial_service_time=0.1)
+    for _ in range(4):
+        for future in [queue.submit(5.0, time.sleep, 1.5) for _ in range(2)]:
+            future.result()
+    assert queue.service_time > 1.0
+
+    # The average now exceeds the deadline, but an idle worker still takes the job
+    for _ in range(20):
+        assert queue.submit(1.0, lambda: None).result() is None
+    assert queue.service_time < 1.0
+    assert queue.rejected_deadline == 0
+
+
+def test_deadline_rejections_decay_estimate():
+    queue = WorkQueue("test", workers=1, max_queue=8, initial_service_time=2.0)
+    blocker = queue.submit(10.0, time.sleep, 0.5)
+    rejections = 0
+    while True:
+        try:
+            queue.submit(1.0, lambda: None).result()
+            break
+        except Overloaded:
+            rejections += 1
+    blocker.result()
+    assert rejections > 0
+    assert queue.service_time < 2.0
+
+
+def test_full_queue_rejects_with_429():
+    queue = WorkQueue("test", workers=1, max_queue=1, initial_service_time=0.01)
+    queue.submit(10.0, time.sleep, 0.3)
+    queue.submit(10.0, lambda: None)
+    with pytest.raises(Overloaded) as rejected:
+        queue.submit(10.0, lambda: None)
+    assert rejected.value.status == 429
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from audio_format import (
+    build_wav, decode_wav, encode_samples, mulaw_encode, mulaw_decode, resample, transcode_wav,
+    parse_fmt, parse_wav, WAVE_FORMAT_MULAW
+)
+
+
+def tone(frequency, rate, seconds=0.5, amplitude=0.5):
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32).reshape(-1, 1)
+
+
+def test_mulaw_round_trip_error_is_bounded():
+    pcm16 = np.linspace(-32768, 32767, 4096).astype(np.int16)
+    decoded = mulaw_decode(mulaw_encode(pcm16)).astype(np.int32)
+    error = np.abs(decoded - pcm16.astype(np.int32))
+    # G.711 quantization steps grow with magnitude, so the error stays within a few percent
+    assert np.all(error <= np.maximum(np.abs(pcm16.astype(np.int32)) / 16, 16))
+    assert mulaw_decode(mulaw_encode(np.array([0], dtype=np.int16)))[0] == 0
+
+
+def test_mulaw_wav_decodes_to_the_same_signal():
+    samples = tone(440, 16000)
+    wav = build_wav(encode_samples(samples, "pcm_mulaw"), "pcm_mulaw", 16000)
+    format_tag, channels, rate, bits = parse_fmt(parse_wav(wav)[0])
+    assert (format_tag, channels, rate, bits) == (WAVE_FORMAT_MULAW, 1, 16000, 8)
+    decoded, decoded_rate = decode_wav(wav)
+    assert decoded_rate == 16000
+    assert decoded.shape == samples.shape
+    assert np.max(np.abs(decoded - samples)) < 0.02
+
+
+def test_resample_keeps_duration_and_tone():
+    samples = tone(440, 44100)
+    resampled = resample(samples, 44100, 16000)
+    assert len(resampled) == 8000
+    spectrum = np.abs(np.fft.rfft(resampled[:, 0]))
+    assert abs(np.argmax(spectrum) * 16000 / len(resampled) - 440) < 5
+
+
+def test_downsampling_filters_out_aliasing_frequencies():
+    # 10 kHz is above the 8 kHz Nyquist limit of 16 kHz audio and must not fold back in
+    resampled = resample(tone(10000, 44100), 44100, 16000)
+    assert np.sqrt(np.mean(resampled[500:-500] ** 2)) < 0.05
+
+
+def test_transcode_master_to_telephony_format():
+    master = build_wav(encode_samples(tone(440, 44100), "pcm_f32le"), "pcm_f32le", 44100)
+    decoded, rate = decode_wav(transcode_wav(master, "pcm_mulaw", 16000))
+    assert rate == 16000
+    assert len(decoded) == 8000
+    with pytest.raises(ValueError):
+        transcode_wav(master, "mp3", 16000)
+    with pytest.raises(ValueError):
+        transcode_wav(master, "pcm_s16le", 8000)
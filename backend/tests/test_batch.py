@@ -0,0 +1,137 @@
+import io
+import json
+import re
+import threading
+import time
+import zipfile
+import numpy as np
+import pytest
+from admission import WorkQueue, Overloaded
+from audio_format import build_wav, encode_samples
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    # app.py keeps its caches and access log in the working directory, against fake upstreams
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path_factory.mktemp("batch"))
+        for name, value in {"UPSTREAM_PROVIDER": "fake", "PREWARM_ENABLED": "0",
+                            "FAKE_TTS_MEDIAN_MS": "5", "FAKE_STT_MEDIAN_MS": "5"}.items():
+            patch.setenv(name, value)
+        import app
+        yield app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def multipart_parts(response):
+    boundary = re.search(r'boundary=(\S+)', response.headers["Content-Type"]).group(1)
+    parts = []
+    for chunk in response.data.split(f"--{boundary}".encode())[1:-1]:
+        head, _, body = chunk.strip(b"\r\n").partition(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n"))
+        parts.append((headers, body))
+    return parts
+
+
+def speech_wav(seconds, pitch):
+    t = np.arange(int(16000 * seconds)) / 16000
+    samples = (0.3 * np.sin(2 * np.pi * pitch * t)).astype(np.float32).reshape(-1, 1)
+    return build_wav(encode_samples(samples, "pcm_s16le"), "pcm_s16le", 16000)
+
+
+def test_fan_out_caps_parallelism_and_yields_in_completion_order(app_module):
+    queue = WorkQueue("test_batch", workers=4, max_queue=16, initial_service_time=0.01)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def job(delay):
+        with lock:
+            running.append(delay)
+            peak.append(len(running))
+        time.sleep(delay)
+        with lock:
+            running.remove(delay)
+        if delay == 0.05:
+            raise ValueError("upstream failed")
+        return delay
+
+    jobs = [(f"k{i}", job, delay) for i, delay in enumerate([0.3, 0.1, 0.05, 0.4])]
+    results = list(app_module.fan_out(queue, 5.0, jobs, parallelism=2))
+    assert max(peak) == 2
+    assert [key for key, _, _ in results] == ["k1", "k2", "k0", "k3"]
+    assert isinstance(results[1][2], ValueError)
+    assert [result for _, result, error in results if error is None] == [0.1, 0.3, 0.4]
+
+
+def test_fan_out_reports_rejected_jobs(app_module):
+    queue = WorkQueue("test_batch_full", workers=1, max_queue=1, initial_service_time=0.01)
+    jobs = [(f"k{i}", time.sleep, 0.1) for i in range(3)]
+    results = list(app_module.fan_out(queue, 5.0, jobs, parallelism=3))
+    assert sorted(key for key, _, _ in results) == ["k0", "k1", "k2"]
+    rejected = [error for _, _, error in results if error is not None]
+    assert len(rejected) == 1 and isinstance(rejected[0], Overloaded)
+
+
+def test_convert_batch_sends_cached_first_and_isolates_failures(client, app_module, monkeypatch):
+    assert client.post("/api/convert", json={"text": "Already cached."}).status_code == 200
+
+    synthesize = app_module.text_to_speech_rendition
+
+    def flaky(text, *args):
+        if text == "Upstream fails.":
+            raise RuntimeError("Cartesia unavailable")
+        return synthesize(text, *args)
+
+    monkeypatch.setattr(app_module, "text_to_speech_rendition", flaky)
+    response = client.post("/api/convert/batch", json={"items": [
+        {"text": "Fresh text."}, {"text": "Already cached."}, {"text": "Fresh text."},
+        {"text": "Bad voice.", "voice": "nobody"}, {"text": "Upstream fails."},
+    ]})
+    assert response.status_code == 200
+    parts = multipart_parts(response)
+    audio_parts = [headers["X-Batch-Items"] for headers, _ in parts if headers["Content-Type"] == "audio/wav"]
+    assert audio_parts == ["1", "0,2"]
+
+    manifest = json.loads(parts[-1][1])
+    assert [item["status"] for item in manifest["items"]] == ["synthesized", "cached", "synthesized", "error", "error"]
+    assert manifest["items"][0]["cache_key"] == manifest["items"][2]["cache_key"]
+    assert "Voice must be one of" in manifest["items"][3]["error"]
+    assert "Cartesia unavailable" in manifest["items"][4]["error"]
+    assert manifest["counts"] == {"synthesized": 2, "cached": 1, "error": 2}
+
+
+def test_convert_batch_zip_has_manifest(client):
+    response = client.post("/api/convert/batch", json={"texts": ["One.", "Two."], "format": "zip"})
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        assert sorted(archive.namelist()) == ["0000.wav", "0001.wav", "manifest.json"]
+    assert [item["file"] for item in manifest["items"]] == ["0000.wav", "0001.wav"]
+
+
+def test_transcribe_batch_dedupes_and_isolates_failures(client, app_module, monkeypatch):
+    good, bad = speech_wav(1.0, 220), speech_wav(1.0, 330)
+    transcribe = app_module.transcribe_audio
+
+    def flaky(audio_data):
+        if audio_data == bad:
+            raise RuntimeError("Deepgram unavailable")
+        return transcribe(audio_data)
+
+    monkeypatch.setattr(app_module, "transcribe_audio", flaky)
+    response = client.post("/api/transcribe/batch", data={"audio": [
+        (io.BytesIO(good), "a.wav"), (io.BytesIO(bad), "b.wav"), (io.BytesIO(good), "c.wav"),
+        (io.BytesIO(b"tiny"), "d.wav"),
+    ]}, content_type="multipart/form-data")
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    by_index = {line["index"]: line for line in lines[:-1]}
+    assert sorted(by_index) == [0, 1, 2, 3]
+    assert by_index[0]["status"] == by_index[2]["status"] == "transcribed"
+    assert by_index[0]["transcript"] == by_index[2]["transcript"]
+    assert by_index[1]["status"] == "error" and "Deepgram unavailable" in by_index[1]["error"]
+    assert by_index[3]["status"] == "no_speech"
+    assert lines[-1] == {"done": True, "items": 4, "counts": {"no_speech": 1, "transcribed": 2, "error": 1}}
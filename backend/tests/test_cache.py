@@ -0,0 +1,49 @@
+import time
+from cache import LRUCache, sizeof
+
+
+def test_sizeof_counts_utf8_bytes():
+    assert sizeof(b"abc") == 3
+    assert sizeof("abc") == 3
+    assert sizeof("héllo") == 6
+    assert sizeof("日本") == 6
+
+
+def test_evicts_least_recently_used_past_byte_budget():
+    cache = LRUCache("test", max_bytes=10)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"  # "b" is now the least recently used
+    cache.set("c", b"cccc")
+    assert "b" not in cache
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+    assert cache.current_bytes == 8
+    assert cache.stats()["evictions"] == 1
+
+
+def test_replacing_a_key_updates_byte_total():
+    cache = LRUCache("test", max_bytes=100)
+    cache.set("a", b"x" * 40)
+    cache.set("a", b"x" * 10)
+    assert cache.current_bytes == 10
+    assert len(cache) == 1
+
+
+def test_oversized_value_drops_existing_entry():
+    cache = LRUCache("test", max_bytes=10)
+    cache.set("a", b"old")
+    cache.set("a", b"x" * 11)
+    assert cache.get("a") is None
+    assert cache.current_bytes == 0
+
+
+def test_expired_entries_are_missed_and_purged():
+    cache = LRUCache("test", max_bytes=100, ttl=0.05)
+    cache.set("a", b"a")
+    cache.set("b", b"b")
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.purge_expired() == 1
+    assert cache.current_bytes == 0
+    assert cache.stats()["expirations"] == 2
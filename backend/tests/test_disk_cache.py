@@ -0,0 +1,60 @@
+import os
+from disk_cache import DiskCache, content_digest, file_content_digest
+
+
+def test_write_lookup_and_digest(tmp_path):
+    cache = DiskCache(str(tmp_path), ".bin", max_bytes=1000)
+    cache.write("abcd", b"payload")
+    path, digest = cache.lookup("abcd")
+    assert path == os.path.join(str(tmp_path), "ab", "abcd.bin")
+    assert digest == content_digest(b"payload") == file_content_digest(path)
+    assert cache.read("missing") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_quota_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), ".bin", max_bytes=1000)
+    for i in range(4):
+        cache.write(f"k{i}", b"x" * 240)
+    assert cache.read("k0") is not None  # k1 is now the least recently used
+    cache.write("k4", b"x" * 240)
+    assert cache.read("k1") is None
+    assert cache.read("k0") is not None
+    stats = cache.stats()
+    assert stats["bytes"] <= 1000 * 0.9
+    assert stats["entries"] == 3
+
+
+def test_quota_is_shared_by_instances_on_one_index(tmp_path):
+    first = DiskCache(str(tmp_path), ".bin", max_bytes=1000)
+    second = DiskCache(str(tmp_path), ".bin", max_bytes=1000)
+    for i in range(8):
+        (first if i % 2 else second).write(f"k{i}", b"x" * 200)
+    assert first.stats()["bytes"] == second.stats()["bytes"] <= 1000
+
+
+def test_missing_file_drops_index_row(tmp_path):
+    cache = DiskCache(str(tmp_path), ".bin", max_bytes=1000)
+    cache.write("abcd", b"payload")
+    os.remove(cache.path_for("abcd"))
+    assert cache.lookup("abcd") is None
+    assert not cache.contains("abcd")
+
+
+def test_legacy_files_are_adopted(tmp_path):
+    (tmp_path / "abcd.wav").write_bytes(b"legacy audio")
+    cache = DiskCache(str(tmp_path), ".wav", max_bytes=1000)
+    assert not (tmp_path / "abcd.wav").exists()
+    path, digest = cache.lookup("abcd")
+    assert path == cache.path_for("abcd")
+    assert digest == content_digest(b"legacy audio")
+    assert cache.stats()["entries"] == 1
+
+
+def test_legacy_files_are_discarded_when_keys_changed(tmp_path):
+    (tmp_path / "abcd.txt").write_bytes(b"legacy transcript")
+    DiskCache(str(tmp_path), ".txt", max_bytes=1000)  # adopts the file into the index
+    cache = DiskCache(str(tmp_path), ".txt", max_bytes=1000, adopt_legacy=False)
+    assert cache.stats()["entries"] == 0
+    assert not os.path.exists(cache.path_for("abcd"))
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+import pytest
+import resilience
+from resilience import CircuitBreaker, CircuitOpen, DeadlineExceeded, UpstreamPolicy
+
+
+@pytest.fixture(autouse=True)
+def fast_breaker(monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKER_MIN_CALLS", 4)
+    monkeypatch.setattr(resilience, "BREAKER_COOLDOWN", 0.1)
+
+
+def trip(breaker):
+    for _ in range(4):
+        breaker.record(False)
+
+
+def test_breaker_opens_on_failure_rate():
+    breaker = CircuitBreaker("test")
+    breaker.record(True)
+    breaker.record(False)
+    breaker.record(True)
+    assert breaker.state == "closed"
+    breaker.record(False)  # 2 of 4 recent calls failed
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen) as rejected:
+        breaker.allow()
+    assert rejected.value.status == 503
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    breaker = CircuitBreaker("test")
+    trip(breaker)
+    time.sleep(0.15)
+    breaker.allow()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpen):
+        breaker.allow()  # Only one probe at a time
+    breaker.record(True)
+    assert breaker.state == "closed"
+    breaker.allow()
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker("test")
+    trip(breaker)
+    time.sleep(0.15)
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+
+
+def test_abandoned_probe_frees_the_slot():
+    breaker = CircuitBreaker("test")
+    trip(breaker)
+    time.sleep(0.15)
+    breaker.allow()
+    breaker.record(None)
+    breaker.allow()
+    assert breaker.state == "half_open"
+
+
+def test_open_breaker_fails_fast_without_calling_upstream():
+    policy = UpstreamPolicy("test", deadline=1.0, hedge=False)
+    trip(policy.breaker)
+    calls = []
+    with pytest.raises(CircuitOpen):
+        policy.call(lambda timeout: calls.append(timeout))
+    assert calls == []
+
+
+def warmed_policy(deadline=2.0):
+    policy = UpstreamPolicy("test", deadline=deadline)
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        policy.record(True, 0.01)
+    return policy
+
+
+def test_slow_call_is_hedged_and_the_hedge_wins():
+    policy = warmed_policy()
+    first_call = threading.Event()
+
+    def upstream(timeout):
+        if not first_call.is_set():
+            first_call.set()
+            time.sleep(1.0)
+            return "slow"
+        return "fast"
+
+    start = time.monotonic()
+    assert policy.call(upstream) == "fast"
+    assert time.monotonic() - start < 0.5
+    stats = policy.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+
+
+def test_async_slow_call_is_hedged_and_the_loser_cancelled():
+    policy = warmed_policy()
+    cancelled = []
+
+    async def upstream(timeout):
+        if not cancelled:
+            cancelled.append(False)
+            try:
+                await asyncio.sleep(1.0)
+            except asyncio.CancelledError:
+                cancelled[0] = True
+                raise
+            return "slow"
+        return "fast"
+
+    async def main():
+        result = await policy.call_async(upstream)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "fast"
+    assert cancelled == [True]
+    assert policy.stats()["hedge_wins"] == 1
+
+
+def test_deadline_exceeded_counts_as_failure():
+    policy = UpstreamPolicy("test", deadline=0.1, hedge=False)
+    with pytest.raises(DeadlineExceeded):
+        policy.call(lambda timeout: time.sleep(0.5))
+    assert policy.stats()["deadline_exceeded"] == 1
+    assert policy.breaker.stats()["recent_failures"] == 1
+
+
+def test_error_from_every_attempt_is_raised():
+    policy = UpstreamPolicy("test", deadline=1.0, hedge=False)
+
+    def upstream(timeout):
+        raise ConnectionError("connection reset")
+
+    with pytest.raises(ConnectionError):
+        policy.call(upstream)
+    assert policy.stats()["deadline_exceeded"] == 0
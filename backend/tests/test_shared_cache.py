@@ -0,0 +1,79 @@
+import threading
+import pytest
+from shared_cache import SQLiteStore, RedisStore
+from fake_upstreams import FakeRedis
+
+
+def sqlite_stores(tmp_path, count):
+    # Separate connections to one file stand in for separate worker processes
+    stores = [SQLiteStore(str(tmp_path / "shared.db")) for _ in range(count)]
+    for store in stores:
+        store.register("test", 1024 * 1024)
+    return stores
+
+
+def redis_stores(tmp_path, count):
+    client = FakeRedis()
+    stores = [RedisStore(client) for _ in range(count)]
+    for store in stores:
+        store.register("test", 1024 * 1024)
+    return stores
+
+
+def increment(value):
+    return str(int(value or 0) + 1)
+
+
+@pytest.mark.parametrize("make_stores", [sqlite_stores, redis_stores])
+def test_concurrent_updates_are_not_lost(tmp_path, make_stores):
+    stores = make_stores(tmp_path, 4)
+
+    def worker(store):
+        for _ in range(25):
+            store.update("test", "counter", increment)
+
+    threads = [threading.Thread(target=worker, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stores[0].get("test", "counter") == "100"
+
+
+@pytest.mark.parametrize("make_stores", [sqlite_stores, redis_stores])
+def test_failed_update_keeps_old_value_and_releases_lock(tmp_path, make_stores):
+    store, = make_stores(tmp_path, 1)
+    store.set("test", "key", "old")
+
+    def fail(value):
+        raise ValueError("change failed")
+
+    with pytest.raises(ValueError):
+        store.update("test", "key", fail)
+    assert store.get("test", "key") == "old"
+    assert store.update("test", "key", lambda value: value + "+new") == "old+new"
+
+
+def test_redis_update_does_not_release_a_lock_taken_over_by_another_writer():
+    client = FakeRedis()
+    store = RedisStore(client)
+    store.register("test", 1024 * 1024)
+    lock_key = "chatbot:test:key:lock"
+
+    def slow_change(value):
+        # Our lock expired and another writer took it before we finished
+        client.set(lock_key, "other-writer")
+        return "new"
+
+    store.update("test", "key", slow_change)
+    assert client.get(lock_key) == b"other-writer"
+
+
+def test_sqlite_namespace_stays_within_budget(tmp_path):
+    store = SQLiteStore(str(tmp_path / "shared.db"))
+    store.register("small", 100)
+    for i in range(10):
+        store.set("small", f"k{i}", b"x" * 30)
+    assert store.stats()["namespaces"]["small"]["bytes"] <= 100
+    assert store.get("small", "k9") == b"x" * 30
+    assert store.get("small", "k0") is None
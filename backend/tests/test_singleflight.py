@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import pytest
+from singleflight import SingleFlight, AsyncSingleFlight
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_calls_share_one_leader():
+    flight = SingleFlight("test")
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    threading.Timer(0.2, release.set).start()
+    results, errors = run_concurrently(5, lambda: flight.do("key", slow))
+    assert results == ["result"] * 5
+    assert errors == [None] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+
+def test_leader_error_reaches_every_caller():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    threading.Timer(0.2, release.set).start()
+    _, errors = run_concurrently(3, lambda: flight.do("key", failing))
+    assert all(isinstance(e, ValueError) for e in errors)
+
+    # The key is released, so the next call runs again
+    assert flight.do("key", lambda: "fresh") == "fresh"
+
+
+def test_stream_followers_replay_from_the_start():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def chunks():
+        yield b"a"
+        release.wait(5)
+        yield b"b"
+
+    first = flight.do_stream("key", chunks)
+    assert next(first) == b"a"
+    second = flight.do_stream("key", chunks)
+    release.set()
+    assert list(first) == [b"b"]
+    assert list(second) == [b"a", b"b"]
+
+
+def test_async_calls_share_one_task_and_errors():
+    flight = AsyncSingleFlight("test")
+    calls = []
+
+    async def slow(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        if value == "bad":
+            raise ValueError("upstream failed")
+        return value
+
+    async def main():
+        results = await asyncio.gather(*[flight.do("good", slow, "good") for _ in range(4)])
+        assert results == ["good"] * 4
+        with pytest.raises(ValueError):
+            await asyncio.gather(flight.do("bad", slow, "bad"), flight.do("bad", slow, "bad"))
+
+    asyncio.run(main())
+    assert calls == ["good", "bad"]
+    assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,44 @@
+import numpy as np
+from vad import find_speech, PAD_MS
+
+RATE = 16000
+
+
+def voiced(seconds, amplitude=0.3):
+    """A 150 Hz buzz with harmonics: loud, and few zero crossings like voiced speech."""
+    t = np.arange(int(RATE * seconds)) / RATE
+    return amplitude * (np.sin(2 * np.pi * 150 * t) + 0.5 * np.sin(2 * np.pi * 450 * t))
+
+
+def hiss(seconds, amplitude, seed=0):
+    return amplitude * np.random.default_rng(seed).standard_normal(int(RATE * seconds))
+
+
+def clip(*parts):
+    return np.concatenate(parts).astype(np.float32).reshape(-1, 1)
+
+
+def test_trims_silence_around_speech_with_padding():
+    samples = clip(hiss(1.0, 0.001), voiced(1.0), hiss(1.0, 0.001, seed=1))
+    start, end = find_speech(samples, RATE)
+    pad = RATE * PAD_MS // 1000
+    assert abs(start - (RATE - pad)) <= RATE // 50
+    assert abs(end - (2 * RATE + pad)) <= RATE // 50
+
+
+def test_silence_and_hiss_hold_no_speech():
+    assert find_speech(clip(np.zeros(RATE * 2)), RATE) is None
+    assert find_speech(clip(hiss(2.0, 0.05)), RATE) is None
+
+
+def test_short_click_is_not_speech():
+    assert find_speech(clip(hiss(1.0, 0.001), voiced(0.06), hiss(1.0, 0.001, seed=1)), RATE) is None
+
+
+def test_continuous_speech_is_kept_whole():
+    samples = clip(voiced(2.0))
+    assert find_speech(samples, RATE) == (0, len(samples))
+
+
+def test_empty_clip():
+    assert find_speech(np.zeros((0, 1), dtype=np.float32), RATE) is None
@@ -1,13 +1,26 @@
 import os
+import math
 import logging
 import types
 import hashlib
-from cartesia import Cartesia
 from dotenv import load_dotenv
 import io
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, Future
 import threading
 import time
+import re
+import queue
+import asyncio
+import contextvars
+from cache import get_cache
+from disk_cache import DiskCache
+from singleflight import SingleFlight, AsyncSingleFlight
+from admission import Overloaded
+from resilience import get_policy
+from metrics import observe_stage
+from access_log import record_access
+from providers import create_tts_clients
+from audio_format import parse_wav, streaming_wav_header, transcode_wav, concat_wavs, MASTER_ENCODING, MASTER_SAMPLE_RATE
 
 # Load environment variables
 load_dotenv()
@@ -16,27 +29,37 @@ load_dotenv()
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Create thread pool for parallel processing - shared with app.py
+# Thread pool for pipelined sentence synthesis and background cache writes (routes use admission.py queues)
 executor = ThreadPoolExecutor(max_workers=16)  # Increased from 4 to match stt.py
 
-# Get API key with better error handling
-api_key = os.environ.get("CARTESIA_API_KEY")
-if not api_key:
-    logger.error("CARTESIA_API_KEY is not set in environment variables")
-    raise ValueError("CARTESIA_API_KEY is not set. Please check your .env file.")
+# Initialize clients - the async client serves async_server.py. TTS_PROVIDER=fake swaps in
+# local stand-ins for load testing (see providers.py)
+client, async_client = create_tts_clients()
 
-# Initialize client
-client = Cartesia(api_key=api_key)
+# Deadline, hedging and circuit breaker for Cartesia calls (see resilience.py)
+cartesia = get_policy("cartesia", deadline=10)
 
-# Create cache directory if it doesn't exist
+# Sharded, quota-bounded disk cache with an on-disk index
 cache_dir = "tts_cache"
-os.makedirs(cache_dir, exist_ok=True)
+DISK_CACHE_MAX_BYTES = int(os.getenv("TTS_DISK_CACHE_BYTES", 2 * 1024 * 1024 * 1024))
+# Master renditions keep the legacy md5(text:voice:speed) key, so flat-layout files are still valid
+disk_cache = DiskCache(cache_dir, ".wav", DISK_CACHE_MAX_BYTES, policy=os.getenv("TTS_DISK_CACHE_POLICY", "lru"))
 
-# In-memory cache for ultra-fast responses - aligned with app.py
-memory_cache = {}
-MEMORY_CACHE_SIZE = 100  # Maximum number of entries to keep in memory
+# In-memory cache for ultra-fast responses - byte-budgeted LRU shared via cache.py
 MEMORY_CACHE_EXPIRY = 3600  # 1 hour, matching app.py's CACHE_EXPIRY
-memory_cache_lock = threading.Lock()  # Add thread safety
+memory_cache = get_cache("tts", ttl=MEMORY_CACHE_EXPIRY, sliding_ttl=True)
+
+# Coalesces identical in-flight synthesis requests
+tts_flight = SingleFlight("tts")
+tts_async_flight = AsyncSingleFlight("tts_async")
+
+# Optimization: Multi-sentence texts are synthesized and cached sentence by sentence, so a
+# reply that repeats earlier sentences only pays Cartesia for the new ones. Segments get their
+# own pool because text_to_speech itself may already be running on the shared executor.
+# Opt-in: sentences synthesized separately lose cross-sentence prosody at the joins
+SEGMENT_CACHE_ENABLED = os.getenv("TTS_SEGMENT_CACHE", "0") == "1"
+segment_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TTS_SEGMENT_WORKERS", 8)), thread_name_prefix="tts-segment")
+SEGMENT_TIMEOUT = 15
 
 # Pre-define voice and speed mappings as constants for faster lookup
 VOICE_MAPPING = {
@@ -55,8 +78,255 @@ SPEED_MAPPING = {
 }
 SPEED_VALUES = sorted(SPEED_MAPPING.keys())
 
+def tts_cache_key(text, voice, speed):
+    """Cache key for a synthesized text, shared by the memory and file caches."""
+    return hashlib.md5(f"{text}:{voice}:{speed}".encode()).hexdigest()
+
+def segment_cache_key(sentence, voice, speed):
+    """Cache key for one sentence's audio; a different namespace from whole-text keys."""
+    return hashlib.md5(f"segment:{sentence}:{voice}:{speed}".encode()).hexdigest()
+
+def record_tts_access(cache_key, text, voice, speed, encoding=MASTER_ENCODING, sample_rate=MASTER_SAMPLE_RATE):
+    """Count a request for a rendition in the access log, with what prewarming needs to rebuild it."""
+    record_access("tts", cache_key, {"text": text, "voice": voice, "speed": speed,
+                                     "encoding": encoding, "sample_rate": sample_rate})
+
+def split_segments(text):
+    """Split text into whitespace-normalized sentences, the unit of the segment cache."""
+    return [" ".join(sentence.split()) for sentence in split_sentences_incremental([text])]
+
+def validate_tts_request(text, voice, speed):
+    """Raise ValueError for invalid text, voice or speed."""
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("Text must be a non-empty string")
+    if voice.lower() not in VOICE_MAPPING:
+        raise ValueError(f"Voice must be one of: {', '.join(VOICE_MAPPING.keys())}")
+    if not isinstance(speed, (int, float)) or speed < 0.5 or speed > 2.0:
+        raise ValueError("Speed must be between 0.5 and 2.0")
+
+def resolve_voice_settings(voice, speed):
+    """Map a voice name and numeric speed to the Cartesia voice id and speed setting."""
+    # Get voice ID from mapping
+    selected_voice = VOICE_MAPPING.get(voice.lower(), VOICE_MAPPING["default"])
+    
+    # Find closest speed setting
+    closest_speed = min(SPEED_VALUES, key=lambda x: abs(x - speed))
+    return selected_voice, SPEED_MAPPING[closest_speed]
+
+def rendition_cache_key(text, voice, speed, encoding=MASTER_ENCODING, sample_rate=MASTER_SAMPLE_RATE):
+    """Cache key for an output rendition; the canonical master uses the plain TTS key."""
+    master_key = tts_cache_key(text, voice, speed)
+    if encoding == MASTER_ENCODING and sample_rate == MASTER_SAMPLE_RATE:
+        return master_key
+    return hashlib.md5(f"{master_key}:{encoding}:{sample_rate}".encode()).hexdigest()
+
+def get_cached_audio(text, voice="default", speed=1.0, encoding=MASTER_ENCODING, sample_rate=MASTER_SAMPLE_RATE):
+    """Return audio from the in-memory cache without touching the executor, or None."""
+    return memory_cache.get(rendition_cache_key(text, voice, speed, encoding, sample_rate))
+
+def _synthesize_stream(text, selected_voice, speed_setting, cache_key):
+    """Stream audio from Cartesia, caching the complete file once the stream ends."""
+    logger.debug(f"Calling Cartesia TTS stream with model_id=sonic-2, voice_id={selected_voice}, speed={speed_setting}")
+    # Streams cannot be hedged, but they still respect the circuit breaker and deadline
+    cartesia.allow()
+    start_time = time.perf_counter()
+    outcome = None
+    try:
+        try:
+            # For streaming, use the generator directly from Cartesia
+            audio_stream = client.tts.stream(
+                model_id="sonic-2",
+                transcript=text,
+                voice={"mode": "id", "id": selected_voice, "experimental_controls": {"speed": speed_setting}},
+                language="en",
+                output_format={"container": "wav", "encoding": MASTER_ENCODING, "sample_rate": MASTER_SAMPLE_RATE},
+                request_options={"timeout_in_seconds": math.ceil(cartesia.deadline)}
+            )
+        except Exception as e:
+            observe_stage("cartesia", time.perf_counter() - start_time, "error")
+            logger.error(f"Error calling Cartesia TTS API: {e}", exc_info=True)
+            raise Exception(f"TTS API error: {str(e)}")
+        
+        # Collect chunks for caching while passing them through
+        chunks = []
+        for chunk in audio_stream:
+            if not chunks:
+                observe_stage("cartesia", time.perf_counter() - start_time, "first_chunk")
+            chunks.append(chunk)
+            yield chunk
+        outcome = True
+    except Exception:
+        outcome = False
+        raise
+    finally:
+        # A client that disconnects mid-stream leaves outcome None: neither success nor failure
+        cartesia.record(outcome, time.perf_counter() - start_time)
+    observe_stage("cartesia", time.perf_counter() - start_time, "complete")
+    
+    # After streaming completes, save to cache in background
+    def save_to_cache():
+        audio_data = b"".join(chunks)
+        if audio_data and len(audio_data) >= 100:
+            # Save to file cache
+            disk_cache.write(cache_key, audio_data)
+            
+            # Update memory cache
+            memory_cache.set(cache_key, audio_data)
+    
+    # Submit cache saving as a background task
+    executor.submit(save_to_cache)
+
+def collect_audio(audio_data):
+    """Join Cartesia output (bytes or a generator of chunks) into one bytes object."""
+    logger.debug(f"Received audio_data type: {type(audio_data)}")
+    if isinstance(audio_data, types.GeneratorType):
+        logger.debug("Combining audio chunks from generator")
+        # Combine chunks with progress tracking
+        chunks = []
+        chunk_count = 0
+        total_bytes = 0
+        
+        for chunk in audio_data:
+            if isinstance(chunk, bytes):
+                chunks.append(chunk)
+                chunk_count += 1
+                total_bytes += len(chunk)
+                
+        logger.debug(f"Combined {chunk_count} chunks, total size: {total_bytes} bytes")
+        return b"".join(chunks)
+    if not isinstance(audio_data, bytes):
+        raise TypeError(f"Expected bytes or generator, got {type(audio_data)}")
+    return audio_data
+
+def _request_audio(text, selected_voice, speed_setting, timeout):
+    """One Cartesia request for complete audio; the SDK abandons it after timeout seconds."""
+    return collect_audio(client.tts.bytes(
+        model_id="sonic-2",
+        transcript=text,
+        voice={"mode": "id", "id": selected_voice, "experimental_controls": {"speed": speed_setting}},
+        language="en",
+        output_format={"container": "wav", "encoding": MASTER_ENCODING, "sample_rate": MASTER_SAMPLE_RATE},
+        request_options={"timeout_in_seconds": max(1, math.ceil(timeout))}
+    ))
+
+def _synthesize_audio(text, selected_voice, speed_setting, cache_key):
+    """Synthesize complete audio with Cartesia and store it in both cache tiers."""
+    logger.debug(f"Calling Cartesia TTS with model_id=sonic-2, voice_id={selected_voice}, speed={speed_setting}")
+    start_time = time.perf_counter()
+    try:
+        # For non-streaming, get complete bytes; slow requests are hedged within the deadline
+        audio_data = cartesia.call(_request_audio, text, selected_voice, speed_setting)
+    except Overloaded:
+        raise  # Circuit open: surfaces as a 503 with Retry-After
+    except Exception as e:
+        observe_stage("cartesia", time.perf_counter() - start_time, "error")
+        logger.error(f"Error calling Cartesia TTS API: {e}", exc_info=True)
+        raise Exception(f"TTS API error: {str(e)}")
+    
+    observe_stage("cartesia", time.perf_counter() - start_time, "complete")
+    
+    # Validate audio data
+    if not audio_data or len(audio_data) < 100:
+        raise ValueError("Received empty or invalid audio data from TTS API")
+        
+    # Save to cache for future use
+    disk_cache.write(cache_key, audio_data)
+    
+    # Update memory cache (evicts least recently used entries past the byte budget)
+    memory_cache.set(cache_key, audio_data)
+    
+    return audio_data
+
+def cached_in_other_voice(text, voice, speed, encoding=MASTER_ENCODING, sample_rate=MASTER_SAMPLE_RATE):
+    """
+    Return a cached rendition of the same text in another voice, or None.
+    
+    Used when Cartesia is failing or its circuit is open: the right words in a
+    different voice are better than an error. A cached master is transcoded if the
+    rendition itself is not cached. The result is never cached under the requested
+    voice's key.
+    """
+    for other_voice in VOICE_MAPPING:
+        if other_voice == voice:
+            continue
+        master_key = tts_cache_key(text, other_voice, speed)
+        for cache_key in dict.fromkeys((rendition_cache_key(text, other_voice, speed, encoding, sample_rate), master_key)):
+            audio_data = memory_cache.get(cache_key)
+            if audio_data is None:
+                audio_data = disk_cache.read(cache_key)
+            if audio_data is None:
+                continue
+            logger.warning(f"Cartesia unavailable, serving cached '{other_voice}' voice instead of '{voice}' for: {text[:20]}...")
+            observe_stage("cartesia", 0.0, "fallback")
+            if cache_key == master_key and (encoding, sample_rate) != (MASTER_ENCODING, MASTER_SAMPLE_RATE):
+                audio_data = transcode_wav(audio_data, encoding, sample_rate)
+            return audio_data
+    return None
+
+def synthesize_segment(sentence, voice="default", speed=1.0):
+    """
+    Return the audio for one sentence from the segment cache, synthesizing it on a miss.
+    
+    Args:
+        sentence (str): A single sentence, as produced by split_segments.
+        voice (str): The voice to use ("default", "male", or "female").
+        speed (float): The speed of speech (0.5 to 2.0).
+        
+    Returns:
+        bytes: A complete WAV file in the master format.
+    """
+    segment_key = segment_cache_key(sentence, voice, speed)
+    record_access("tts", segment_key, {"segment": sentence, "voice": voice, "speed": speed})
+    audio_data = memory_cache.get(segment_key)
+    if audio_data is not None:
+        return audio_data
+    audio_data = disk_cache.read(segment_key)
+    if audio_data is not None:
+        memory_cache.set(segment_key, audio_data)
+        return audio_data
+    selected_voice, speed_setting = resolve_voice_settings(voice, speed)
+    return tts_flight.do(segment_key, _synthesize_audio, sentence, selected_voice, speed_setting, segment_key)
+
+def _segment_audio(segments, voice, speed):
+    """
+    Start fetching every segment's audio; returns one future per segment, in order.
+    
+    Repeated sentences within the text share one future, and misses go to Cartesia in parallel.
+    """
+    futures = {}
+    for sentence in segments:
+        if sentence not in futures:
+            # Copy the context so Cartesia timings keep the request's route label
+            futures[sentence] = segment_executor.submit(contextvars.copy_context().run,
+                                                        synthesize_segment, sentence, voice, speed)
+    return [futures[sentence] for sentence in segments]
+
+def _cache_joined_audio(wavs, cache_key):
+    """Join sentence WAVs by concatenating their PCM under one header and cache the result."""
+    audio_data = concat_wavs(wavs)
+    disk_cache.write(cache_key, audio_data)
+    memory_cache.set(cache_key, audio_data)
+    return audio_data
+
+def _synthesize_segmented(segments, voice, speed, cache_key):
+    """Build a multi-sentence text's audio from the segment cache, synthesizing only missing sentences."""
+    return _cache_joined_audio([future.result(timeout=SEGMENT_TIMEOUT) for future in _segment_audio(segments, voice, speed)],
+                               cache_key)
+
+def _stream_segmented(segments, voice, speed, cache_key):
+    """Stream per-sentence audio in order as it becomes ready; cached sentences go out immediately."""
+    wavs = []
+    for future in _segment_audio(segments, voice, speed):
+        wav = future.result(timeout=SEGMENT_TIMEOUT)
+        fmt_chunk, pcm = parse_wav(wav)
+        if not wavs:
+            yield streaming_wav_header(fmt_chunk)
+        wavs.append(wav)
+        yield pcm
+    executor.submit(_cache_joined_audio, wavs, cache_key)
+
 # In tts.py
-def text_to_speech(text, voice="default", speed=1.0, streaming=False):
+def text_to_speech(text, voice="default", speed=1.0, streaming=False, fallback=True):
     """
     Convert text to speech using Cartesia API with improved caching and streaming support.
     
@@ -65,6 +335,8 @@ def text_to_speech(text, voice="default", speed=1.0, streaming=False):
         voice (str): The voice to use ("default", "male", or "female").
         speed (float): The speed of speech (0.5 to 2.0).
         streaming (bool): Whether to return a streaming response.
+        fallback (bool): Whether a non-streaming request may be answered with a cached
+            rendition in another voice when Cartesia fails.
         
     Returns:
         bytes or generator: The audio data or a generator yielding audio chunks.
@@ -74,59 +346,36 @@ def text_to_speech(text, voice="default", speed=1.0, streaming=False):
         logger.debug(f"TTS request: text='{text[:50]}...', voice={voice}, speed={speed}, streaming={streaming}")
         
         # Input validation
-        if not isinstance(text, str) or not text.strip():
-            raise ValueError("Text must be a non-empty string")
-        if voice.lower() not in VOICE_MAPPING:
-            raise ValueError(f"Voice must be one of: {', '.join(VOICE_MAPPING.keys())}")
-        if not isinstance(speed, (int, float)) or speed < 0.5 or speed > 2.0:
-            raise ValueError("Speed must be between 0.5 and 2.0")
+        validate_tts_request(text, voice, speed)
         
-        # Generate cache keys
-        # Using a shorter hash for memory cache (just the first portion of text)
-        memory_cache_key = hashlib.md5(f"{text[:100]}:{voice}:{speed}".encode()).hexdigest()
-        
-        # Full hash for file cache
-        full_cache_key = hashlib.md5(f"{text}:{voice}:{speed}".encode()).hexdigest()
-        cache_path = os.path.join(cache_dir, f"{full_cache_key}.wav")
+        # Generate cache key - the full-text hash is shared by the memory and file caches
+        # so texts with a common prefix never collide
+        full_cache_key = tts_cache_key(text, voice, speed)
+        record_tts_access(full_cache_key, text, voice, speed)
         
         # For streaming requests, we'll still check cache first
         # If found in cache, we can send the entire file as a stream
         
-        # Check memory cache first (fastest) with thread safety
-        with memory_cache_lock:
-            if memory_cache_key in memory_cache:
-                cached_entry = memory_cache[memory_cache_key]
-                if time.time() - cached_entry['timestamp'] < MEMORY_CACHE_EXPIRY:
-                    logger.debug(f"Found in-memory cached audio for: {text[:20]}...")
-                    # Update timestamp to keep frequently used items fresh
-                    memory_cache[memory_cache_key]['timestamp'] = time.time()
-                    
-                    if streaming:
-                        # For streaming, return a generator that yields the cached data
-                        def yield_cached():
-                            yield cached_entry['audio_data']
-                        return yield_cached()
-                    else:
-                        return cached_entry['audio_data']
+        # Check memory cache first (fastest); hits refresh recency and TTL
+        cached_audio = memory_cache.get(full_cache_key)
+        if cached_audio is not None:
+            logger.debug(f"Found in-memory cached audio for: {text[:20]}...")
+            
+            if streaming:
+                # For streaming, return a generator that yields the cached data
+                def yield_cached():
+                    yield cached_audio
+                return yield_cached()
+            else:
+                return cached_audio
         
         # Then check file cache
-        if os.path.exists(cache_path):
+        audio_data = disk_cache.read(full_cache_key)
+        if audio_data is not None:
             logger.debug(f"Found cached audio file for: {text[:20]}...")
-            with open(cache_path, "rb") as f:
-                audio_data = f.read()
                 
-            # Update memory cache with thread safety
-            with memory_cache_lock:
-                memory_cache[memory_cache_key] = {
-                    'audio_data': audio_data,
-                    'timestamp': time.time()
-                }
-                
-                # Clean memory cache if too large
-                if len(memory_cache) > MEMORY_CACHE_SIZE:
-                    # Remove oldest entry
-                    oldest_key = min(memory_cache.keys(), key=lambda k: memory_cache[k]['timestamp'])
-                    del memory_cache[oldest_key]
+            # Update memory cache (evicts least recently used entries past the byte budget)
+            memory_cache.set(full_cache_key, audio_data)
             
             if streaming:
                 # For streaming, return a generator that yields the cached data
@@ -137,157 +386,339 @@ def text_to_speech(text, voice="default", speed=1.0, streaming=False):
                 return audio_data
         
         # If not in cache, generate new audio
-        # Get voice ID from mapping
-        selected_voice = VOICE_MAPPING.get(voice.lower(), VOICE_MAPPING["default"])
+        selected_voice, speed_setting = resolve_voice_settings(voice, speed)
         
-        # Find closest speed setting
-        closest_speed = min(SPEED_VALUES, key=lambda x: abs(x - speed))
-        speed_setting = SPEED_MAPPING[closest_speed]
+        # Texts of several sentences are assembled from the sentence cache
+        segments = split_segments(text) if SEGMENT_CACHE_ENABLED else []
+        segmented = len(segments) > 1
         
-        logger.debug(f"Calling Cartesia TTS with model_id=sonic-2, voice_id={selected_voice}, speed={speed_setting}")
+        # Identical concurrent requests share one Cartesia call; streaming followers
+        # replay the leader's chunks from the start
+        if streaming:
+            if segmented:
+                return tts_flight.do_stream(full_cache_key, _stream_segmented, segments, voice, speed, full_cache_key)
+            return tts_flight.do_stream(full_cache_key, _synthesize_stream, text, selected_voice, speed_setting, full_cache_key)
         
-        # Add timeout handling
         try:
-            # If streaming is requested, handle differently
-            if streaming:
-                # For streaming, use the generator directly from Cartesia
-                audio_stream = client.tts.stream(
-                    model_id="sonic-2",
-                    transcript=text,
-                    voice={"mode": "id", "id": selected_voice, "experimental_controls": {"speed": speed_setting}},
-                    language="en",
-                    output_format={"container": "wav", "encoding": "pcm_f32le", "sample_rate": 44100}
-                )
-                
-                # Create a buffered wrapper around the stream to collect chunks for caching
-                chunks = []
-                
-                def buffered_stream():
-                    for chunk in audio_stream:
-                        chunks.append(chunk)
-                        yield chunk
-                    
-                    # After streaming completes, save to cache in background
-                    def save_to_cache():
-                        audio_data = b"".join(chunks)
-                        if audio_data and len(audio_data) >= 100:
-                            # Save to file cache
-                            with open(cache_path, "wb") as f:
-                                f.write(audio_data)
-                            
-                            # Update memory cache
-                            with memory_cache_lock:
-                                memory_cache[memory_cache_key] = {
-                                    'audio_data': audio_data,
-                                    'timestamp': time.time()
-                                }
-                    
-                    # Submit cache saving as a background task
-                    executor.submit(save_to_cache)
-                
-                return buffered_stream()
+            if segmented:
+                audio_data = tts_flight.do(full_cache_key, _synthesize_segmented, segments, voice, speed, full_cache_key)
             else:
-                # For non-streaming, get complete bytes
-                audio_data = client.tts.bytes(
-                    model_id="sonic-2",
-                    transcript=text,
-                    voice={"mode": "id", "id": selected_voice, "experimental_controls": {"speed": speed_setting}},
-                    language="en",
-                    output_format={"container": "wav", "encoding": "pcm_f32le", "sample_rate": 44100}
-                )
-        except Exception as e:
-            logger.error(f"Error calling Cartesia TTS API: {e}", exc_info=True)
-            raise Exception(f"TTS API error: {str(e)}")
+                audio_data = tts_flight.do(full_cache_key, _synthesize_audio, text, selected_voice, speed_setting, full_cache_key)
+        except Exception:
+            audio_data = cached_in_other_voice(text, voice, speed) if fallback else None
+            if audio_data is None:
+                raise
         
-        # For non-streaming mode, process the response
-        if not streaming:
-            logger.debug(f"Received audio_data type: {type(audio_data)}")
-            if isinstance(audio_data, types.GeneratorType):
-                logger.debug("Combining audio chunks from generator")
-                # Combine chunks with progress tracking
-                chunks = []
-                chunk_count = 0
-                total_bytes = 0
-                
-                for chunk in audio_data:
-                    if isinstance(chunk, bytes):
-                        chunks.append(chunk)
-                        chunk_count += 1
-                        total_bytes += len(chunk)
-                        
-                audio_data = b"".join(chunks)
-                logger.debug(f"Combined {chunk_count} chunks, total size: {total_bytes} bytes")
-            elif not isinstance(audio_data, bytes):
-                raise TypeError(f"Expected bytes or generator, got {type(audio_data)}")
-            
-            # Validate audio data
-            if not audio_data or len(audio_data) < 100:
-                raise ValueError("Received empty or invalid audio data from TTS API")
-                
-            # Save to cache for future use
-            with open(cache_path, "wb") as f:
-                f.write(audio_data)
-            
-            # Update memory cache with thread safety
-            with memory_cache_lock:
-                memory_cache[memory_cache_key] = {
-                    'audio_data': audio_data,
-                    'timestamp': time.time()
-                }
-                
-                # Clean memory cache if too large
-                if len(memory_cache) > MEMORY_CACHE_SIZE:
-                    # Remove oldest entries (more aggressive cleanup)
-                    keys_by_age = sorted(memory_cache.keys(), key=lambda k: memory_cache[k]['timestamp'])
-                    for old_key in keys_by_age[:max(1, len(keys_by_age)//10)]:  # Remove ~10% of oldest entries
-                        del memory_cache[old_key]
-            
-            # Report timing
-            processing_time = time.time() - start_time
-            logger.debug(f"TTS conversion completed in {processing_time:.2f}s, audio size: {len(audio_data)} bytes")
-            
-            return audio_data
+        # Report timing
+        processing_time = time.time() - start_time
+        logger.debug(f"TTS conversion completed in {processing_time:.2f}s, audio size: {len(audio_data)} bytes")
+        
+        return audio_data
     
     except Exception as e:
         logger.error(f"TTS conversion failed: {str(e)}", exc_info=True)
         raise
+
+def text_to_speech_rendition(text, voice="default", speed=1.0, encoding=MASTER_ENCODING, sample_rate=MASTER_SAMPLE_RATE):
+    """
+    Convert text to speech in a specific output encoding and sample rate.
+    
+    Every rendition is transcoded locally from the canonical f32/44.1 kHz master, so
+    Cartesia is called at most once per text/voice/speed. Renditions are cached under
+    their own keys in both cache tiers.
+    
+    Args:
+        text (str): The text to convert to speech.
+        voice (str): The voice to use ("default", "male", or "female").
+        speed (float): The speed of speech (0.5 to 2.0).
+        encoding (str): "pcm_f32le", "pcm_s16le" or "pcm_mulaw".
+        sample_rate (int): 16000, 22050, 24000 or 44100.
+        
+    Returns:
+        bytes: The WAV file in the requested format.
+    """
+    cache_key = rendition_cache_key(text, voice, speed, encoding, sample_rate)
+    if encoding == MASTER_ENCODING and sample_rate == MASTER_SAMPLE_RATE:
+        return text_to_speech(text, voice, speed, False)
+    record_tts_access(cache_key, text, voice, speed, encoding, sample_rate)
+    
+    cached_audio = memory_cache.get(cache_key)
+    if cached_audio is not None:
+        logger.debug(f"Found in-memory cached {encoding}/{sample_rate} rendition for: {text[:20]}...")
+        return cached_audio
+    
+    audio_data = disk_cache.read(cache_key)
+    if audio_data is not None:
+        logger.debug(f"Found cached {encoding}/{sample_rate} rendition file for: {text[:20]}...")
+        memory_cache.set(cache_key, audio_data)
+        return audio_data
+    
+    try:
+        return tts_flight.do(cache_key, _render_from_master, text, voice, speed, encoding, sample_rate, cache_key)
+    except Exception:
+        audio_data = cached_in_other_voice(text, voice, speed, encoding, sample_rate)
+        if audio_data is None:
+            raise
+        return audio_data
+
+def _render_from_master(text, voice, speed, encoding, sample_rate, cache_key):
+    """Transcode the (possibly freshly synthesized) master and cache the rendition."""
+    # No voice fallback here: the rendition is cached under the requested voice's key
+    master = text_to_speech(text, voice, speed, False, fallback=False)
+    start_time = time.time()
+    audio_data = transcode_wav(master, encoding, sample_rate)
+    logger.debug(f"Transcoded {len(master)} byte master to {encoding}/{sample_rate}: "
+                 f"{len(audio_data)} bytes in {time.time() - start_time:.3f}s")
+    disk_cache.write(cache_key, audio_data)
+    memory_cache.set(cache_key, audio_data)
+    return audio_data
+
+async def _request_audio_async(text, selected_voice, speed_setting, timeout):
+    """Async twin of _request_audio; a losing hedge is cancelled rather than left running."""
+    chunks = [chunk async for chunk in async_client.tts.bytes(
+        model_id="sonic-2",
+        transcript=text,
+        voice={"mode": "id", "id": selected_voice, "experimental_controls": {"speed": speed_setting}},
+        language="en",
+        output_format={"container": "wav", "encoding": MASTER_ENCODING, "sample_rate": MASTER_SAMPLE_RATE},
+        request_options={"timeout_in_seconds": max(1, math.ceil(timeout))}
+    )]
+    return b"".join(chunks)
+
+async def _synthesize_audio_async(text, selected_voice, speed_setting, cache_key):
+    """Async twin of _synthesize_audio using the asyncio Cartesia client."""
+    logger.debug(f"Calling async Cartesia TTS with model_id=sonic-2, voice_id={selected_voice}, speed={speed_setting}")
+    start_time = time.perf_counter()
+    try:
+        audio_data = await cartesia.call_async(_request_audio_async, text, selected_voice, speed_setting)
+    except Overloaded:
+        raise
+    except Exception as e:
+        observe_stage("cartesia", time.perf_counter() - start_time, "error")
+        logger.error(f"Error calling Cartesia TTS API: {e}", exc_info=True)
+        raise Exception(f"TTS API error: {str(e)}")
+    observe_stage("cartesia", time.perf_counter() - start_time, "complete")
+    
+    if not audio_data or len(audio_data) < 100:
+        raise ValueError("Received empty or invalid audio data from TTS API")
+    
+    await asyncio.to_thread(disk_cache.write, cache_key, audio_data)
+    await memory_cache.set_async(cache_key, audio_data)
+    return audio_data
+
+async def text_to_speech_async(text, voice="default", speed=1.0, fallback=True):
+    """
+    Asyncio version of text_to_speech (non-streaming) for the async server.
+    
+    Uses the same cache tiers and keys and the same voice fallback; disk IO runs in
+    worker threads so the event loop only waits on the network.
+    
+    Returns:
+        bytes: The audio data.
+    """
+    validate_tts_request(text, voice, speed)
+    cache_key = tts_cache_key(text, voice, speed)
+    await asyncio.to_thread(record_tts_access, cache_key, text, voice, speed)
+    
+    cached_audio = await memory_cache.get_async(cache_key)
+    if cached_audio is not None:
+        return cached_audio
+    
+    audio_data = await asyncio.to_thread(disk_cache.read, cache_key)
+    if audio_data is not None:
+        await memory_cache.set_async(cache_key, audio_data)
+        return audio_data
+    
+    selected_voice, speed_setting = resolve_voice_settings(voice, speed)
+    segments = split_segments(text) if SEGMENT_CACHE_ENABLED else []
+    try:
+        if len(segments) > 1:
+            return await tts_async_flight.do(cache_key, _synthesize_segmented_async, segments, voice, speed, cache_key)
+        return await tts_async_flight.do(cache_key, _synthesize_audio_async, text, selected_voice, speed_setting, cache_key)
+    except Exception:
+        audio_data = await asyncio.to_thread(cached_in_other_voice, text, voice, speed) if fallback else None
+        if audio_data is None:
+            raise
+        return audio_data
+
+async def _synthesize_segmented_async(segments, voice, speed, cache_key):
+    """Async twin of _synthesize_segmented: missing sentences are awaited concurrently."""
+    async def segment(sentence):
+        segment_key = segment_cache_key(sentence, voice, speed)
+        await asyncio.to_thread(record_access, "tts", segment_key, {"segment": sentence, "voice": voice, "speed": speed})
+        audio_data = await memory_cache.get_async(segment_key)
+        if audio_data is None:
+            audio_data = await asyncio.to_thread(disk_cache.read, segment_key)
+        if audio_data is None:
+            selected_voice, speed_setting = resolve_voice_settings(voice, speed)
+            return await tts_async_flight.do(segment_key, _synthesize_audio_async, sentence,
+                                             selected_voice, speed_setting, segment_key)
+        await memory_cache.set_async(segment_key, audio_data)
+        return audio_data
+    
+    # Repeated sentences share one lookup
+    unique = list(dict.fromkeys(segments))
+    audio_by_sentence = dict(zip(unique, await asyncio.gather(*(segment(sentence) for sentence in unique))))
+    return await asyncio.to_thread(_cache_joined_audio, [audio_by_sentence[sentence] for sentence in segments], cache_key)
+
+async def text_to_speech_rendition_async(text, voice="default", speed=1.0, encoding=MASTER_ENCODING, sample_rate=MASTER_SAMPLE_RATE):
+    """Asyncio version of text_to_speech_rendition; transcoding runs in a worker thread."""
+    if encoding == MASTER_ENCODING and sample_rate == MASTER_SAMPLE_RATE:
+        return await text_to_speech_async(text, voice, speed)
+    
+    cache_key = rendition_cache_key(text, voice, speed, encoding, sample_rate)
+    await asyncio.to_thread(record_tts_access, cache_key, text, voice, speed, encoding, sample_rate)
+    cached_audio = await memory_cache.get_async(cache_key)
+    if cached_audio is not None:
+        return cached_audio
+    
+    audio_data = await asyncio.to_thread(disk_cache.read, cache_key)
+    if audio_data is not None:
+        await memory_cache.set_async(cache_key, audio_data)
+        return audio_data
+    
+    async def render():
+        master = await text_to_speech_async(text, voice, speed, fallback=False)
+        audio_data = await asyncio.to_thread(transcode_wav, master, encoding, sample_rate)
+        await asyncio.to_thread(disk_cache.write, cache_key, audio_data)
+        await memory_cache.set_async(cache_key, audio_data)
+        return audio_data
+    
+    try:
+        return await tts_async_flight.do(cache_key, render)
+    except Exception:
+        audio_data = await asyncio.to_thread(cached_in_other_voice, text, voice, speed, encoding, sample_rate)
+        if audio_data is None:
+            raise
+        return audio_data
+
+# Sentence boundary: terminal punctuation (optionally followed by closing quotes/brackets) then whitespace
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+["\')\]]*\s+')
+MIN_SENTENCE_LENGTH = 20  # Merge very short fragments so each Cartesia call is worth its overhead
+PIPELINE_PUT_INTERVAL = 0.5  # Seconds between checks for a disconnected consumer while the queue is full
+
+def split_sentences_incremental(text_chunks):
+    """
+    Split a stream of text chunks into sentences as soon as each one is complete.
+    
+    Args:
+        text_chunks (iterable): Text fragments in arrival order (e.g. streamed LLM output).
+        
+    Yields:
+        str: Complete sentences; whatever remains at the end of the stream is flushed last.
+    """
+    buffer = ""
+    for chunk in text_chunks:
+        if not chunk:
+            continue
+        buffer += chunk
+        
+        # Emit every complete sentence, keeping the trailing fragment buffered
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(buffer):
+            if match.end() - start < MIN_SENTENCE_LENGTH:
+                continue
+            sentence = buffer[start:match.end()].strip()
+            if sentence:
+                yield sentence
+            start = match.end()
+        buffer = buffer[start:]
+    
+    if buffer.strip():
+        yield buffer.strip()
+
+def pipelined_text_to_speech(text_chunks, voice="default", speed=1.0, max_pending=4):
+    """
+    Synthesize streamed text sentence by sentence, overlapping generation with TTS.
+    
+    Sentences are cut from text_chunks as they arrive and submitted to the executor
+    immediately, so Cartesia works on sentence N while the LLM is still producing
+    sentence N+1. Audio is emitted strictly in order as one continuous WAV stream.
+    If the consumer stops early (e.g. the client disconnects), the producer thread
+    exits, sentences not yet synthesizing are cancelled and text_chunks is closed.
+    
+    Args:
+        text_chunks (iterable): Text fragments, e.g. a streamed Gemini reply.
+        voice (str): The voice to use ("default", "male", or "female").
+        speed (float): The speed of speech (0.5 to 2.0).
+        max_pending (int): Maximum sentences synthesizing ahead of playback.
+        
+    Yields:
+        bytes: A WAV header followed by PCM data for each sentence in order.
+    """
+    pending = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()  # Set once the consumer is gone
+    
+    def offer(item):
+        # Bounded put that gives up, cancelling the item, once nobody will take it
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=PIPELINE_PUT_INTERVAL)
+            except queue.Full:
+                continue
+            if not stop.is_set():
+                return True
+            break
+        if isinstance(item, Future):
+            item.cancel()
+        return False
+    
+    def produce():
+        # Runs on its own thread so a slow LLM stream never blocks emitting finished audio
+        try:
+            for sentence in split_sentences_incremental(text_chunks):
+                logger.debug(f"Pipelined TTS sentence: {sentence[:50]}...")
+                if SEGMENT_CACHE_ENABLED:
+                    # Sentences spoken before come straight from the segment cache
+                    future = executor.submit(synthesize_segment, " ".join(sentence.split()), voice, speed)
+                else:
+                    future = executor.submit(text_to_speech, sentence, voice, speed, False)
+                if not offer(future):
+                    break
+        except Exception as e:
+            logger.error(f"Pipelined TTS text stream failed: {e}", exc_info=True)
+            offer(e)
+        finally:
+            offer(None)
+            if stop.is_set() and hasattr(text_chunks, "close"):
+                # Stop the upstream (e.g. Gemini) stream nobody is listening to any more
+                text_chunks.close()
+    
+    threading.Thread(target=produce, daemon=True).start()
+    
+    start_time = time.time()
+    header_sent = False
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            fmt_chunk, pcm = parse_wav(item.result(timeout=15))
+            if not header_sent:
+                logger.debug(f"Pipelined TTS first audio after {time.time() - start_time:.2f}s")
+                yield streaming_wav_header(fmt_chunk)
+                header_sent = True
+            yield pcm
+    finally:
+        stop.set()
+        # Cancel sentences that have not started synthesizing
+        while True:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, Future):
+                item.cancel()
+
 # Add a cleanup function that can be called by app.py
 def cleanup_old_cache_files(max_age_seconds=86400):  # Default to 24 hours
-    """Clean up old cache files"""
+    """Clean up cache files not accessed within max_age_seconds (the byte quota is enforced on write)"""
     try:
         logger.debug("Cleaning up old TTS cache files")
-        current_time = time.time()
-        cleaned_files = 0
-        
-        for filename in os.listdir(cache_dir):
-            if filename.endswith('.wav'):
-                file_path = os.path.join(cache_dir, filename)
-                if os.path.getmtime(file_path) < current_time - max_age_seconds:
-                    os.remove(file_path)
-                    cleaned_files += 1
+        cleaned_files = disk_cache.remove_idle(max_age_seconds)
         
         logger.info(f"Cleaned up {cleaned_files} old TTS cache files")
     except Exception as e:
         logger.error(f"Error cleaning TTS cache: {e}", exc_info=True)
-
-# Add warmup function to preload common voices
-def warmup_tts_engine():
-    """Warm up the TTS engine by generating a short audio sample for each voice"""
-    try:
-        logger.debug("Warming up TTS engine...")
-        test_text = "Hello, this is a test."
-        
-        for voice in VOICE_MAPPING.keys():
-            cache_key = hashlib.md5(f"{test_text}:{voice}:1.0".encode()).hexdigest()
-            cache_path = os.path.join(cache_dir, f"{cache_key}.wav")
-            
-            # Only generate if not already cached
-            if not os.path.exists(cache_path):
-                logger.debug(f"Warming up voice: {voice}")
-                # Use a future to avoid blocking
-                future = executor.submit(text_to_speech, test_text, voice, 1.0)
-                # Don't wait for the result
-        
-        logger.debug("TTS engine warmup initiated")
-    except Exception as e:
-        logger.error(f"Error during TTS warmup: {e}", exc_info=True)
\ No newline at end of file
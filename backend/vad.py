@@ -0,0 +1,73 @@
+import logging
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+FRAME_MS = 20
+SPEECH_MARGIN_DB = 12  # Speech must stand this far above the clip's own noise floor
+ABSOLUTE_FLOOR_DBFS = -50  # Anything quieter is silence regardless of the noise floor
+NOISE_PERCENTILE = 10  # Quietest frames estimate the noise floor
+MAX_NOISE_ZCR = 0.45  # Broadband hiss crosses zero about every other sample; voiced speech far less
+MIN_SPEECH_MS = 200  # Less total speech than this (a click, a cough) is treated as no speech
+PAD_MS = 200  # Kept around the speech region so word onsets and endings aren't clipped
+
+
+def frame_features(samples, rate):
+    """
+    Per-frame loudness and zero-crossing rate, computed over whole arrays.
+
+    Args:
+        samples (numpy.ndarray): Audio of shape (frames, channels).
+        rate (int): Sample rate.
+
+    Returns:
+        tuple: (energy in dBFS per frame, zero-crossing rate per frame, samples per frame)
+    """
+    frame_length = max(1, rate * FRAME_MS // 1000)
+    mono = samples.mean(axis=1)
+    count = len(mono) // frame_length
+    frames = mono[:count * frame_length].reshape(count, frame_length)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    energy_db = 20 * np.log10(np.maximum(rms, 1e-10))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frame_length
+    return energy_db, zcr, frame_length
+
+
+def find_speech(samples, rate):
+    """
+    Locate the speech in a clip with an energy / zero-crossing voice activity detector.
+
+    Frames count as speech when they are well above both the clip's noise floor and an
+    absolute floor, unless they look like broadband noise (high zero-crossing rate and
+    only marginally loud). Clips without enough dynamic range to estimate a floor only
+    get the absolute floor and the noise check, so uncertain clips still go upstream.
+
+    Returns:
+        tuple or None: (start, end) sample indices of the padded speech region, or None
+        if the clip holds no speech.
+    """
+    energy_db, zcr, frame_length = frame_features(samples, rate)
+    if len(energy_db) == 0:
+        return None
+
+    noise_floor = np.percentile(energy_db, NOISE_PERCENTILE)
+    if np.percentile(energy_db, 95) - noise_floor < SPEECH_MARGIN_DB:
+        # Stationary clip: steady noise, or speech without pauses that sets its own "floor".
+        # Fail open on anything loud enough that isn't hiss rather than drop real speech
+        threshold = ABSOLUTE_FLOOR_DBFS
+        speech = (energy_db > threshold) & (zcr < MAX_NOISE_ZCR)
+    else:
+        threshold = max(noise_floor + SPEECH_MARGIN_DB, ABSOLUTE_FLOOR_DBFS)
+        speech = (energy_db > threshold) & ((zcr < MAX_NOISE_ZCR) | (energy_db > threshold + SPEECH_MARGIN_DB))
+
+    speech_frames = np.flatnonzero(speech)
+    if len(speech_frames) * FRAME_MS < MIN_SPEECH_MS:
+        logger.debug(f"VAD: {len(speech_frames) * FRAME_MS} ms of speech above {threshold:.1f} dBFS, rejecting clip")
+        return None
+
+    pad = rate * PAD_MS // 1000
+    start = max(0, speech_frames[0] * frame_length - pad)
+    end = min(len(samples), (speech_frames[-1] + 1) * frame_length + pad)
+    return int(start), int(end)
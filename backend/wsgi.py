@@ -1,10 +1,18 @@
 from app import app
+from prewarm import start_prewarming
+from providers import warm_upstreams
 from waitress import serve
 
 if __name__ == "__main__":
     print("Starting production server...")
     print("Server running on http://0.0.0.0:5000")
     
+    # Open upstream connections now so the first requests don't pay for TCP/TLS setup
+    warm_upstreams()
+    
+    # Refill the memory caches with what was popular before the restart
+    start_prewarming()
+    
     # Increase threads for handling multiple concurrent connections
     # Adjust timeout values as needed
     serve(